@@ -0,0 +1,215 @@
+"""
+Versioned JSON API with batch endpoints for the four inference tasks
+Every endpoint takes a list of items and answers with one result per item, in
+order: {"index": i, "ok": true, ...} or {"index": i, "ok": false, "error": "..."},
+so one bad input does not fail the rest of the batch. A malformed request as a
+whole (no items, too many items, bad options) is a 400. Each endpoint imports its
+model module on first use.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify, url_for
+from modules.style_transfer_jobs import style_jobs, submit_style_transfer
+from utils.file_handling import allowed_file
+from utils.jobs import QueueFull
+
+logger = logging.getLogger(__name__)
+
+# Most items accepted in one batch request
+API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', '64'))
+# Audio files of one transcription batch recognized at once (each also recognizes its chunks concurrently)
+API_TRANSCRIBE_WORKERS = int(os.environ.get('API_TRANSCRIBE_WORKERS', '2'))
+
+AUDIO_EXTENSIONS = {'wav', 'mp3', 'ogg'}
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+MAX_GENERATION_LENGTH = 500
+
+api = Blueprint('api_v1', __name__)
+
+
+class BadRequest(Exception):
+    """The request as a whole is invalid; answered with a 400 and the message"""
+
+
+@api.errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify({'error': str(e)}), 400
+
+
+def _results(items):
+    """Number per-item dicts from the model paths into the API result format"""
+    results = [{'index': index, 'ok': 'error' not in item, **item} for index, item in enumerate(items)]
+    return jsonify({'results': results})
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise BadRequest("Expected a JSON object body")
+    return body
+
+
+def _batch(items, name):
+    if not isinstance(items, list) or not items:
+        raise BadRequest(f"'{name}' must be a non-empty list")
+    if len(items) > API_MAX_BATCH:
+        raise BadRequest(f"At most {API_MAX_BATCH} {name} per request")
+    return items
+
+
+def _option(body, name, kind, default, minimum=None, maximum=None):
+    value = body.get(name, default)
+    if value is None:
+        return None
+    try:
+        value = kind(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"'{name}' must be a {kind.__name__}")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise BadRequest(f"'{name}' is out of range")
+    return value
+
+
+def _quality(body, tiers):
+    quality = body.get('quality')
+    if quality is not None and quality not in tiers:
+        raise BadRequest(f"'quality' must be one of {', '.join(tiers)}")
+    return quality
+
+
+@api.route('/summarize', methods=['POST'])
+def summarize():
+    # {"texts": [...], "max_length", "min_length", "quality", "deadline_seconds"}
+    from modules.summarization import summarize_texts, QUALITY_TIERS as SUMMARY_TIERS
+
+    body = _json_body()
+    texts = _batch(body.get('texts'), 'texts')
+    max_length = _option(body, 'max_length', int, 150, minimum=1)
+    min_length = _option(body, 'min_length', int, 30, minimum=0, maximum=max_length)
+    quality = _quality(body, SUMMARY_TIERS)
+    deadline_seconds = _option(body, 'deadline_seconds', float, None, minimum=0)
+
+    # Short texts share padded generate calls; long ones go through map-reduce
+    return _results(summarize_texts(texts, max_length, min_length, quality=quality,
+                                    deadline_seconds=deadline_seconds))
+
+
+@api.route('/generate', methods=['POST'])
+def generate():
+    # {"prompts": [...], "length", "temperature", "top_k", "top_p", "seed", "quality", "deadline_seconds"}
+    from modules.text_generation import generate_texts, QUALITY_TIERS as GENERATION_TIERS
+
+    body = _json_body()
+    prompts = _batch(body.get('prompts'), 'prompts')
+    length = _option(body, 'length', int, 100, minimum=1, maximum=MAX_GENERATION_LENGTH)
+    temperature = _option(body, 'temperature', float, 0.7, minimum=0.01)
+    # 0 turns top-k filtering off, and top_p 1.0 top-p filtering
+    top_k = _option(body, 'top_k', int, 50, minimum=0)
+    top_p = _option(body, 'top_p', float, 0.95, minimum=0.0, maximum=1.0)
+    seed = _option(body, 'seed', int, None)
+    quality = _quality(body, GENERATION_TIERS)
+    deadline_seconds = _option(body, 'deadline_seconds', float, None, minimum=0)
+
+    # Prompts are left-padded and sampled together
+    return _results(generate_texts(prompts, length, temperature, top_k, top_p, seed=seed,
+                                   quality=quality, deadline_seconds=deadline_seconds))
+
+
+@api.route('/transcribe', methods=['POST'])
+def transcribe():
+    # multipart: one or more "audio" files, optional "language" field
+    from modules.speech_recognition import transcribe_pcm
+    from utils.audio_processing import decode_audio_stream
+
+    files = _batch(request.files.getlist('audio'), 'audio files')
+    language = request.form.get('language', 'en-US')
+
+    # Decode every upload first: the request streams are only readable on this thread
+    items = []
+    for audio_file in files:
+        if not allowed_file(audio_file.filename, AUDIO_EXTENSIONS):
+            items.append({'error': f"Invalid file type. Please upload {', '.join(sorted(AUDIO_EXTENSIONS))} audio files."})
+            continue
+        try:
+            items.append({'pcm': decode_audio_stream(audio_file.stream), 'filename': audio_file.filename})
+        except Exception as e:
+            logger.error(f"Error decoding {audio_file.filename}: {e}")
+            items.append({'error': f"Error processing audio file: {e}"})
+
+    def run(item):
+        if 'error' in item:
+            return item
+        with item['pcm'] as pcm:
+            try:
+                return {'filename': item['filename'], 'duration': pcm.duration,
+                        'transcript': transcribe_pcm(pcm, language)}
+            except Exception as e:
+                logger.error(f"Transcription of {item['filename']} failed: {e}")
+                return {'filename': item['filename'], 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=API_TRANSCRIBE_WORKERS) as executor:
+        return _results(list(executor.map(run, items)))
+
+
+@api.route('/style-transfer', methods=['POST'])
+def style_transfer():
+    # multipart: one or more "content" images and either one "style" image for all of them
+    # or one "style" image per content image
+    contents = _batch(request.files.getlist('content'), 'content images')
+    styles = request.files.getlist('style')
+    if len(styles) == 1:
+        styles = styles * len(contents)
+    elif len(styles) != len(contents):
+        raise BadRequest("Send one 'style' image, or one per 'content' image")
+
+    items = []
+    for content_file, style_file in zip(contents, styles):
+        if not (allowed_file(content_file.filename, IMAGE_EXTENSIONS)
+                and allowed_file(style_file.filename, IMAGE_EXTENSIONS)):
+            items.append({'error': f"Invalid file type. Please upload {', '.join(sorted(IMAGE_EXTENSIONS))} images."})
+            continue
+        try:
+            # A shared style image is read once per pair
+            style_file.stream.seek(0)
+            submission = submit_style_transfer(content_file.stream, content_file.filename.rsplit('.', 1)[-1],
+                                               style_file.stream, style_file.filename.rsplit('.', 1)[-1])
+        except QueueFull:
+            items.append({'error': "The style transfer queue is full. Please try again later."})
+            continue
+        except Exception as e:
+            logger.error(f"Style transfer submission failed: {e}")
+            items.append({'error': str(e)})
+            continue
+
+        item = {'content_url': url_for('static', filename=submission['content_image']),
+                'style_url': url_for('static', filename=submission['style_image'])}
+        if submission['output_image']:
+            item['status'] = 'done'
+            item['output_url'] = url_for('static', filename=submission['output_image'])
+        else:
+            item['job_id'] = submission['job'].id
+            item['status'] = submission['job'].status
+            item['status_url'] = url_for('api_v1.job_status', job_id=submission['job'].id)
+        items.append(item)
+    return _results(items)
+
+
+@api.route('/jobs/<job_id>')
+def job_status(job_id):
+    # Status, progress and (once done) the output of a style transfer job
+    job = style_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    status = job.to_dict()
+    if job.result:
+        status['output_url'] = url_for('static', filename=job.result['output_image'])
+    return jsonify(status)
+
+
+@api.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    job = style_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
@@ -1,17 +1,24 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context, g
 from werkzeug.utils import secure_filename # This should now be correctly imported from werkzeug.utils
 from werkzeug.utils import secure_filename
 from flask_uploads import UploadSet, configure_uploads
 IMAGES = ('jpg', 'jpeg', 'png', 'gif')
 AUDIO = ('wav', 'mp3', 'ogg')
 import os
-from modules.summarization import summarize_text
-from modules.speech_recognition import transcribe_audio
-from modules.neural_style_transfer import perform_style_transfer
-from modules.text_generation import generate_text
+import json
+import time
+from contextlib import closing
+from api import api
+from modules import serving
+from modules.style_transfer_jobs import style_jobs, start_sweepers, submit_style_transfer
 # Note: save_uploaded_file from utils.file_handling seems unused in the provided routes, but keeping the import
 from utils.file_handling import allowed_file
-import uuid
+from utils.jobs import QueueFull
+from utils.result_cache import result_cache
+from utils import metrics
+# The model modules (and with them torch, torchvision and transformers) are imported
+# inside the routes that use them, so the app starts and answers health checks in
+# well under a second. gunicorn.conf.py still loads them in the master before forking.
 
 app = Flask(__name__)
 # IMPORTANT: Change 'your-secret-key-here' to a strong, unique, random value in production!
@@ -32,6 +39,66 @@ audios = UploadSet('audios', AUDIO)
 images = UploadSet('images', IMAGES)
 configure_uploads(app, (audios, images))
 
+# Versioned JSON batch API
+app.register_blueprint(api, url_prefix='/api/v1')
+
+
+@app.before_request
+def start_upload_sweepers():
+    # Started on the first request of each process, so forked workers get their own thread
+    start_sweepers()
+
+
+@app.before_request
+def start_request_trace():
+    # Pipeline stages timed while this request is handled are collected into its trace
+    g.trace, g.trace_token = metrics.start_trace(f"{request.method} {request.path}")
+
+
+@app.after_request
+def record_request_metrics(response):
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    # Route templates rather than paths, so job IDs do not become separate series
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    trace.sample_rss()
+    metrics.metrics.observe('http_request_seconds', time.perf_counter() - trace.started,
+                            endpoint=endpoint, method=request.method)
+    metrics.metrics.inc('http_requests_total', endpoint=endpoint, method=request.method,
+                        status=response.status_code)
+    if trace.peak_rss_bytes is not None:
+        metrics.metrics.observe('request_peak_rss_bytes', trace.peak_rss_bytes, endpoint=endpoint)
+    if metrics.METRICS_TRACE and endpoint != '/metrics':
+        if trace.spans:
+            response.headers['Server-Timing'] = trace.server_timing()
+        app.logger.info(f"Trace: {json.dumps(trace.to_dict())}")
+    metrics.flush()
+    return response
+
+
+@app.teardown_request
+def end_request_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        metrics.end_trace(token)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus text format: stage and request latency histograms, model loads, cache lookups, memory
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is up and answering requests
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: models are loaded and warmed up in this worker
+    status = serving.status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 @app.route('/')
 def index():
@@ -40,15 +107,23 @@ def index():
 
 @app.route('/summarization', methods=['GET', 'POST'])
 def summarization():
+    from modules.summarization import summarize_text, QUALITY_TIERS as SUMMARY_TIERS
+
     if request.method == 'POST':
         text = request.form.get('text')
         # Basic validation for empty input text
         if not text or not text.strip():
              return render_template('summarization.html', error="Please enter text to summarize.")
 
+        quality = request.form.get('quality') or None
+        if quality and quality not in SUMMARY_TIERS:
+            return render_template('summarization.html', original_text=text, error="Unknown quality setting.")
+
         try:
-            summary = summarize_text(text)
-            return render_template('summarization.html', original_text=text, summary=summary)
+            report = {}
+            summary = summarize_text(text, quality=quality, report=report)
+            return render_template('summarization.html', original_text=text, summary=summary,
+                                   quality=report['quality'], truncated=report['truncated'])
         except Exception as e:
             # Catch any errors during summarization
             print(f"Error during summarization: {e}") # Log the error to the terminal
@@ -57,8 +132,22 @@ def summarization():
     # Render the empty summarization form for GET requests
     return render_template('summarization.html')
 
+@app.route('/summarization/stats')
+def summarization_stats():
+    # Queue depth and batch-size statistics of the summarization scheduler
+    from modules.summarization import batcher as summarization_batcher
+    return jsonify(summarization_batcher.stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    # Hit and miss counters of the shared result cache
+    return jsonify(result_cache.stats())
+
 @app.route('/speech-recognition', methods=['GET', 'POST'])
 def speech_recognition():
+    from modules.speech_recognition import transcribe_pcm
+    from utils.audio_processing import decode_audio_stream
+
     if request.method == 'POST':
         if 'audio' not in request.files:
             return render_template('speech.html', error="No audio file selected.")
@@ -70,23 +159,21 @@ def speech_recognition():
 
         if audio_file and allowed_file(audio_file.filename, {'wav', 'mp3', 'ogg'}):
             try:
-                # Generate a secure filename
-                filename = secure_filename(audio_file.filename)
-                unique_filename = f"{uuid.uuid4().hex}_{filename}"
-                filepath = os.path.join(app.config['UPLOADED_AUDIOS_DEST'], unique_filename)
-                
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                
-                # Save the file
-                audio_file.save(filepath)
-                app.logger.info(f"Audio file saved to: {filepath}")
+                # Decode the upload straight into an in-memory PCM buffer; nothing is written
+                # to disk unless the decoded audio exceeds the spill threshold
+                pcm = decode_audio_stream(audio_file.stream)
+                app.logger.info(f"Decoded {audio_file.filename}: {pcm.duration:.2f}s of audio"
+                                f"{' (spilled to a temporary file)' if pcm.spilled else ''}")
+            except Exception as e:
+                app.logger.error(f"Error processing audio file: {str(e)}")
+                return render_template('speech.html', 
+                                     error=f"Error processing audio file: {str(e)}")
 
+            with pcm:
                 try:
-                    transcript = transcribe_audio(filepath)
+                    transcript = transcribe_pcm(pcm)
                     return render_template('speech.html', 
-                                         transcript=transcript,
-                                         audio_file=unique_filename)
+                                         transcript=transcript)
                 except ValueError as e:
                     return render_template('speech.html', 
                                          error=str(e))
@@ -94,15 +181,6 @@ def speech_recognition():
                     app.logger.error(f"Transcription error: {str(e)}")
                     return render_template('speech.html', 
                                          error=f"Transcription failed: {str(e)}")
-                finally:
-                    # Clean up the file after processing
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-            
-            except Exception as e:
-                app.logger.error(f"Error processing audio file: {str(e)}")
-                return render_template('speech.html', 
-                                     error=f"Error processing audio file: {str(e)}")
         
         else:
             return render_template('speech.html', 
@@ -129,61 +207,31 @@ def style_transfer():
         if (content_file and allowed_file(content_file.filename, allowed_image_extensions)) and \
            (style_file and allowed_file(style_file.filename, allowed_image_extensions)):
 
-            # Generate unique filenames using uuid to prevent naming conflicts
-            content_filename = f"content_{uuid.uuid4().hex}.{content_file.filename.split('.')[-1].lower()}"
-            style_filename = f"style_{uuid.uuid4().hex}.{style_file.filename.split('.')[-1].lower()}"
-
-            # Define file paths using the configured image upload destination
-            content_path = os.path.join(app.config['UPLOADED_IMAGES_DEST'], content_filename)
-            style_path = os.path.join(app.config['UPLOADED_IMAGES_DEST'], style_filename)
-
-            # Define the intended output path for the styled image
-            # Output is saved in the 'outputs' subdirectory of the main upload folder
-            output_filename = f"output_{uuid.uuid4().hex}.jpg" # Output as JPG is common
-            output_path = os.path.join(app.config['UPLOAD_FOLDER'], 'outputs', output_filename)
+            content_ext = content_file.filename.rsplit('.', 1)[-1]
+            style_ext = style_file.filename.rsplit('.', 1)[-1]
 
             try:
-                # Save the uploaded content and style files to the server
-                content_file.save(content_path)
-                style_file.save(style_path)
-
-                # Perform style transfer using the module function
-                # The function is expected to save the result to output_path
-                # It returns a tuple: (success_status, message_or_path)
-                success, result_info = perform_style_transfer(content_path, style_path, output_path)
-
-                # Clean up uploaded files immediately if not needed after processing (optional)
-                # os.remove(content_path)
-                # os.remove(style_path)
-
-                if success:
-                    # If style transfer was successful
-                    # Pass paths relative to 'static' for the template to display images
-                    # These paths are correct for use with url_for('static', filename=...)
-                    output_relative_path = f'uploads/outputs/{output_filename}'
-                    content_relative_path = f'uploads/images/{content_filename}'
-                    style_relative_path = f'uploads/images/{style_filename}'
-
-                    # Render the style_transfer.html template with input and output images
+                # Store both images and queue the transfer, unless the pair was already stylized
+                submission = submit_style_transfer(content_file.stream, content_ext,
+                                                   style_file.stream, style_ext)
+                if submission['output_image']:
                     return render_template('style_transfer.html',
-                                           content_image=content_relative_path,
-                                           style_image=style_relative_path,
-                                           output_image=output_relative_path) # Pass the correct relative path
-
-
-                else:
-                    # If style transfer failed (error reported by perform_style_transfer)
-                    error_message = result_info # The function returned the error message
-                    print(f"Style transfer failed: {error_message}") # Log the error
-                    return render_template('style_transfer.html', error=f"Style transfer failed: {error_message}")
-
-
+                                           output_image=submission['output_image'],
+                                           content_image=submission['content_image'],
+                                           style_image=submission['style_image'])
+
+                # The page polls the job for progress and the result
+                return render_template('style_transfer.html',
+                                       job_id=submission['job'].id,
+                                       content_image=submission['content_image'],
+                                       style_image=submission['style_image'])
+
+            except QueueFull:
+                return render_template('style_transfer.html', error="The style transfer queue is full. Please try again later.")
             except Exception as e:
-                 # Catch any unexpected errors during file saving or function call
+                 # Catch any unexpected errors during file saving or job submission
+                 # Stored uploads may be shared with other requests, so they are left for the sweeper
                  print(f"An unexpected error occurred during style transfer process: {e}") # Log the error
-                 # Clean up potentially saved files if an error occurs (optional)
-                 if os.path.exists(content_path): os.remove(content_path)
-                 if os.path.exists(style_path): os.remove(style_path)
                  return render_template('style_transfer.html', error=f"An unexpected error occurred: {e}")
         else:
             # If file type is not allowed for either content or style image
@@ -192,38 +240,76 @@ def style_transfer():
     # Render the empty style transfer form for GET requests
     return render_template('style_transfer.html')
 
+@app.route('/style-transfer/jobs/<job_id>')
+def style_transfer_status(job_id):
+    # Report the status, current step and loss of a style transfer job
+    job = style_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    status = job.to_dict()
+    if job.result:
+        status['output_url'] = url_for('static', filename=job.result['output_image'])
+    return jsonify(status)
+
+@app.route('/style-transfer/jobs/<job_id>/cancel', methods=['POST'])
+def style_transfer_cancel(job_id):
+    job = style_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+
+def parse_generation_form(form):
+    """
+    Validate the prompt, length and quality fields of a text generation form
+    Returns (prompt, length, quality, error_message); quality is None for the default tier
+    """
+    from modules.text_generation import QUALITY_TIERS as GENERATION_TIERS
+
+    prompt = form.get('prompt')
+    quality = form.get('quality') or None
+    # Get length, default to 100 if not provided
+    length_str = form.get('length', '100')
+
+    # Basic validation for empty prompt
+    if not prompt or not prompt.strip():
+        return prompt, None, quality, "Please enter a prompt for text generation."
+
+    # Validate and convert length to integer
+    try:
+        length = int(length_str)
+    except ValueError:
+        # Handle case where length is not a valid integer
+        return prompt, None, quality, "Invalid length provided. Please enter a number."
+
+    # Ensure length is a positive number
+    if length <= 0:
+        return prompt, None, quality, "Length must be a positive number."
+    # Optional: Set a maximum length to prevent excessive computation
+    max_length = 500 # Example max length
+    if length > max_length:
+        return prompt, None, quality, f"Length exceeds maximum allowed ({max_length})."
+    if quality and quality not in GENERATION_TIERS:
+        return prompt, None, None, "Unknown quality setting."
+
+    return prompt, length, quality, None
 
 @app.route('/text-generation', methods=['GET', 'POST'])
 def text_generation():
-    if request.method == 'POST':
-        prompt = request.form.get('prompt')
-        # Get length, default to 100 if not provided
-        length_str = request.form.get('length', '100')
-
-        # Basic validation for empty prompt
-        if not prompt or not prompt.strip():
-             return render_template('generation.html', error="Please enter a prompt for text generation.")
+    from modules.text_generation import generate_text
 
-        # Validate and convert length to integer
-        try:
-            length = int(length_str)
-            # Ensure length is a positive number
-            if length <= 0:
-                 return render_template('generation.html', error="Length must be a positive number.")
-            # Optional: Set a maximum length to prevent excessive computation
-            max_length = 500 # Example max length
-            if length > max_length:
-                 return render_template('generation.html', error=f"Length exceeds maximum allowed ({max_length}).")
-
-        except ValueError:
-            # Handle case where length is not a valid integer
-            return render_template('generation.html', error="Invalid length provided. Please enter a number.")
+    if request.method == 'POST':
+        prompt, length, quality, error = parse_generation_form(request.form)
+        if error:
+            return render_template('generation.html', prompt=prompt, error=error)
 
         try:
             # Generate text using the module function
-            generated_text = generate_text(prompt, length)
+            report = {}
+            generated_text = generate_text(prompt, length, quality=quality, report=report)
             # Render the generation.html template with the result
-            return render_template('generation.html', prompt=prompt, generated_text=generated_text)
+            return render_template('generation.html', prompt=prompt, generated_text=generated_text,
+                                   quality=report['quality'], truncated=report['truncated'])
         except Exception as e:
             # Catch any errors during text generation
             print(f"Error during text generation: {e}") # Log the error
@@ -233,6 +319,36 @@ def text_generation():
     # Render the empty text generation form for GET requests
     return render_template('generation.html')
 
+@app.route('/text-generation/stream', methods=['POST'])
+def text_generation_stream():
+    # Streams generated text as Server-Sent Events; generation stops when the client disconnects
+    from modules.text_generation import stream_text
+
+    prompt, length, quality, error = parse_generation_form(request.form)
+    if error:
+        return jsonify({'error': error}), 400
+
+    def events():
+        produced = 0
+        report = {}
+        try:
+            with closing(stream_text(prompt, length, quality=quality, report=report)) as fragments:
+                for fragment in fragments:
+                    if produced == 0:
+                        app.logger.info(f"Time to first token: {report['ttft_seconds']:.3f}s")
+                    produced += 1
+                    yield f"data: {json.dumps({'text': fragment})}\n\n"
+            yield f"event: done\ndata: {json.dumps({'truncated': report.get('truncated', False)})}\n\n"
+        except GeneratorExit:
+            app.logger.info(f"Client disconnected after {produced} fragments; generation stopped")
+            raise
+        except Exception as e:
+            app.logger.error(f"Error during streaming text generation: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 # This block ensures the upload directories are created when the script is run directly
 if __name__ == '__main__':
@@ -249,6 +365,9 @@ if __name__ == '__main__':
     os.makedirs(outputs_dir, exist_ok=True) # Ensure the outputs folder also exists
 
 
+    # The development server loads models lazily on first use instead of warming up
+    serving.mark_ready()
+
     # Run the Flask development server
     # debug=True provides helpful error pages and reloads the server on code changes
     app.run(debug=True)
@@ -0,0 +1,191 @@
+# benchmarks/fixtures.py
+"""
+Offline inputs for the benchmark suite
+Small randomly initialized BART, GPT-2 and VGG models are registered in the model
+registry under the names the modules load, so nothing is downloaded. Text, audio
+and (when static/uploads has none) images are generated from fixed seeds, so every
+run sees the same inputs and the same weights.
+"""
+import glob
+import os
+import random
+import wave
+import numpy as np
+import torch
+import torch.nn as nn
+from utils.model_registry import registry
+from utils.precision import apply_precision
+
+SEED = 1234
+
+WORDS = (
+    "city council voted plan expand bus network northern suburbs routes weekday frequency officials "
+    "expansion regional transport grant fares construction shelters spring researchers university "
+    "battery charges minutes design anode silicon structure laboratory tests cells capacity cycles "
+    "team manufacturer scooters delivery vans heavy rain flooding valley weekend roads schools crews "
+    "residents river forecasters weather water levels runoff hills museum renovation gallery space "
+    "wing collection paintings hall exhibitions children hours bakery bread competition year sourdough "
+    "flour mill judges crust flavour owners prize money apprentices shop town centre"
+).split()
+FILLER = "the a of to in and for with on at by from that this was were will would has have".split()
+
+SAMPLE_IMAGES = os.path.join('static', 'uploads')
+
+
+def sentence(rng, min_words=8, max_words=20):
+    words = [rng.choice(WORDS) if rng.random() < 0.6 else rng.choice(FILLER)
+             for _ in range(rng.randint(min_words, max_words))]
+    return words[0].capitalize() + ' ' + ' '.join(words[1:]) + '.'
+
+
+def synthetic_document(num_sentences, seed=SEED):
+    """A news-like document of num_sentences sentences, the same for the same seed"""
+    rng = random.Random(seed * 1000003 + num_sentences)
+    return ' '.join(sentence(rng) for _ in range(num_sentences))
+
+
+def synthetic_prompt(seed=SEED):
+    return sentence(random.Random(seed), 6, 10)
+
+
+def _tokenizer_corpus():
+    rng = random.Random(SEED)
+    return [' '.join(sentence(rng) for _ in range(5)) for _ in range(400)]
+
+
+def build_tokenizer(kind):
+    """Byte-level BPE tokenizer trained on the synthetic corpus; 'bart' adds <s> ... </s> around inputs"""
+    from tokenizers import ByteLevelBPETokenizer
+    from tokenizers.processors import TemplateProcessing
+    from transformers import PreTrainedTokenizerFast
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(_tokenizer_corpus(), vocab_size=1000, min_frequency=2, show_progress=False,
+                            special_tokens=["<s>", "<pad>", "</s>", "<unk>"])
+    if kind == 'bart':
+        bpe._tokenizer.post_processor = TemplateProcessing(
+            single="<s> $A </s>", special_tokens=[("<s>", 0), ("</s>", 2)])
+        return PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, bos_token="<s>", eos_token="</s>",
+                                       pad_token="<pad>", unk_token="<unk>")
+    return PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, bos_token="</s>", eos_token="</s>",
+                                   unk_token="<unk>")
+
+
+def build_bart(tokenizer, d_model=64, layers=2, max_positions=1024):
+    from transformers import BartConfig, BartForConditionalGeneration
+
+    torch.manual_seed(SEED)
+    config = BartConfig(
+        vocab_size=len(tokenizer), d_model=d_model, encoder_layers=layers, decoder_layers=layers,
+        encoder_attention_heads=4, decoder_attention_heads=4, encoder_ffn_dim=4 * d_model,
+        decoder_ffn_dim=4 * d_model, max_position_embeddings=max_positions,
+        pad_token_id=tokenizer.pad_token_id, bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id, decoder_start_token_id=tokenizer.eos_token_id,
+        forced_eos_token_id=tokenizer.eos_token_id,
+    )
+    return BartForConditionalGeneration(config).eval()
+
+
+def build_gpt2(tokenizer, n_embd=64, layers=2, max_positions=1024):
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(SEED)
+    config = GPT2Config(vocab_size=len(tokenizer), n_positions=max_positions, n_embd=n_embd, n_layer=layers,
+                        n_head=4, bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id)
+    return GPT2LMHeadModel(config).eval()
+
+
+def build_vgg(widths=(16, 16, 32, 32, 64)):
+    """VGG-shaped conv/relu/pool stack, as deep as the style transfer loss layers reach"""
+    from modules import neural_style_transfer
+
+    torch.manual_seed(SEED)
+    layers = []
+    channels = 3
+    for i, width in enumerate(widths):
+        layers += [nn.Conv2d(channels, width, 3, padding=1), nn.ReLU(inplace=True)]
+        if i in (1, 3):
+            layers.append(nn.MaxPool2d(2))
+        channels = width
+    return neural_style_transfer.build_feature_extractor(
+        nn.Sequential(*layers),
+        torch.tensor(neural_style_transfer.CNN_NORMALIZATION_MEAN),
+        torch.tensor(neural_style_transfer.CNN_NORMALIZATION_STD),
+        last_layer=f'conv_{len(widths)}',
+    )
+
+
+def register_models(tasks):
+    """Register tiny models under the registry names the modules look up, at their configured precision"""
+    if 'summarization' in tasks:
+        from modules import summarization
+        tokenizer = build_tokenizer('bart')
+        model = apply_precision(build_bart(tokenizer), summarization.PRECISION)
+        registry.register(f"{summarization.model_name}:{summarization.PRECISION}", (tokenizer, model))
+    if 'generation' in tasks or 'streaming' in tasks:
+        from modules import text_generation
+        tokenizer = build_tokenizer('gpt2')
+        model = apply_precision(build_gpt2(tokenizer), text_generation.PRECISION)
+        registry.register(f"{text_generation.model_name}:{text_generation.PRECISION}", (tokenizer, model))
+        draft = apply_precision(build_gpt2(tokenizer, layers=1), text_generation.PRECISION)
+        registry.register(f"{text_generation.draft_model_name}:{text_generation.PRECISION}", draft)
+    if 'style_transfer' in tasks:
+        from modules import neural_style_transfer
+        registry.register(neural_style_transfer.VGG_MODEL_NAME, build_vgg())
+
+
+def write_speech_wav(path, seconds, sample_rate=16000, seed=SEED):
+    """
+    Write speech-like 16-bit mono audio: voiced bursts with a syllable-rate envelope,
+    separated by pauses of low noise, so voice activity detection finds regions
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    audio = rng.normal(0, 30, total)
+    position = 0
+    while position < total:
+        burst = int(rng.uniform(1.0, 4.0) * sample_rate)
+        end = min(total, position + burst)
+        t = np.arange(end - position) / sample_rate
+        pitch = rng.uniform(100, 220)
+        voiced = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * 4 * t))
+        audio[position:end] += 6000 * voiced * envelope
+        position = end + int(rng.uniform(0.3, 1.2) * sample_rate)
+    samples = np.clip(audio, -32768, 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return path
+
+
+def _write_synthetic_image(path, size, seed):
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    channels = [np.sin(2 * np.pi * (rng.uniform(1, 4) * x + rng.uniform(1, 4) * y + rng.uniform()))
+                for _ in range(3)]
+    image = ((np.stack(channels, axis=-1) + 1) * 127.5).astype(np.uint8)
+    Image.fromarray(image).save(path)
+    return path
+
+
+def sample_images(work_dir):
+    """
+    (content_path, style_path) from the sample images in static/uploads
+    Files named content_* and style_* are preferred; without two images, two
+    synthetic ones are generated in work_dir instead.
+    """
+    found = sorted(path for pattern in ('*.jpg', '*.jpeg', '*.png')
+                   for path in glob.glob(os.path.join(SAMPLE_IMAGES, '**', pattern), recursive=True))
+    contents = [path for path in found if os.path.basename(path).startswith('content_')]
+    styles = [path for path in found if os.path.basename(path).startswith('style_')]
+    if contents and styles:
+        return contents[0], styles[0]
+    if len(found) >= 2:
+        return found[0], found[1]
+    return (_write_synthetic_image(os.path.join(work_dir, 'content.png'), 256, SEED),
+            _write_synthetic_image(os.path.join(work_dir, 'style.png'), 256, SEED + 1))
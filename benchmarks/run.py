@@ -0,0 +1,389 @@
+# benchmarks/run.py
+"""
+Offline benchmark suite for summarization, generation, speech recognition and style transfer
+Every task runs through its public entry point (summarize_text, generate_text,
+stream_text, transcribe_audio, perform_style_transfer) with tiny random models and
+synthetic inputs from benchmarks.fixtures, at several input sizes. Each case reports
+latency percentiles, throughput and the peak resident memory while it ran, and
+streaming cases the time to first token. Results are
+written as JSON and can be checked against a saved baseline:
+
+    python -m benchmarks.run --output bench.json
+    cp bench.json benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+Exits with status 1 when a case regressed past the thresholds.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import torch
+from benchmarks import fixtures
+from utils.resources import current_rss_bytes, peak_rss_bytes
+
+TASKS = ('summarization', 'generation', 'streaming', 'speech', 'style_transfer')
+
+# Input sizes per task; --quick keeps the first two of each
+SIZES = {
+    'summarization': ('sentences', (5, 40, 160)),
+    'generation': ('tokens', (16, 64, 256)),
+    'streaming': ('tokens', (16, 64, 256)),
+    'speech': ('seconds', (5, 30, 120)),
+    'style_transfer': ('pixels', (64, 128, 256)),
+}
+
+
+class MemorySampler:
+    """Polls this process's RSS on a background thread and keeps the highest value"""
+
+    def __init__(self, interval_seconds=0.005):
+        self.interval_seconds = interval_seconds
+        self.start_rss = None
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._sample()
+
+    def __enter__(self):
+        self.start_rss = current_rss_bytes()
+        self.peak_rss = self.start_rss
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def _reset_caches():
+    # Every timed call does the full work instead of hitting the result cache
+    from utils.result_cache import result_cache
+    result_cache.clear()
+
+
+def _percentiles(values):
+    return {
+        'mean': float(np.mean(values)),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'min': min(values),
+        'max': max(values),
+    }
+
+
+def measure(call, repeats, warmup, unit):
+    """
+    Time call() repeats times after warmup untimed calls
+    call returns how many units (tokens, seconds of audio, ...) it processed, or
+    (units, {name: seconds}) for latencies measured inside the call, such as the
+    time to first token, which are reported as percentiles under their names.
+    """
+    for _ in range(warmup):
+        _reset_caches()
+        call()
+    gc.collect()
+
+    latencies = []
+    inner = {}
+    units = 0
+    with MemorySampler() as memory:
+        for _ in range(repeats):
+            _reset_caches()
+            torch.manual_seed(fixtures.SEED)
+            start = time.perf_counter()
+            result = call()
+            latencies.append(time.perf_counter() - start)
+            if isinstance(result, tuple):
+                result, timings = result
+                for name, seconds in timings.items():
+                    inner.setdefault(name, []).append(seconds)
+            units += result
+
+    total = sum(latencies)
+    return {
+        'repeats': repeats,
+        'latency': _percentiles(latencies),
+        **{name: _percentiles(values) for name, values in inner.items()},
+        'throughput': {
+            'items_per_second': repeats / total,
+            'units_per_second': units / total,
+            'unit': unit,
+        },
+        'peak_rss_bytes': memory.peak_rss,
+        'peak_rss_delta_bytes': (memory.peak_rss - memory.start_rss
+                                 if memory.peak_rss is not None and memory.start_rss is not None else None),
+    }
+
+
+def summarization_cases(sizes, options, work_dir):
+    from modules.summarization import summarize_text
+
+    for sentences in sizes:
+        text = fixtures.synthetic_document(sentences)
+        words = len(text.split())
+
+        def call(text=text, words=words):
+            summarize_text(text, max_length=options.summary_length, min_length=10)
+            return words
+        yield sentences, call, 'words'
+
+
+def generation_cases(sizes, options, work_dir):
+    from modules.text_generation import generate_text
+
+    prompt = fixtures.synthetic_prompt()
+    for length in sizes:
+        def call(length=length):
+            generate_text(prompt, length, seed=fixtures.SEED)
+            return length
+        yield length, call, 'tokens'
+
+
+def streaming_cases(sizes, options, work_dir):
+    from modules.text_generation import stream_text
+
+    prompt = fixtures.synthetic_prompt()
+    for length in sizes:
+        def call(length=length):
+            report = {}
+            for _ in stream_text(prompt, length, report=report):
+                pass
+            return length, {'ttft': report['ttft_seconds']}
+        yield length, call, 'tokens'
+
+
+def speech_cases(sizes, options, work_dir):
+    from modules.recognizer_backends import get_backend
+    from modules.speech_recognition import transcribe_audio
+
+    # Recognition is simulated offline; --speech-latency adds a per-chunk service delay
+    get_backend('stub').latency_seconds = options.speech_latency
+    for seconds in sizes:
+        path = fixtures.write_speech_wav(os.path.join(work_dir, f'speech_{seconds}s.wav'), seconds)
+
+        def call(path=path, seconds=seconds):
+            transcribe_audio(path, backend='stub')
+            return seconds
+        yield seconds, call, 'audio_seconds'
+
+
+def style_transfer_cases(sizes, options, work_dir):
+    from modules.neural_style_transfer import perform_style_transfer
+
+    content_path, style_path = fixtures.sample_images(work_dir)
+    for size in sizes:
+        output_path = os.path.join(work_dir, f'stylized_{size}.jpg')
+
+        def call(size=size, output_path=output_path):
+            report = {}
+            success, result = perform_style_transfer(content_path, style_path, output_path,
+                                                     num_steps=options.style_steps, image_size=size,
+                                                     mode='optimize', pyramid_levels=1, convergence_tol=0,
+                                                     report=report)
+            if not success:
+                raise RuntimeError(result)
+            # The steps the optimizer actually took, which may differ from the requested count
+            return report['total_steps']
+        yield size, call, 'steps'
+
+
+CASES = {
+    'summarization': summarization_cases,
+    'generation': generation_cases,
+    'streaming': streaming_cases,
+    'speech': speech_cases,
+    'style_transfer': style_transfer_cases,
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(splitter):
+    import transformers
+    from modules import summarization, text_generation
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'torch': torch.__version__,
+        'transformers': transformers.__version__,
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'summarization_precision': summarization.PRECISION,
+        'generation_precision': text_generation.PRECISION,
+        'sentence_splitter': splitter,
+        'commit': _git_commit(),
+    }
+
+
+def run(tasks, options):
+    from modules.neural_style_transfer import style_gram_cache
+    from utils.result_cache import result_cache
+    from utils.text_processing import sentence_splitter
+
+    # Nothing is read from or written to disk caches left by earlier runs
+    result_cache.disk_dir = None
+    style_gram_cache.disk_dir = None
+    # Results are only comparable between runs that split sentences the same way
+    splitter = sentence_splitter()
+    fixtures.register_models(tasks)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(splitter),
+        'settings': {'repeats': options.repeats, 'warmup': options.warmup, 'quick': options.quick,
+                     'style_steps': options.style_steps, 'summary_length': options.summary_length,
+                     'speech_latency': options.speech_latency},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='benchmarks-') as work_dir:
+        for task in tasks:
+            parameter, sizes = SIZES[task]
+            sizes = sizes[:2] if options.quick else sizes
+            for size, call, unit in CASES[task](sizes, options, work_dir):
+                name = f"{task}/{parameter}={size}"
+                print(f"Running {name}...")
+                result = measure(call, options.repeats, options.warmup, unit)
+                report['results'][name] = {'task': task, parameter: size, **result}
+                _print_result(name, result)
+    report['peak_rss_bytes'] = peak_rss_bytes()
+    return report
+
+
+def _print_result(name, result):
+    latency = result['latency']
+    throughput = result['throughput']
+    delta = result['peak_rss_delta_bytes']
+    memory = f"+{delta / 2**20:.1f} MB" if delta is not None else "n/a"
+    ttft = f", first token p50 {result['ttft']['p50'] * 1000:.1f} ms" if 'ttft' in result else ""
+    print(f"  {name}: p50 {latency['p50'] * 1000:.1f} ms, p90 {latency['p90'] * 1000:.1f} ms{ttft}, "
+          f"{throughput['units_per_second']:.1f} {throughput['unit']}/s, peak RSS {memory}")
+
+
+def compare(report, baseline, threshold=0.2, memory_threshold=0.25, min_memory_bytes=16 * 2**20):
+    """
+    Compare each case with the same case in a baseline report
+    A case regresses when its p50 latency or time to first token grew, or its
+    throughput fell, by more than threshold (a fraction), or its peak memory growth
+    rose by more than memory_threshold and at least min_memory_bytes. Returns one row per shared case.
+    """
+    rows = []
+    for name, result in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        latency_change = result['latency']['p50'] / base['latency']['p50'] - 1
+        throughput_change = (result['throughput']['units_per_second']
+                             / base['throughput']['units_per_second'] - 1)
+        ttft_change = (result['ttft']['p50'] / base['ttft']['p50'] - 1
+                       if 'ttft' in result and 'ttft' in base else None)
+        memory_change = None
+        memory_regressed = False
+        if result['peak_rss_delta_bytes'] is not None and base['peak_rss_delta_bytes'] is not None:
+            memory_change = result['peak_rss_delta_bytes'] - base['peak_rss_delta_bytes']
+            allowed = max(memory_threshold * base['peak_rss_delta_bytes'], min_memory_bytes)
+            memory_regressed = memory_change > allowed
+        reasons = []
+        if latency_change > threshold:
+            reasons.append(f"p50 latency +{latency_change:.0%}")
+        if throughput_change < -threshold / (1 + threshold):
+            reasons.append(f"throughput {throughput_change:.0%}")
+        if ttft_change is not None and ttft_change > threshold:
+            reasons.append(f"p50 time to first token +{ttft_change:.0%}")
+        if memory_regressed:
+            reasons.append(f"peak memory +{memory_change / 2**20:.1f} MB")
+        rows.append({
+            'case': name,
+            'latency_change': latency_change,
+            'throughput_change': throughput_change,
+            'ttft_change': ttft_change,
+            'memory_change_bytes': memory_change,
+            'regressed': bool(reasons),
+            'reasons': reasons,
+        })
+    return rows
+
+
+def _print_comparison(rows, baseline_path):
+    print(f"\nCompared with {baseline_path}:")
+    for row in rows:
+        memory = (f"{row['memory_change_bytes'] / 2**20:+.1f} MB"
+                  if row['memory_change_bytes'] is not None else "n/a")
+        status = f"REGRESSION ({', '.join(row['reasons'])})" if row['regressed'] else "ok"
+        ttft = f"first token {row['ttft_change']:+.0%}, " if row['ttft_change'] is not None else ""
+        print(f"  {row['case']}: latency {row['latency_change']:+.0%}, {ttft}"
+              f"throughput {row['throughput_change']:+.0%}, memory {memory}: {status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with tiny random models and synthetic inputs")
+    parser.add_argument('--tasks', default=','.join(TASKS), help=f"comma-separated subset of {', '.join(TASKS)}")
+    parser.add_argument('--quick', action='store_true', help="only the two smallest sizes per task")
+    parser.add_argument('--repeats', type=int, default=5, help="timed calls per case")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed calls per case")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="torch intra-op threads (default: 1, for stable numbers)")
+    parser.add_argument('--style-steps', type=int, default=10, help="optimization steps per style transfer")
+    parser.add_argument('--summary-length', type=int, default=60, help="max_length of each summary")
+    parser.add_argument('--speech-latency', type=float, default=0.0,
+                        help="simulated seconds per recognized chunk")
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    parser.add_argument('--baseline', help="compare with a report saved earlier")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed fractional latency or throughput change (default: 0.2)")
+    parser.add_argument('--memory-threshold', type=float, default=0.25,
+                        help="allowed fractional growth of peak memory (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    tasks = [task.strip() for task in args.tasks.split(',') if task.strip()]
+    unknown = [task for task in tasks if task not in TASKS]
+    if unknown:
+        parser.error(f"unknown tasks: {', '.join(unknown)}")
+    torch.set_num_threads(args.threads)
+
+    report = run(tasks, args)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['comparison'] = {
+            'baseline': args.baseline,
+            'baseline_created': baseline.get('created'),
+            'cases': compare(report, baseline, args.threshold, args.memory_threshold),
+        }
+        _print_comparison(report['comparison']['cases'], args.baseline)
+        report['regressions'] = [row['case'] for row in report['comparison']['cases'] if row['regressed']]
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main().get('regressions') else 0)
@@ -0,0 +1,132 @@
+# benchmarks/startup.py
+"""
+Startup profile of the web app
+Imports the app in a fresh interpreter with python -X importtime and reports the
+import time per module, then starts another fresh interpreter that imports the
+app and answers GET /healthz through the test client, timed from launch:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --top 40 --output startup.json
+
+Exits with status 1 when the health check took longer than --max-seconds or
+when importing the app loaded any of the heavy libraries the routes load on first use.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Libraries only the model routes need; importing the app must not load them
+HEAVY_MODULES = ('torch', 'torchvision', 'transformers', 'nltk', 'matplotlib', 'pydub')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEALTH_CHECK = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/healthz')
+print(json.dumps({
+    'import_seconds': imported - start,
+    'healthz_seconds': time.perf_counter() - imported,
+    'status': response.status_code,
+    'heavy_modules': [name for name in sys.argv[1:] if name in sys.modules],
+}))
+"""
+
+
+def profile_imports(module='app'):
+    """
+    Per-module import times of module in a fresh interpreter, in import order
+    Each entry has the module name, its own seconds, its cumulative seconds (with
+    the modules it imported) and its nesting depth.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip()[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        modules.append({
+            'module': name.strip(),
+            'self_seconds': int(self_us) / 1e6,
+            'cumulative_seconds': int(cumulative_us) / 1e6,
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return modules
+
+
+def time_health_check(module_names=HEAVY_MODULES):
+    """Seconds from launching a fresh interpreter until the app has answered GET /healthz"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', HEALTH_CHECK, *module_names],
+                            cwd=ROOT, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Health check failed:\n{result.stderr.strip()[-2000:]}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['seconds_from_launch'] = seconds
+    return report
+
+
+def _print_table(title, rows, key):
+    print(f"\n{title}:")
+    for row in rows:
+        print(f"  {row[key] * 1000:9.1f} ms  {row['module']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time per module and time to the first health check")
+    parser.add_argument('--module', default='app', help="module to import (default: app)")
+    parser.add_argument('--top', type=int, default=20, help="modules listed per table")
+    parser.add_argument('--max-seconds', type=float, default=1.0,
+                        help="longest allowed time from launch to the health check answer (default: 1.0)")
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    modules = profile_imports(args.module)
+    total = next((row['cumulative_seconds'] for row in modules if row['module'] == args.module), None)
+    print(f"import {args.module}: {total * 1000:.1f} ms over {len(modules)} modules" if total is not None
+          else f"import {args.module}: already imported by the interpreter")
+    _print_table("Slowest by cumulative time (with the modules each imported)",
+                 sorted(modules, key=lambda row: row['cumulative_seconds'], reverse=True)[:args.top],
+                 'cumulative_seconds')
+    _print_table("Slowest by own time",
+                 sorted(modules, key=lambda row: row['self_seconds'], reverse=True)[:args.top], 'self_seconds')
+
+    report = {
+        'module': args.module,
+        'import_seconds': total,
+        'modules': modules,
+        'health_check': time_health_check(),
+    }
+    health = report['health_check']
+    print(f"\nGET /healthz answered {health['status']} {health['seconds_from_launch']:.2f}s after launch "
+          f"(import {health['import_seconds']:.2f}s, request {health['healthz_seconds'] * 1000:.1f} ms)")
+    problems = []
+    if health['status'] != 200 or health['seconds_from_launch'] > args.max_seconds:
+        problems.append(f"health check took {health['seconds_from_launch']:.2f}s (limit {args.max_seconds:.2f}s)")
+    if health['heavy_modules']:
+        problems.append(f"importing the app loaded {', '.join(health['heavy_modules'])}")
+    for problem in problems:
+        print(f"  SLOW STARTUP: {problem}")
+    report['problems'] = problems
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main().get('problems') else 0)
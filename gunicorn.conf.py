@@ -0,0 +1,72 @@
+# gunicorn.conf.py
+"""
+Production serving: gunicorn -c gunicorn.conf.py app:app
+The master imports the app and loads every model before forking, then freezes
+the heap so the workers share the weights copy-on-write. Each worker runs a
+warmup inference per task before it accepts requests, and /readyz reports it.
+"""
+import os
+import tempfile
+import time
+
+_started = time.monotonic()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+# Threads per worker, so concurrent requests reach the summarization batcher together
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# Warmup and long generations can run well past gunicorn's 30 second default
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+# Import the app once in the master; when_ready then loads the models there before forking
+preload_app = True
+
+# Job records go where every worker can read them, so a status poll or cancel may land on
+# any worker; this deployment's own directory unless JOBS_DIR points elsewhere
+_default_jobs_dir = os.path.join(tempfile.gettempdir(), f'quadra-mind-jobs-{os.getpid()}')
+os.environ.setdefault('JOBS_DIR', _default_jobs_dir)
+
+# Tokenizers used in the master would otherwise warn and turn their thread pool off after the fork
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+# Torch intra-op threads per worker (default: the CPUs divided between the workers)
+SERVING_TORCH_THREADS = int(os.environ.get('SERVING_TORCH_THREADS', '0')) or None
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked
+    from modules import serving
+    from modules.style_transfer_jobs import style_jobs
+    from utils import metrics
+    metrics.clear_dir()
+    style_jobs.clear_store()
+    serving.preload_models()
+    # The master's model loads are reported once, from its own file; workers start from zero
+    metrics.flush(force=True)
+    server.log.info(f"Master ready {time.monotonic() - _started:.1f}s after start; forking {workers} workers")
+
+
+def post_fork(server, worker):
+    from modules import serving
+    from utils import metrics
+    serving.reset_start()
+    metrics.metrics.clear()
+    torch_threads = serving.set_worker_threads(workers, SERVING_TORCH_THREADS)
+    server.log.info(f"Worker {worker.pid} forked with {torch_threads} torch threads")
+
+
+def post_worker_init(worker):
+    # The worker only starts accepting connections once this returns
+    from modules import serving
+    serving.warmup(notify=worker.notify)
+
+
+def on_exit(server):
+    from modules.style_transfer_jobs import style_jobs
+    style_jobs.clear_store()
+    if style_jobs.store_dir == _default_jobs_dir:
+        try:
+            os.rmdir(_default_jobs_dir)
+        except OSError:
+            pass  # never created, or holds files of a crashed write
@@ -0,0 +1,253 @@
+"""
+Compare fp32 and dynamic int8 inference for summarization and text generation
+Both precisions run the same fixed corpus. int8 outputs are scored against the
+fp32 outputs with ROUGE-1/2/L and token agreement, next to load time, latency,
+model size and process RSS.
+
+    python -m modules.eval_precision --task all --output precision_report.json
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+import torch
+from utils.model_registry import registry
+from utils.precision import PRECISIONS
+from utils.resources import current_rss_bytes, peak_rss_bytes
+from utils.text_processing import clean_text
+
+# Fixed evaluation corpus; pass --corpus to use other texts (separated by blank lines)
+EVAL_CORPUS = [
+    "The city council voted on Tuesday to expand the bus network into the northern suburbs. "
+    "The plan adds four routes and raises weekday frequency to every ten minutes. "
+    "Officials said the expansion would be paid for by a regional transport grant and would "
+    "not increase fares. Construction of new shelters is expected to begin in the spring, "
+    "and the first routes should open before the end of the year.",
+
+    "Researchers at the university have developed a battery that charges in under five minutes. "
+    "The design replaces the graphite anode with a porous silicon structure that swells less "
+    "during charging. In laboratory tests the cells kept ninety percent of their capacity after "
+    "a thousand cycles. The team is now working with a manufacturer to test larger cells for "
+    "electric scooters and delivery vans.",
+
+    "Heavy rain caused flooding across the valley over the weekend, closing several roads and "
+    "two schools. Emergency crews rescued residents from homes near the river, and no injuries "
+    "were reported. Forecasters expect drier weather later in the week, but warned that water "
+    "levels could stay high for several days as runoff from the hills reaches the lowlands.",
+
+    "The museum will reopen next month after a two-year renovation that doubled its gallery space. "
+    "A new wing will display the permanent collection of maritime paintings, while the old hall "
+    "is being turned into a space for travelling exhibitions. Entry will remain free for children, "
+    "and the museum plans longer opening hours on Fridays.",
+
+    "A local bakery has won the national bread competition for the third year in a row. "
+    "Its sourdough loaf, made with flour from a nearby mill, impressed the judges with its crust "
+    "and flavour. The owners said they would use the prize money to train two new apprentices "
+    "and to open a second shop in the town centre.",
+]
+
+
+def _ngrams(tokens, n):
+    counts = {}
+    for i in range(len(tokens) - n + 1):
+        gram = tuple(tokens[i:i + n])
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def _f1(overlap, reference_total, candidate_total):
+    if reference_total == 0 and candidate_total == 0:
+        return 1.0
+    if overlap == 0 or reference_total == 0 or candidate_total == 0:
+        return 0.0
+    precision = overlap / candidate_total
+    recall = overlap / reference_total
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_n(reference, candidate, n):
+    """ROUGE-N F1 between two texts over lowercased words"""
+    ref = _ngrams(reference.lower().split(), n)
+    cand = _ngrams(candidate.lower().split(), n)
+    overlap = sum(min(count, cand.get(gram, 0)) for gram, count in ref.items())
+    return _f1(overlap, sum(ref.values()), sum(cand.values()))
+
+
+def rouge_l(reference, candidate):
+    """ROUGE-L F1: longest common subsequence of lowercased words"""
+    ref = reference.lower().split()
+    cand = candidate.lower().split()
+    previous = [0] * (len(cand) + 1)
+    for r in ref:
+        current = [0]
+        for j, c in enumerate(cand):
+            current.append(previous[j] + 1 if r == c else max(previous[j + 1], current[j]))
+        previous = current
+    return _f1(previous[-1], len(ref), len(cand))
+
+
+def token_agreement(reference_ids, candidate_ids):
+    """Fraction of positions where two token sequences hold the same token"""
+    longest = max(len(reference_ids), len(candidate_ids))
+    if longest == 0:
+        return 1.0
+    return sum(a == b for a, b in zip(reference_ids, candidate_ids)) / longest
+
+
+def _load(get_model, precision):
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    tokenizer, model = get_model(precision)
+    load_seconds = time.perf_counter() - start
+    rss_after = current_rss_bytes()
+    return tokenizer, model, {
+        'load_seconds': load_seconds,
+        'model_bytes': sum(entry['size_bytes'] for entry in registry.stats()),
+        'rss_bytes': rss_after,
+        'rss_delta_bytes': rss_after - rss_before if rss_after is not None and rss_before is not None else None,
+    }
+
+
+def _timed(fn, inputs):
+    """Run fn on every input after one warmup call; returns (outputs, latencies)"""
+    fn(inputs[0])
+    outputs, latencies = [], []
+    for item in inputs:
+        start = time.perf_counter()
+        outputs.append(fn(item))
+        latencies.append(time.perf_counter() - start)
+    return outputs, latencies
+
+
+def _latency_stats(latencies):
+    return {
+        'mean_seconds': statistics.mean(latencies),
+        'median_seconds': statistics.median(latencies),
+        'max_seconds': max(latencies),
+    }
+
+
+def run_summarization(texts, precision, max_length=150, min_length=30):
+    from modules import summarization
+
+    tokenizer, model, report = _load(summarization.get_model, precision)
+    max_tokens = min(1024, model.config.max_position_embeddings)
+
+    def summarize(text):
+        ids = tokenizer(clean_text(text), max_length=max_tokens, truncation=True)["input_ids"]
+        return summarization.summarize_token_ids([ids], max_length, min_length, precision)[0]
+
+    summaries, latencies = _timed(summarize, texts)
+    report.update(_latency_stats(latencies))
+    report['outputs'] = summaries
+    report['output_ids'] = [tokenizer(s, add_special_tokens=False)["input_ids"] for s in summaries]
+    return report
+
+
+def run_generation(texts, precision, length=50):
+    from modules import text_generation
+
+    tokenizer, model, report = _load(text_generation.get_model, precision)
+    # Greedy decoding, so the two precisions differ only through their logits
+    prompts = [clean_text(text).split('. ')[0] + '.' for text in texts]
+
+    def generate(prompt):
+        inputs = tokenizer.encode(prompt, return_tensors="pt")
+        with torch.no_grad():
+            outputs = model.generate(inputs, max_new_tokens=length, do_sample=False,
+                                     pad_token_id=tokenizer.eos_token_id)
+        return outputs[0, inputs.shape[1]:].tolist()
+
+    output_ids, latencies = _timed(generate, prompts)
+    report.update(_latency_stats(latencies))
+    report['output_ids'] = output_ids
+    report['outputs'] = [tokenizer.decode(ids, skip_special_tokens=True) for ids in output_ids]
+    report['tokens_per_second'] = sum(len(ids) for ids in output_ids) / sum(latencies)
+    return report
+
+
+def compare(reference, candidate):
+    """Quality of candidate outputs scored against reference outputs, averaged over the corpus"""
+    pairs = list(zip(reference['outputs'], candidate['outputs']))
+    id_pairs = list(zip(reference['output_ids'], candidate['output_ids']))
+    return {
+        'rouge1': statistics.mean(rouge_n(r, c, 1) for r, c in pairs),
+        'rouge2': statistics.mean(rouge_n(r, c, 2) for r, c in pairs),
+        'rougeL': statistics.mean(rouge_l(r, c) for r, c in pairs),
+        'token_agreement': statistics.mean(token_agreement(r, c) for r, c in id_pairs),
+        'exact_match': statistics.mean(float(r == c) for r, c in id_pairs),
+        'speedup': reference['mean_seconds'] / candidate['mean_seconds'],
+        'size_ratio': candidate['model_bytes'] / reference['model_bytes'] if reference['model_bytes'] else None,
+    }
+
+
+def evaluate(task, texts, precisions=PRECISIONS, **options):
+    """
+    Run one task at each precision and compare every precision with the first
+    Models are evicted between runs so each precision is measured on its own.
+    """
+    runner = {'summarization': run_summarization, 'generation': run_generation}[task]
+    results = {}
+    for precision in precisions:
+        print(f"Running {task} at {precision}...")
+        registry.clear()
+        gc.collect()
+        results[precision] = runner(texts, precision, **options)
+    registry.clear()
+    gc.collect()
+
+    reference = precisions[0]
+    comparisons = {p: compare(results[reference], results[p]) for p in precisions[1:]}
+    return {'precisions': results, 'compared_to': reference, 'comparisons': comparisons}
+
+
+def _print_summary(task, report):
+    print(f"\n{task}")
+    for precision, result in report['precisions'].items():
+        rss = f"{result['rss_bytes'] / 2**20:.0f} MB" if result['rss_bytes'] is not None else "n/a"
+        print(f"  {precision}: load {result['load_seconds']:.1f}s, "
+              f"model {result['model_bytes'] / 2**20:.0f} MB, RSS {rss}, "
+              f"mean latency {result['mean_seconds'] * 1000:.0f} ms")
+    for precision, scores in report['comparisons'].items():
+        print(f"  {precision} vs {report['compared_to']}: ROUGE-1 {scores['rouge1']:.3f}, "
+              f"ROUGE-2 {scores['rouge2']:.3f}, ROUGE-L {scores['rougeL']:.3f}, "
+              f"token agreement {scores['token_agreement']:.3f}, speedup {scores['speedup']:.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare fp32 and int8 inference on a fixed corpus")
+    parser.add_argument('--task', choices=('summarization', 'generation', 'all'), default='all')
+    parser.add_argument('--corpus', help="text file of documents separated by blank lines (default: built-in corpus)")
+    parser.add_argument('--limit', type=int, help="only use the first N documents")
+    parser.add_argument('--gen-length', type=int, default=50, help="new tokens per generation prompt")
+    parser.add_argument('--threads', type=int, help="torch intra-op threads")
+    parser.add_argument('--output', help="write the full report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            texts = [block.strip() for block in f.read().split('\n\n') if block.strip()]
+    else:
+        texts = EVAL_CORPUS
+    texts = texts[:args.limit] if args.limit else texts
+
+    tasks = ('summarization', 'generation') if args.task == 'all' else (args.task,)
+    report = {'documents': len(texts), 'threads': torch.get_num_threads(), 'tasks': {}}
+    for task in tasks:
+        options = {'length': args.gen_length} if task == 'generation' else {}
+        report['tasks'][task] = evaluate(task, texts, **options)
+        _print_summary(task, report['tasks'][task])
+    report['peak_rss_bytes'] = peak_rss_bytes()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote report to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
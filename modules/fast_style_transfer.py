@@ -0,0 +1,266 @@
+"""
+Feed-forward style transfer: one image transformation network per style
+A network is trained once against the VGG19 content and style losses of
+neural_style_transfer; afterwards stylizing an image is a single forward pass.
+
+Train and export a network for a style image:
+    python -m modules.fast_style_transfer --style path/to/style.jpg --content-dir path/to/photos
+"""
+import argparse
+import os
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import Dataset, DataLoader
+from torchvision import transforms
+from PIL import Image
+from utils.image_processing import save_image
+from utils.file_handling import file_sha256
+from utils.model_registry import registry
+from utils.metrics import stage
+from modules.neural_style_transfer import (
+    device, CONTENT_LAYERS, STYLE_LAYERS, get_feature_extractor, extract_features,
+    build_model_with_losses, load_and_preprocess, style_gram_cache
+)
+
+# Trained networks are stored as <sha256 of the style image>.pth
+STYLE_MODEL_DIR = os.environ.get('STYLE_MODEL_DIR', os.path.join('models', 'styles'))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class ConvLayer(nn.Module):
+    def __init__(self, in_channels, out_channels, kernel_size, stride):
+        super().__init__()
+        self.pad = nn.ReflectionPad2d(kernel_size // 2)
+        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size, stride)
+
+    def forward(self, x):
+        return self.conv(self.pad(x))
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv1 = ConvLayer(channels, channels, kernel_size=3, stride=1)
+        self.in1 = nn.InstanceNorm2d(channels, affine=True)
+        self.conv2 = ConvLayer(channels, channels, kernel_size=3, stride=1)
+        self.in2 = nn.InstanceNorm2d(channels, affine=True)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        out = self.relu(self.in1(self.conv1(x)))
+        out = self.in2(self.conv2(out))
+        return out + x
+
+
+class UpsampleConvLayer(nn.Module):
+    """Nearest-neighbour upsampling followed by a convolution, which avoids checkerboard artifacts"""
+
+    def __init__(self, in_channels, out_channels, kernel_size, stride, upsample=None):
+        super().__init__()
+        self.upsample = upsample
+        self.conv = ConvLayer(in_channels, out_channels, kernel_size, stride)
+
+    def forward(self, x):
+        if self.upsample:
+            x = nn.functional.interpolate(x, scale_factor=self.upsample, mode='nearest')
+        return self.conv(x)
+
+
+class TransformerNet(nn.Module):
+    """Image transformation network of Johnson et al.: downsample, residual blocks, upsample"""
+
+    def __init__(self, channels=32, num_residual_blocks=5):
+        super().__init__()
+        self.encoder = nn.Sequential(
+            ConvLayer(3, channels, kernel_size=9, stride=1),
+            nn.InstanceNorm2d(channels, affine=True), nn.ReLU(),
+            ConvLayer(channels, channels * 2, kernel_size=3, stride=2),
+            nn.InstanceNorm2d(channels * 2, affine=True), nn.ReLU(),
+            ConvLayer(channels * 2, channels * 4, kernel_size=3, stride=2),
+            nn.InstanceNorm2d(channels * 4, affine=True), nn.ReLU(),
+        )
+        self.residuals = nn.Sequential(*[ResidualBlock(channels * 4) for _ in range(num_residual_blocks)])
+        self.decoder = nn.Sequential(
+            UpsampleConvLayer(channels * 4, channels * 2, kernel_size=3, stride=1, upsample=2),
+            nn.InstanceNorm2d(channels * 2, affine=True), nn.ReLU(),
+            UpsampleConvLayer(channels * 2, channels, kernel_size=3, stride=1, upsample=2),
+            nn.InstanceNorm2d(channels, affine=True), nn.ReLU(),
+            ConvLayer(channels, 3, kernel_size=9, stride=1),
+        )
+
+    def forward(self, x):
+        return self.decoder(self.residuals(self.encoder(x)))
+
+
+class ContentImageFolder(Dataset):
+    """Every image file in a folder (searched recursively), resized and cropped to image_size"""
+
+    def __init__(self, root, image_size):
+        self.paths = sorted(
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(root)
+            for name in names
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.paths:
+            raise ValueError(f"No content images found in {root}")
+        self.transform = transforms.Compose([
+            transforms.Resize(image_size),
+            transforms.CenterCrop(image_size),
+            transforms.ToTensor()
+        ])
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.transform(Image.open(self.paths[index]).convert('RGB'))
+
+
+def style_network_path(style_path, model_dir=None, style_digest=None):
+    """Where the trained network for a style image is stored; style_digest skips hashing the file"""
+    return os.path.join(model_dir or STYLE_MODEL_DIR, f"{style_digest or file_sha256(style_path)}.pth")
+
+
+def find_style_network(style_path, model_dir=None, style_digest=None):
+    """Return the path of a trained network for this style image, or None"""
+    path = style_network_path(style_path, model_dir, style_digest)
+    return path if os.path.exists(path) else None
+
+
+def load_style_network(path):
+    """Return the trained network stored at path, shared through the model registry"""
+    def loader():
+        checkpoint = torch.load(path, map_location='cpu')
+        network = TransformerNet(**checkpoint['config'])
+        network.load_state_dict(checkpoint['state_dict'])
+        return network.to(device).eval()
+    return registry.get(f"fast-style:{os.path.abspath(path)}", loader)
+
+
+def stylize(content_path, output_path, network_path, image_size=512):
+    """
+    Stylize an image with a trained network in a single forward pass
+
+    Returns:
+        tuple: (success, output_path_or_error_message)
+    """
+    try:
+        network = load_style_network(network_path)
+        with stage('style_transfer', 'image_load'):
+            content_img = load_and_preprocess(content_path, image_size).to(device)
+        with stage('style_transfer', 'stylize'), torch.no_grad():
+            output = network(content_img).clamp_(0, 1)
+        with stage('style_transfer', 'image_save'):
+            save_image(output, output_path)
+        return True, output_path
+    except Exception as e:
+        return False, f"Style transfer failed: {str(e)}"
+
+
+def train_style_network(style_path, content_dir, output_path=None, image_size=256, epochs=2,
+                        batch_size=4, lr=1e-3, style_weight=1e6, content_weight=1,
+                        channels=32, num_residual_blocks=5, log_interval=50, max_steps=None):
+    """
+    Train a TransformerNet for one style image and export it
+
+    Args:
+        style_path: Style image the network learns
+        content_dir: Folder of training content images
+        output_path: Where to save the network (default: STYLE_MODEL_DIR/<style hash>.pth)
+        image_size: Training resolution
+        epochs: Passes over the content images
+        batch_size: Content images per optimization step
+        lr: Adam learning rate
+        style_weight: Weight for style loss
+        content_weight: Weight for content loss
+        channels: Width of the first network layer
+        num_residual_blocks: Depth of the network
+        log_interval: Print the losses every this many steps
+        max_steps: Optional cap on the total number of steps
+
+    Returns:
+        Path of the exported network
+    """
+    style_digest = file_sha256(style_path)
+    output_path = output_path or style_network_path(style_path, style_digest=style_digest)
+    loader = DataLoader(ContentImageFolder(content_dir, image_size), batch_size=batch_size,
+                        shuffle=True, drop_last=False)
+
+    # Loss network: the shared VGG19 trunk with the existing content and style loss layers
+    trunk = get_feature_extractor()
+    style_grams = style_gram_cache.get_or_compute(trunk, style_path, image_size, STYLE_LAYERS,
+                                                  style_digest)
+    placeholder = torch.zeros(1, 3, image_size, image_size, device=device)
+    loss_model, style_losses, content_losses = build_model_with_losses(
+        trunk, style_grams, placeholder, STYLE_LAYERS, CONTENT_LAYERS
+    )
+
+    config = {'channels': channels, 'num_residual_blocks': num_residual_blocks}
+    network = TransformerNet(**config).to(device).train()
+    optimizer = optim.Adam(network.parameters(), lr=lr)
+
+    print(f"Training style network on {len(loader.dataset)} images...")
+    step = 0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        for batch in loader:
+            batch = batch.to(device)
+
+            # Content targets are the VGG features of the untouched batch
+            targets = extract_features(trunk, batch, CONTENT_LAYERS)
+            for name, content_loss in zip(CONTENT_LAYERS, content_losses):
+                content_loss.target = targets[name]
+
+            optimizer.zero_grad()
+            loss_model(network(batch))
+            style_score = sum(sl.loss for sl in style_losses) * style_weight
+            content_score = sum(cl.loss for cl in content_losses) * content_weight
+            total_loss = style_score + content_score
+            total_loss.backward()
+            optimizer.step()
+
+            step += 1
+            if step % log_interval == 0:
+                print(f"Epoch {epoch + 1} step {step}: Style={style_score.item():.2f} "
+                      f"Content={content_score.item():.2f} ({time.perf_counter() - start:.0f}s)")
+            if max_steps and step >= max_steps:
+                break
+        if max_steps and step >= max_steps:
+            break
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    torch.save({
+        'config': config,
+        'state_dict': network.cpu().state_dict(),
+        'style_sha256': style_digest,
+        'image_size': image_size,
+    }, output_path)
+    print(f"Saved style network to {output_path}")
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and export a feed-forward style network")
+    parser.add_argument('--style', required=True, help="style image to learn")
+    parser.add_argument('--content-dir', required=True, help="folder of training content images")
+    parser.add_argument('--output', help=f"output file (default: {STYLE_MODEL_DIR}/<style sha256>.pth)")
+    parser.add_argument('--image-size', type=int, default=256)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--style-weight', type=float, default=1e6)
+    parser.add_argument('--content-weight', type=float, default=1)
+    parser.add_argument('--max-steps', type=int)
+    args = parser.parse_args(argv)
+
+    train_style_network(args.style, args.content_dir, args.output, image_size=args.image_size,
+                        epochs=args.epochs, batch_size=args.batch_size, lr=args.lr,
+                        style_weight=args.style_weight, content_weight=args.content_weight,
+                        max_steps=args.max_steps)
+
+
+if __name__ == "__main__":
+    main()
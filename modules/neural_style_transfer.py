@@ -6,13 +6,37 @@ from torchvision import transforms, models
 from PIL import Image
 import numpy as np
 from utils.image_processing import load_image, save_image
+from utils.file_handling import file_sha256
+from utils.model_registry import registry
+from utils.result_cache import result_cache, cache_key
+from utils.metrics import stage
+from collections import OrderedDict
+import threading
+import time
 import os
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# VGG19 input normalization and the layers the losses attach to
+CNN_NORMALIZATION_MEAN = [0.485, 0.456, 0.406]
+CNN_NORMALIZATION_STD = [0.229, 0.224, 0.225]
+CONTENT_LAYERS = ['conv_4']
+STYLE_LAYERS = ['conv_1', 'conv_2', 'conv_3', 'conv_4', 'conv_5']
+VGG_MODEL_NAME = "vgg19-features"
+
+# Style Gram targets are cached per style image and resolution
+STYLE_CACHE_SIZE = int(os.environ.get('STYLE_CACHE_SIZE', '32'))
+STYLE_CACHE_DIR = os.environ.get('STYLE_CACHE_DIR') or None
+
+# Coarse-to-fine optimization: number of resolutions and the early-stop threshold
+PYRAMID_LEVELS = int(os.environ.get('STYLE_PYRAMID_LEVELS', '1'))
+CONVERGENCE_TOL = float(os.environ.get('STYLE_CONVERGENCE_TOL', '0'))
+
 def perform_style_transfer(content_path, style_path, output_path, 
                          num_steps=300, style_weight=1e6, content_weight=1,
-                         image_size=512):
+                         image_size=512, progress=None, mode='auto',
+                         pyramid_levels=None, convergence_tol=None, report=None,
+                         content_digest=None, style_digest=None):
     """
     Performs neural style transfer with proper image resizing and error handling.
     
@@ -20,56 +44,190 @@ def perform_style_transfer(content_path, style_path, output_path,
         content_path: Path to content image
         style_path: Path to style image
         output_path: Path to save output image
-        num_steps: Number of optimization steps
+        num_steps: Number of optimization steps (per pyramid level)
         style_weight: Weight for style loss
         content_weight: Weight for content loss
         image_size: Size to resize both images to
+        progress: Optional callback called as progress(step, num_steps, style_score, content_score)
+            after every loss evaluation; raising from it aborts the transfer
+        mode: 'optimize' runs per-image optimization, 'fast' uses the trained feed-forward
+            network for this style, 'auto' uses the network when one exists
+        pyramid_levels: Number of resolutions to optimize at, coarsest first; each level
+            halves the size of the next and seeds it with its upsampled result
+        convergence_tol: Stop a level early once an optimizer step improves the loss by
+            less than this fraction; None or 0 always runs num_steps
+        report: Optional dict filled in with the mode ('fast', 'optimize' or 'cached'),
+            steps and per-level timings
+        content_digest, style_digest: SHA-256 of the images when the caller already
+            knows them (UploadStore names files by it); otherwise each file is hashed once
         
     Returns:
         tuple: (success, output_path_or_error_message)
     """
+    pyramid_levels = PYRAMID_LEVELS if pyramid_levels is None else pyramid_levels
+    convergence_tol = CONVERGENCE_TOL if convergence_tol is None else convergence_tol
+    report = {} if report is None else report
+    start = time.perf_counter()
+    content_digest = content_digest or file_sha256(content_path)
+    style_digest = style_digest or file_sha256(style_path)
+
     try:
-        # 1. Load and resize images to same dimensions
-        print("Loading and preprocessing images...")
-        content_img = load_and_preprocess(content_path, image_size).to(device)
-        style_img = load_and_preprocess(style_path, image_size).to(device)
-        
-        # Verify image dimensions match
-        if content_img.shape != style_img.shape:
-            return False, "Image dimensions mismatch after preprocessing"
-        
-        # 2. Initialize with content image
-        input_img = content_img.clone().requires_grad_(True)
+        settings = transfer_settings(style_path, num_steps, style_weight, content_weight,
+                                     image_size, mode, pyramid_levels, convergence_tol, style_digest)
+    except ValueError as e:
+        return False, str(e)
+    network_path = settings[1] if settings[0] == 'fast' else None
+    
+    # The encoded output is cached by input hashes plus everything that shapes the result
+    key = cache_key('style', content_digest, style_digest,
+                    os.path.splitext(output_path)[1].lower(), *settings)
+    hit, image_bytes = result_cache.get(key)
+    if hit:
+        print(f"Style transfer result served from cache; writing {output_path}")
+        with open(output_path, 'wb') as f:
+            f.write(image_bytes)
+        report.update(mode='cached', total_steps=0, levels=[],
+                      total_seconds=time.perf_counter() - start)
+        return True, output_path
+    
+    if network_path is not None:
+        from modules.fast_style_transfer import stylize
+        print(f"Using trained style network {network_path}")
+        result = stylize(content_path, output_path, network_path, image_size)
+        report.update(mode='fast', total_steps=0, levels=[],
+                      total_seconds=time.perf_counter() - start)
+        if result[0]:
+            _cache_output(key, output_path)
+        return result
+    
+    try:
+        report.update(mode='optimize', total_steps=0, levels=[])
         
-        # 3. Load VGG19 model
-        print("Loading VGG19 model...")
-        cnn = models.vgg19(pretrained=True).features.to(device).eval()
+        # 1. Shared VGG19 trunk, loaded once per process
+        trunk = get_feature_extractor()
         
-        # 4. Normalization parameters
-        cnn_normalization_mean = torch.tensor([0.485, 0.456, 0.406]).to(device)
-        cnn_normalization_std = torch.tensor([0.229, 0.224, 0.225]).to(device)
+        # 2. Resolutions from coarsest to finest
+        sizes = pyramid_sizes(image_size, pyramid_levels)
+        max_total_steps = num_steps * len(sizes)
+        input_img = None
         
-        # 5. Layer selection
-        content_layers = ['conv_4']
-        style_layers = ['conv_1', 'conv_2', 'conv_3', 'conv_4', 'conv_5']
+        for size in sizes:
+            level_start = time.perf_counter()
+            
+            # 3. Load and resize the content image for this level
+            print(f"Loading and preprocessing images at {size}px...")
+            with stage('style_transfer', 'image_load'):
+                content_img = load_and_preprocess(content_path, size).to(device)
+            
+            # 4. Initialize with the content image, or the upsampled coarser result
+            if input_img is None:
+                input_img = content_img.clone()
+            else:
+                input_img = nn.functional.interpolate(input_img.detach(), size=content_img.shape[-2:],
+                                                      mode='bilinear', align_corners=False)
+            input_img.requires_grad_(True)
+            
+            # 5. Style targets, computed once per style image and resolution
+            with stage('style_transfer', 'style_targets'):
+                style_grams = style_gram_cache.get_or_compute(trunk, style_path, size, STYLE_LAYERS,
+                                                              style_digest)
+            
+            # 6. Build model with loss layers
+            model, style_losses, content_losses = build_model_with_losses(
+                trunk, style_grams, content_img, STYLE_LAYERS, CONTENT_LAYERS
+            )
+            
+            # 7. Run style transfer at this level
+            print("Starting style transfer...")
+            steps, final_loss, converged = optimize_image(
+                model, style_losses, content_losses, input_img, num_steps,
+                style_weight, content_weight, convergence_tol,
+                progress=progress, step_offset=report['total_steps'], max_total_steps=max_total_steps
+            )
+            report['total_steps'] += steps
+            report['levels'].append({
+                'size': size,
+                'steps': steps,
+                'final_loss': final_loss,
+                'converged': converged,
+                'seconds': time.perf_counter() - level_start,
+            })
+            print(f"Level {size}px: {steps} steps in {report['levels'][-1]['seconds']:.1f}s"
+                  f"{' (converged)' if converged else ''}")
         
-        # 6. Build model with loss layers
-        model, style_losses, content_losses = build_model_with_losses(
-            cnn, cnn_normalization_mean, cnn_normalization_std,
-            style_img, content_img, style_layers, content_layers
-        )
+        # Final processing
+        with torch.no_grad():
+            input_img.data.clamp_(0, 1)
         
-        # 7. Set up optimizer
-        optimizer = optim.LBFGS([input_img.requires_grad_()], lr=0.8)
+        print(f"Saving result to {output_path}")
+        with stage('style_transfer', 'image_save'):
+            save_image(input_img, output_path)
+        _cache_output(key, output_path)
+        report['total_seconds'] = time.perf_counter() - start
+        return True, output_path
         
-        # 8. Run style transfer
-        print("Starting style transfer...")
-        run = [0]
-        while run[0] <= num_steps:
-            def closure():
-                # Clamp pixel values
-                input_img.data.clamp_(0, 1)
-                
+    except Exception as e:
+        return False, f"Style transfer failed: {str(e)}"
+
+def transfer_settings(style_path, num_steps=300, style_weight=1e6, content_weight=1,
+                      image_size=512, mode='auto', pyramid_levels=None, convergence_tol=None,
+                      style_digest=None):
+    """
+    Everything besides the two images that shapes the output of perform_style_transfer
+    The first entry is 'fast', followed by the trained network's path, when that network
+    stylizes the image, else 'optimize'. Arguments are those of perform_style_transfer;
+    raises ValueError for an unknown mode, or mode='fast' without a trained network.
+    """
+    pyramid_levels = PYRAMID_LEVELS if pyramid_levels is None else pyramid_levels
+    convergence_tol = CONVERGENCE_TOL if convergence_tol is None else convergence_tol
+    if mode not in ('auto', 'fast', 'optimize'):
+        raise ValueError(f"Unknown style transfer mode: {mode}")
+    if mode != 'optimize':
+        # Imported here because fast_style_transfer builds on this module
+        from modules.fast_style_transfer import find_style_network
+        network_path = find_style_network(style_path, style_digest=style_digest)
+        if network_path is not None:
+            return ('fast', network_path, os.path.getmtime(network_path), image_size)
+        if mode == 'fast':
+            raise ValueError("No trained style network exists for this style image")
+    return ('optimize', VGG_MODEL_NAME, num_steps, style_weight, content_weight,
+            image_size, pyramid_levels, convergence_tol)
+
+def _cache_output(key, output_path):
+    with open(output_path, 'rb') as f:
+        result_cache.put(key, f.read())
+
+def pyramid_sizes(image_size, levels, min_size=64):
+    """Image sizes for each pyramid level, coarsest first, never below min_size"""
+    sizes = [image_size]
+    for _ in range(max(levels, 1) - 1):
+        smaller = sizes[0] // 2
+        if smaller < min_size:
+            break
+        sizes.insert(0, smaller)
+    return sizes
+
+def optimize_image(model, style_losses, content_losses, input_img, num_steps,
+                   style_weight, content_weight, convergence_tol=0,
+                   progress=None, step_offset=0, max_total_steps=None):
+    """
+    Run L-BFGS on input_img for up to num_steps loss evaluations
+    Stops early when one optimizer step improves the loss by less than convergence_tol
+    (relative). Returns (steps, final_loss, converged)
+    """
+    optimizer = optim.LBFGS([input_img], lr=0.8)
+    max_total_steps = max_total_steps or num_steps
+    run = [0]
+    losses = []
+    previous_loss = None
+    converged = False
+    
+    while run[0] <= num_steps:
+        def closure():
+            # Clamp pixel values
+            input_img.data.clamp_(0, 1)
+            
+            with stage('style_transfer', 'optimization_step'):
                 optimizer.zero_grad()
                 model(input_img)
                 
@@ -78,26 +236,29 @@ def perform_style_transfer(content_path, style_path, output_path,
                 total_loss = style_score + content_score
                 
                 total_loss.backward()
-                
-                run[0] += 1
-                if run[0] % 50 == 0:
-                    print(f"Step {run[0]}: Style={style_score.item():.2f} "
-                          f"Content={content_score.item():.2f}")
-                
-                return total_loss
             
-            optimizer.step(closure)
-        
-        # Final processing
-        with torch.no_grad():
-            input_img.data.clamp_(0, 1)
+            run[0] += 1
+            losses.append(total_loss.item())
+            step = step_offset + run[0]
+            if progress is not None:
+                progress(step, max_total_steps, style_score.item(), content_score.item())
+            if step % 50 == 0:
+                print(f"Step {step}: Style={style_score.item():.2f} "
+                      f"Content={content_score.item():.2f}")
+            
+            return total_loss
         
-        print(f"Saving result to {output_path}")
-        save_image(input_img, output_path)
-        return True, output_path
+        optimizer.step(closure)
         
-    except Exception as e:
-        return False, f"Style transfer failed: {str(e)}"
+        current_loss = losses[-1]
+        if convergence_tol and previous_loss is not None:
+            improvement = (previous_loss - current_loss) / max(abs(previous_loss), 1e-12)
+            if improvement < convergence_tol:
+                converged = True
+                break
+        previous_loss = current_loss
+    
+    return run[0], losses[-1], converged
 
 def load_and_preprocess(image_path, size=512):
     """Load and preprocess image with consistent resizing"""
@@ -109,14 +270,12 @@ def load_and_preprocess(image_path, size=512):
     image = Image.open(image_path).convert('RGB')
     return transform(image).unsqueeze(0)  # Add batch dimension
 
-def build_model_with_losses(cnn, mean, std, style_img, content_img, 
-                          style_layers, content_layers):
-    """Build model with content and style loss layers"""
-    normalization = Normalization(mean, std).to(device)
-    content_losses = []
-    style_losses = []
-    
-    model = nn.Sequential(normalization)
+def build_feature_extractor(cnn, mean, std, last_layer):
+    """
+    Wrap a VGG feature stack as a named, normalized trunk ending at last_layer
+    Layers are named conv_i / relu_i / pool_i / bn_i and frozen
+    """
+    trunk = nn.Sequential(OrderedDict([('normalization', Normalization(mean, std))]))
     
     i = 0
     for layer in cnn.children():
@@ -133,17 +292,128 @@ def build_model_with_losses(cnn, mean, std, style_img, content_img,
         else:
             raise RuntimeError(f"Unrecognized layer: {layer.__class__.__name__}")
         
+        trunk.add_module(name, layer)
+        if name == last_layer:
+            break
+    
+    return trunk.to(device).eval().requires_grad_(False)
+
+def load_feature_extractor():
+    """Load VGG19 and truncate it after the deepest loss layer"""
+    print("Loading VGG19 model...")
+    with stage('style_transfer', 'vgg_build'):
+        cnn = models.vgg19(pretrained=True).features
+        mean = torch.tensor(CNN_NORMALIZATION_MEAN)
+        std = torch.tensor(CNN_NORMALIZATION_STD)
+        deepest = max(CONTENT_LAYERS + STYLE_LAYERS, key=lambda name: int(name.split('_')[1]))
+        return build_feature_extractor(cnn, mean, std, last_layer=deepest)
+
+def get_feature_extractor():
+    """Return the shared VGG19 trunk, loading it on first use"""
+    return registry.get(VGG_MODEL_NAME, load_feature_extractor)
+
+def extract_features(trunk, img, layers):
+    """Run img through the trunk once and collect the outputs of the named layers"""
+    features = {}
+    x = img
+    with torch.no_grad():
+        for name, layer in trunk.named_children():
+            x = layer(x)
+            if name in layers:
+                features[name] = x
+                if len(features) == len(layers):
+                    break
+    return features
+
+class StyleGramCache:
+    """
+    LRU cache of style Gram-matrix targets keyed by style image content hash,
+    resolution and style layers, with an optional on-disk tier
+    """
+    
+    def __init__(self, max_entries=32, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_or_compute(self, trunk, style_path, image_size, style_layers, style_digest=None):
+        key = f"{style_digest or file_sha256(style_path)}_{image_size}_{'-'.join(style_layers)}"
+        grams = self._get(key)
+        if grams is not None:
+            return grams
+        
+        style_img = load_and_preprocess(style_path, image_size).to(device)
+        features = extract_features(trunk, style_img, style_layers)
+        grams = {name: StyleLoss.gram_matrix(feature) for name, feature in features.items()}
+        self._put(key, grams)
+        return grams
+    
+    def _get(self, key):
+        with self._lock:
+            grams = self._entries.get(key)
+            if grams is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return grams
+        
+        if self.disk_dir:
+            path = os.path.join(self.disk_dir, f"{key}.pt")
+            if os.path.exists(path):
+                grams = {name: g.to(device) for name, g in torch.load(path, map_location='cpu').items()}
+                with self._lock:
+                    self.hits += 1
+                    self._store(key, grams)
+                return grams
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def _put(self, key, grams):
+        with self._lock:
+            self._store(key, grams)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = os.path.join(self.disk_dir, f"{key}.pt")
+            # Write then rename so concurrent readers never see a partial file
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            torch.save({name: g.cpu() for name, g in grams.items()}, tmp_path)
+            os.replace(tmp_path, path)
+    
+    def _store(self, key, grams):
+        self._entries[key] = grams
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+style_gram_cache = StyleGramCache(max_entries=STYLE_CACHE_SIZE, disk_dir=STYLE_CACHE_DIR)
+
+def build_model_with_losses(trunk, style_grams, content_img, style_layers, content_layers):
+    """Build model with content and style loss layers on top of the shared trunk"""
+    content_features = extract_features(trunk, content_img, content_layers)
+    content_losses = []
+    style_losses = []
+    
+    model = nn.Sequential()
+    
+    for name, layer in trunk.named_children():
         model.add_module(name, layer)
+        i = name.split('_')[-1]
         
         if name in content_layers:
-            target = model(content_img).detach()
-            content_loss = ContentLoss(target)
+            content_loss = ContentLoss(content_features[name])
             model.add_module(f"content_loss_{i}", content_loss)
             content_losses.append(content_loss)
         
         if name in style_layers:
-            target = model(style_img).detach()
-            style_loss = StyleLoss(target)
+            style_loss = StyleLoss(style_grams[name], precomputed=True)
             model.add_module(f"style_loss_{i}", style_loss)
             style_losses.append(style_loss)
     
@@ -163,9 +433,10 @@ class ContentLoss(nn.Module):
         return input
 
 class StyleLoss(nn.Module):
-    def __init__(self, target):
+    def __init__(self, target, precomputed=False):
         super().__init__()
-        self.target = self.gram_matrix(target).detach()
+        # precomputed=True means target is already a Gram matrix
+        self.target = (target if precomputed else self.gram_matrix(target)).detach()
     
     def forward(self, input):
         G = self.gram_matrix(input)
@@ -174,10 +445,11 @@ class StyleLoss(nn.Module):
     
     @staticmethod
     def gram_matrix(input):
+        # One Gram matrix per image so batched inputs do not mix styles
         batch, channel, h, w = input.size()
-        features = input.view(batch * channel, h * w)
-        G = torch.mm(features, features.t())
-        return G.div(batch * channel * h * w)
+        features = input.view(batch, channel, h * w)
+        G = torch.bmm(features, features.transpose(1, 2))
+        return G.div(channel * h * w)
 
 class Normalization(nn.Module):
     def __init__(self, mean, std):
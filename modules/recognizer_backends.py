@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import speech_recognition as sr
+from utils.metrics import metrics, stage
+
+logger = logging.getLogger(__name__)
+
+# Default backend and how many chunks it may recognize at once
+SPEECH_BACKEND = os.environ.get('SPEECH_BACKEND', 'google')
+SPEECH_CONCURRENCY = int(os.environ.get('SPEECH_CONCURRENCY', '4'))
+SPEECH_RETRIES = int(os.environ.get('SPEECH_RETRIES', '2'))
+
+
+class RecognizerBackend:
+    """
+    Base class for speech recognizer services
+    Each worker thread gets its own pooled session from create_session(), reused
+    across chunks. Failed requests are retried with exponential backoff; audio the
+    service cannot understand is not retried.
+    """
+
+    name = 'base'
+
+    def __init__(self, max_concurrency=SPEECH_CONCURRENCY, retries=SPEECH_RETRIES, backoff_seconds=0.5):
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self._local = threading.local()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def create_session(self):
+        """Create the per-thread client used for requests"""
+        return None
+
+    def _recognize(self, session, audio_data, language):
+        raise NotImplementedError
+
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.create_session()
+        return self._local.session
+
+    def recognize(self, audio_data, language='en-US'):
+        """Recognize one chunk, retrying transient request errors"""
+        for attempt in range(self.retries + 1):
+            try:
+                with stage('speech', 'chunk_recognition'):
+                    return self._recognize(self.session(), audio_data, language)
+            except sr.RequestError as e:
+                metrics.inc('speech_request_errors_total', backend=self.name)
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff_seconds * 2 ** attempt
+                logger.warning(f"{self.name} request failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def executor(self):
+        """Thread pool shared by every transcription using this backend"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix=f"speech-{self.name}")
+            return self._executor
+
+
+class GoogleBackend(RecognizerBackend):
+    """Google Web Speech API through speech_recognition"""
+
+    name = 'google'
+
+    def create_session(self):
+        return sr.Recognizer()
+
+    def _recognize(self, session, audio_data, language):
+        return session.recognize_google(audio_data, language=language)
+
+
+class StubBackend(RecognizerBackend):
+    """
+    Offline backend for tests and benchmarks
+    Returns a description of each chunk after an optional simulated latency.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency_seconds=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency_seconds = latency_seconds
+
+    def _recognize(self, session, audio_data, language):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        if seconds == 0:
+            raise sr.UnknownValueError()
+        return f"[{seconds:.2f}s of {language} speech]"
+
+
+BACKENDS = {
+    'google': GoogleBackend,
+    'stub': StubBackend,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Return the shared backend instance for name (default: SPEECH_BACKEND)"""
+    name = name or SPEECH_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown speech recognition backend: {name}")
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = BACKENDS[name]()
+        return _instances[name]
+
+
+def recognize_chunks(chunks, backend, language='en-US'):
+    """
+    Recognize chunks concurrently and return their texts in chunk order
+    chunks yields (index, audio_data) pairs and is consumed lazily, keeping at most
+    twice the backend's concurrency in flight. Chunks that fail or contain no
+    recognizable speech are logged and left out.
+    """
+    executor = backend.executor()
+    in_flight = deque()
+    texts = []
+
+    def collect(index, future):
+        try:
+            texts.append(future.result())
+        except sr.UnknownValueError:
+            logger.warning(f"Could not understand audio in chunk {index+1}")
+        except sr.RequestError as e:
+            logger.error(f"API error in chunk {index+1}: {e}")
+        except Exception as e:
+            logger.error(f"Error processing chunk {index+1}: {str(e)}")
+
+    for index, audio_data in chunks:
+        in_flight.append((index, executor.submit(backend.recognize, audio_data, language)))
+        if len(in_flight) >= 2 * backend.max_concurrency:
+            collect(*in_flight.popleft())
+    while in_flight:
+        collect(*in_flight.popleft())
+
+    return texts
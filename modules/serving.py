@@ -0,0 +1,218 @@
+"""
+Model preloading, warmup and readiness for multi-process serving
+Under gunicorn (see gunicorn.conf.py) the master loads every model before forking
+and freezes the heap, so the workers share one copy of the weights copy-on-write.
+Each worker then runs one small inference per task before it takes requests.
+Run any other way (flask run, another WSGI server), a process is ready from the
+start and loads models lazily on first use.
+"""
+import gc
+import logging
+import os
+import time
+from utils.model_registry import registry
+from utils.resources import current_rss_bytes, memory_breakdown
+
+logger = logging.getLogger(__name__)
+
+SERVING_TASKS = ('summarization', 'generation', 'style_transfer', 'speech')
+# Tasks whose models are loaded in the master and warmed up in each worker
+SERVING_PRELOAD = [task.strip() for task in os.environ.get('SERVING_PRELOAD', ','.join(SERVING_TASKS)).split(',')
+                   if task.strip()]
+
+# Readiness of this process; set once warmup() (or mark_ready()) has run. A process with
+# no warmup due (see reset_start) counts as ready from the start
+_state = {
+    'started_at': time.monotonic(),
+    'ready': False,
+    'ready_seconds': None,
+    'warmup': {},
+    'warmup_due': False,
+}
+
+
+def _preload_summarization():
+    from modules import summarization
+    summarization.get_model()
+
+
+def _preload_generation():
+    from modules import text_generation
+    text_generation.get_model()
+    if text_generation.SPECULATIVE:
+        text_generation.get_draft_model()
+
+
+def _preload_style_transfer():
+    from modules import neural_style_transfer
+    neural_style_transfer.get_feature_extractor()
+
+
+def _preload_speech():
+    # Recognition itself runs in the backend service; only the client is created here
+    from modules.recognizer_backends import get_backend
+    get_backend()
+
+
+def _warmup_summarization():
+    from modules import summarization
+    tokenizer, _ = summarization.get_model()
+    ids = tokenizer("The service is starting up and checking that summaries work.")["input_ids"]
+    # Bypasses the result cache and the scheduler so the model really runs
+    summarization.summarize_token_ids([ids], max_length=20, min_length=5, quality='fast')
+
+
+def _warmup_generation():
+    import torch
+    from modules import text_generation
+    tokenizer, model = text_generation.get_model()
+    inputs = tokenizer.encode("The service is starting up", return_tensors="pt")
+    with torch.no_grad():
+        model.generate(inputs, max_new_tokens=8, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        if text_generation.SPECULATIVE:
+            text_generation.get_draft_model()(inputs)
+
+
+def _warmup_style_transfer():
+    import torch
+    from modules import neural_style_transfer
+    trunk = neural_style_transfer.get_feature_extractor()
+    image = torch.rand(1, 3, 64, 64, device=neural_style_transfer.device)
+    neural_style_transfer.extract_features(trunk, image, neural_style_transfer.STYLE_LAYERS)
+
+
+PRELOADERS = {
+    'summarization': _preload_summarization,
+    'generation': _preload_generation,
+    'style_transfer': _preload_style_transfer,
+    'speech': _preload_speech,
+}
+
+WARMUPS = {
+    'summarization': _warmup_summarization,
+    'generation': _warmup_generation,
+    'style_transfer': _warmup_style_transfer,
+    'speech': _preload_speech,
+}
+
+
+def _check_tasks(tasks):
+    unknown = [task for task in tasks if task not in SERVING_TASKS]
+    if unknown:
+        raise ValueError(f"Unknown serving tasks: {', '.join(unknown)} (expected some of {', '.join(SERVING_TASKS)})")
+    return tasks
+
+
+def _format_memory():
+    memory = memory_breakdown()
+    if memory is None:
+        rss = current_rss_bytes()
+        return f"RSS {rss / 2**20:.0f} MB" if rss is not None else "RSS n/a"
+    return (f"RSS {memory['rss'] / 2**20:.0f} MB (shared {memory['shared'] / 2**20:.0f} MB, "
+            f"private {memory['private'] / 2**20:.0f} MB, PSS {memory['pss'] / 2**20:.0f} MB)")
+
+
+def preload_models(tasks=None):
+    """
+    Load the models of the given tasks in this process and freeze the heap
+    Call in the gunicorn master before forking. Torch runs single-threaded while
+    loading so the master starts no intra-op thread pool, which forked workers
+    could not use; set_worker_threads() picks the worker count after the fork.
+    Returns the seconds spent.
+    """
+    import torch
+
+    tasks = _check_tasks(SERVING_PRELOAD if tasks is None else tasks)
+    start = time.perf_counter()
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        for task in tasks:
+            task_start = time.perf_counter()
+            PRELOADERS[task]()
+            logger.info(f"Preloaded {task} in {time.perf_counter() - task_start:.1f}s")
+    finally:
+        torch.set_num_threads(threads)
+
+    loaded = registry.stats()
+    # Objects that survive until now live for the whole process. Freezing moves them out of
+    # the collector's generations, so collections in the workers never write to their
+    # headers and the pages holding them stay shared
+    gc.collect()
+    gc.freeze()
+
+    seconds = time.perf_counter() - start
+    logger.info(f"Preloaded {len(loaded)} models ({sum(entry['size_bytes'] for entry in loaded) / 2**20:.0f} MB) "
+                f"in {seconds:.1f}s; froze {gc.get_freeze_count()} objects; {_format_memory()}")
+    return seconds
+
+
+def set_worker_threads(workers, threads=None):
+    """Give each of workers processes an equal share of the CPUs for torch intra-op threads"""
+    import torch
+
+    threads = threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+    torch.set_num_threads(threads)
+    return threads
+
+
+def warmup(tasks=None, notify=None):
+    """
+    Run one small inference per task so the first request does not pay for lazy setup
+    notify is called between tasks (gunicorn's worker heartbeat). Marks the process
+    ready and returns the per-task seconds; a failing task is logged and leaves the
+    process not ready.
+    """
+    tasks = _check_tasks(SERVING_PRELOAD if tasks is None else tasks)
+    timings = {}
+    failed = []
+    for task in tasks:
+        start = time.perf_counter()
+        try:
+            WARMUPS[task]()
+        except Exception as e:
+            logger.error(f"Warmup of {task} failed: {e}")
+            failed.append(task)
+        timings[task] = time.perf_counter() - start
+        if notify is not None:
+            notify()
+
+    _state['warmup'] = {'seconds': timings, 'failed': failed}
+    if not failed:
+        mark_ready()
+    logger.info(f"Worker {os.getpid()} warmed up {', '.join(tasks) or 'nothing'} in {sum(timings.values()):.1f}s; "
+                f"{'ready' if not failed else 'NOT ready'} {time.monotonic() - _state['started_at']:.1f}s "
+                f"after start; {_format_memory()}")
+    return timings
+
+
+def mark_ready():
+    """Mark this process as ready to serve without (further) warmup"""
+    if not _state['ready']:
+        _state['ready'] = True
+        _state['ready_seconds'] = time.monotonic() - _state['started_at']
+
+
+def reset_start():
+    """
+    Restart the startup clock; call in a freshly forked worker
+    The worker is then only ready once warmup() succeeds, not as soon as models are loaded.
+    """
+    _state.update(started_at=time.monotonic(), ready=False, ready_seconds=None, warmup={}, warmup_due=True)
+
+
+def is_ready():
+    return _state['ready'] or not _state['warmup_due']
+
+
+def status():
+    """Readiness report for this process"""
+    return {
+        'pid': os.getpid(),
+        'ready': is_ready(),
+        'ready_seconds': _state['ready_seconds'],
+        'uptime_seconds': time.monotonic() - _state['started_at'],
+        'warmup': _state['warmup'],
+        'models': [entry['name'] for entry in registry.stats()],
+        'memory': memory_breakdown(),
+    }
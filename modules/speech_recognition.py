@@ -2,7 +2,12 @@ import speech_recognition as sr
 from pydub import AudioSegment
 import os
 import logging
-from utils.file_handling import convert_audio_format
+from utils.audio_processing import (
+    WavReader, decode_audio_stream, iter_audio_chunks, iter_speech_segments, pcm_sha256, SAMPLE_WIDTH
+)
+from utils.file_handling import file_sha256
+from utils.result_cache import result_cache, cache_key
+from modules.recognizer_backends import get_backend, recognize_chunks
 
 # FFmpeg configuration (keep this at the top)
 FFMPEG_PATH = r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"
@@ -17,14 +22,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def transcribe_audio(audio_path: str, language: str = 'en-US') -> str:
+def transcribe_audio(audio_path: str, language: str = 'en-US', chunk_seconds: int = 30,
+                     segmentation: str = 'vad', backend: str = None) -> str:
     """
-    Transcribe audio file to text using Google Speech Recognition
-    Handles long audio files by splitting them into 30-second chunks
+    Transcribe audio file to text using Google Speech Recognition (or another backend)
+    Handles long audio files by splitting them into chunks of at most 30 seconds
+    WAV files are read directly; other formats are decoded in memory, never to a second file
     
     Args:
         audio_path: Path to the audio file
         language: Language code for speech recognition
+        chunk_seconds: Maximum length of each recognized chunk
+        segmentation: 'vad' cuts chunks at silences and skips silent stretches,
+            'fixed' cuts fixed-length windows
+        backend: Recognizer backend name from modules.recognizer_backends
+            (default: the SPEECH_BACKEND environment variable, else 'google')
         
     Returns:
         Transcribed text as a string
@@ -34,62 +46,82 @@ def transcribe_audio(audio_path: str, language: str = 'en-US') -> str:
         if not os.path.exists(audio_path):
             raise FileNotFoundError(f"Audio file not found: {audio_path}")
 
+        # The same file with the same settings is served from the result cache before decoding
+        key = cache_key('transcript-file', file_sha256(audio_path), language, chunk_seconds,
+                        segmentation, get_backend(backend).name)
+        hit, transcript = result_cache.get(key)
+        if hit:
+            logger.info(f"Transcript for {audio_path} served from cache")
+            return transcript
+
         logger.info(f"Starting processing for: {audio_path}")
 
-        # Convert to WAV if needed
-        if not audio_path.lower().endswith('.wav'):
-            logger.info("Converting to WAV format...")
-            audio_path = convert_audio_format(audio_path, 'wav')
-            if not os.path.exists(audio_path):
-                raise ValueError("Audio conversion failed")
-
-        # Get duration using pydub
-        audio = AudioSegment.from_wav(audio_path)
-        duration_seconds = len(audio) / 1000  # Convert ms to seconds
-        logger.info(f"Audio duration: {duration_seconds:.2f} seconds")
-
-        # Initialize recognizer
-        recognizer = sr.Recognizer()
-        full_text = []
-
-        # Process in 30-second chunks
-        chunk_size = 30  # seconds
-        for i, start_time in enumerate(range(0, int(duration_seconds), chunk_size)):
-            end_time = min(start_time + chunk_size, duration_seconds)
-            logger.info(f"Processing chunk {i+1}: {start_time}-{end_time}s")
-
-            try:
-                with sr.AudioFile(audio_path) as source:
-                    # Seek to start time and record chunk
-                    recognizer.adjust_for_ambient_noise(source)
-                    audio_chunk = recognizer.record(
-                        source, 
-                        offset=start_time, 
-                        duration=chunk_size
-                    )
-                    
-                    text = recognizer.recognize_google(
-                        audio_chunk, 
-                        language=language
-                    )
-                    full_text.append(text)
-                    
-            except sr.UnknownValueError:
-                logger.warning(f"Could not understand audio in chunk {i+1}")
-            except sr.RequestError as e:
-                logger.error(f"API error in chunk {i+1}: {e}")
-            except Exception as e:
-                logger.error(f"Error processing chunk {i+1}: {str(e)}")
-
-        if not full_text:
-            raise ValueError("No speech detected in audio file")
-
-        return ' '.join(full_text).strip()
+        if audio_path.lower().endswith('.wav'):
+            reader = WavReader(audio_path)
+        else:
+            logger.info("Decoding audio in memory...")
+            with open(audio_path, 'rb') as f:
+                reader = decode_audio_stream(f)
+
+        # The file hash already identifies the audio, so the decoded samples are not hashed again
+        with reader:
+            return transcribe_pcm(reader, language, chunk_seconds, segmentation, backend, key=key)
 
     except Exception as e:
         logger.error(f"Transcription failed: {str(e)}")
         raise
 
+def transcribe_pcm(reader, language: str = 'en-US', chunk_seconds: int = 30,
+                   segmentation: str = 'vad', backend: str = None, key: str = None) -> str:
+    """
+    Transcribe decoded audio from a WavReader or PCMBuffer
+    Without a result cache key the audio is hashed for one, then read once more as
+    chunks taken in order from the reader; callers that already know a key for the
+    audio (such as transcribe_audio's file hash) pass it to skip that pass. Other
+    arguments are the same as for transcribe_audio
+    """
+    backend = get_backend(backend)
+    logger.info(f"Audio duration: {reader.duration:.2f} seconds")
+
+    # Identical audio (after decoding) with the same settings is served from the result cache
+    if key is None:
+        key = cache_key('transcript', pcm_sha256(reader), reader.sample_rate, language, chunk_seconds,
+                        segmentation, backend.name)
+        hit, transcript = result_cache.get(key)
+        if hit:
+            logger.info("Transcript served from cache")
+            return transcript
+
+    # Chunks are read sequentially from one reader
+    vad_report = {}
+    if segmentation == 'vad':
+        chunks = iter_speech_segments(reader, max_segment_seconds=chunk_seconds, report=vad_report)
+    elif segmentation == 'fixed':
+        chunks = iter_audio_chunks(reader, chunk_seconds)
+    else:
+        raise ValueError(f"Unknown segmentation: {segmentation}")
+
+    def audio_chunks():
+        for i, start_time, samples in chunks:
+            logger.info(f"Processing chunk {i+1}: {start_time:.2f}s, "
+                        f"{len(samples) / reader.sample_rate:.2f}s of audio")
+            yield i, sr.AudioData(samples.tobytes(), reader.sample_rate, SAMPLE_WIDTH)
+
+    # Chunks are recognized concurrently; texts come back in order
+    full_text = recognize_chunks(audio_chunks(), backend, language)
+
+    if vad_report:
+        logger.info(f"Voice activity: {vad_report['speech_seconds']:.1f}s of speech in "
+                    f"{vad_report['total_seconds']:.1f}s, {vad_report['regions']} regions, "
+                    f"threshold {vad_report['threshold_db']:.1f} dBFS")
+
+    if not full_text:
+        raise ValueError("No speech detected in audio file")
+
+    transcript = ' '.join(full_text).strip()
+    result_cache.put(key, transcript)
+    return transcript
+
 # Example usage
 if __name__ == "__main__":
     try:
@@ -0,0 +1,142 @@
+"""
+Background style transfer shared by the web pages and the JSON API
+Uploads and outputs live in content-addressed stores; transfers run on a bounded
+job pool and identical requests share one stored output or one running job.
+"""
+import logging
+import os
+from utils.jobs import JobManager, QueueFull
+from utils.upload_store import UploadStore
+from utils.metrics import stage
+from utils.result_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Style transfer runs in the background on a bounded worker pool; requests only submit and poll
+STYLE_TRANSFER_WORKERS = int(os.environ.get('STYLE_TRANSFER_WORKERS', '1'))
+STYLE_TRANSFER_MAX_PENDING = int(os.environ.get('STYLE_TRANSFER_MAX_PENDING', '20'))
+# Directory shared by the worker processes for job records, so any worker answers status
+# polls and cancels (default: jobs are only known to the process that accepted them)
+JOBS_DIR = os.environ.get('JOBS_DIR') or None
+
+# Style transfer images and outputs are stored under their SHA-256, so identical files are kept once.
+# A background sweeper deletes files no job is using once they are older than the age limit,
+# then the least recently used ones while a folder is over its size limit
+UPLOAD_MAX_AGE_HOURS = float(os.environ.get('UPLOAD_MAX_AGE_HOURS', '24'))
+UPLOAD_MAX_MB = float(os.environ.get('UPLOAD_MAX_MB', '1024'))
+UPLOAD_SWEEP_INTERVAL = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', '600'))
+
+# Paths relative to the static folder, which is where the pages serve them from
+STATIC_FOLDER = 'static'
+IMAGES_FOLDER = 'uploads/images'
+OUTPUTS_FOLDER = 'uploads/outputs'
+
+style_jobs = JobManager(max_workers=STYLE_TRANSFER_WORKERS, max_pending=STYLE_TRANSFER_MAX_PENDING,
+                        name='style-transfer', store_dir=JOBS_DIR)
+
+image_store = UploadStore(os.path.join(STATIC_FOLDER, IMAGES_FOLDER),
+                          max_age_seconds=UPLOAD_MAX_AGE_HOURS * 3600,
+                          max_bytes=int(UPLOAD_MAX_MB * 1024 * 1024))
+output_store = UploadStore(os.path.join(STATIC_FOLDER, OUTPUTS_FOLDER),
+                           max_age_seconds=UPLOAD_MAX_AGE_HOURS * 3600,
+                           max_bytes=int(UPLOAD_MAX_MB * 1024 * 1024))
+
+
+def start_sweepers():
+    """Start the upload sweepers; call per process so forked workers get their own thread"""
+    for store in (image_store, output_store):
+        store.start_sweeper(UPLOAD_SWEEP_INTERVAL)
+
+
+def submit_style_transfer(content_stream, content_ext, style_stream, style_ext):
+    """
+    Store a content/style pair and queue its style transfer
+    Returns a dict with the content_image and style_image paths (relative to the
+    static folder) and either output_image, when the pair was already stylized,
+    or the job producing it. Raises QueueFull when too many jobs are waiting.
+    """
+    # Identical uploads are stored once, under the SHA-256 of their content
+    with stage('style_transfer', 'upload_save'):
+        content_digest, content_path = image_store.put(content_stream, content_ext)
+        style_digest, style_path = image_store.put(style_stream, style_ext)
+    submission = {
+        'content_image': f'{IMAGES_FOLDER}/{os.path.basename(content_path)}',
+        'style_image': f'{IMAGES_FOLDER}/{os.path.basename(style_path)}',
+        'output_image': None,
+        'job': None,
+    }
+
+    # The same pair of images with the same settings reuses the stored output
+    output_key = style_output_key(content_digest, style_digest, style_path)
+    output_path = output_store.lookup(output_key, 'jpg')
+    if output_path:
+        logger.info(f"Reusing stored style transfer output {output_path}")
+        submission['output_image'] = f'{OUTPUTS_FOLDER}/{os.path.basename(output_path)}'
+        return submission
+
+    # A job already working on the same pair, in any process, is shared instead of started twice
+    output_path = output_store.path_for(output_key, 'jpg')
+    output_relative_path = f'{OUTPUTS_FOLDER}/{os.path.basename(output_path)}'
+    # Keep the inputs from being swept, by any process, until the job is done with them
+    # (a shared job holds its own references, so these are only kept by a newly submitted one)
+    acquired, submitted = [], False
+    try:
+        for path in (content_path, style_path):
+            image_store.acquire(path)
+            acquired.append(path)
+        job, submitted = style_jobs.submit_once(output_key, run_style_transfer_job, content_path,
+                                                style_path, output_path, output_relative_path,
+                                                content_digest, style_digest, kind='style-transfer')
+    finally:
+        if not submitted:
+            for path in acquired:
+                image_store.release(path)
+
+    submission['job'] = job
+    return submission
+
+
+def run_style_transfer_job(job, content_path, style_path, output_path, output_relative_path,
+                           content_digest=None, style_digest=None):
+    """
+    Background job body: runs the optimization and reports each step to the job
+    Releases the uploads acquired when the job was submitted. The digests the
+    uploads are stored under are passed on so the images are not hashed again.
+    """
+    def progress(step, num_steps, style_score, content_score):
+        job.check_cancelled()
+        job.update(step=step, num_steps=num_steps, style_loss=style_score,
+                   content_loss=content_score, loss=style_score + content_score)
+
+    # Imported on first use: it brings in torch and torchvision, which job status pages do not need
+    from modules.neural_style_transfer import perform_style_transfer
+
+    try:
+        job.check_cancelled()
+        report = {}
+        success, result_info = perform_style_transfer(content_path, style_path, output_path,
+                                                      progress=progress, report=report,
+                                                      content_digest=content_digest,
+                                                      style_digest=style_digest)
+        # A cancel surfaces from perform_style_transfer as a failed result
+        job.check_cancelled()
+    finally:
+        image_store.release(content_path)
+        image_store.release(style_path)
+    if not success:
+        print(f"Style transfer failed: {result_info}") # Log the error
+        raise RuntimeError(result_info)
+    return {'output_image': output_relative_path, 'report': report}
+
+
+def style_output_key(content_digest, style_digest, style_path, **options):
+    """
+    Name of the stored output for a content/style pair under the given perform_style_transfer
+    options (default: those run_style_transfer_job uses); any setting that shapes the output,
+    including a trained network for the style, gives a different name
+    """
+    from modules.neural_style_transfer import transfer_settings
+    settings = transfer_settings(style_path, style_digest=style_digest, **options)
+    key = cache_key('style-output', content_digest, style_digest, *settings)
+    # Stored names are bare SHA-256 digests, so the namespace prefix is left off
+    return key.rpartition('-')[2]
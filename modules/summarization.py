@@ -1,52 +1,349 @@
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM, StoppingCriteriaList
 import torch
-from utils.text_processing import chunk_text, clean_text
+import hashlib
+import os
+import time
+import logging
+from utils.text_processing import (
+    build_chunks, clean_text, encode_segments, select_sentences, sentence_scores,
+    split_sentences
+)
+from utils.model_registry import registry
+from utils.batching import MicroBatcher
+from utils.result_cache import result_cache, cache_key
+from utils.precision import INFERENCE_PRECISION, apply_precision, check_precision
+from utils.deadline import DeadlineCriteria, deadline_after, expired
+from utils.metrics import stage
 
-# Load model and tokenizer
 model_name = "facebook/bart-large-cnn"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
 
-def summarize_text(text, max_length=150, min_length=30, chunk_size=1024):
+# Cross-request batching: requests arriving within the wait window share one generate call
+BATCH_MAX_SIZE = int(os.environ.get('SUMMARIZATION_BATCH_SIZE', '8'))
+BATCH_WAIT_MS = float(os.environ.get('SUMMARIZATION_BATCH_WAIT_MS', '20'))
+
+# Long documents: chunks per generate call, bound on reduce levels, and the
+# combined length (in words) below which chunk summaries are returned as-is
+MAP_BATCH_SIZE = int(os.environ.get('SUMMARIZATION_MAP_BATCH_SIZE', '8'))
+MAX_REDUCE_LEVELS = int(os.environ.get('SUMMARIZATION_MAX_LEVELS', '3'))
+REDUCE_THRESHOLD_WORDS = 500
+
+# Optional extractive stage: documents longer than this many tokens are cut down to their
+# most central sentences before BART sees them (0 disables it)
+EXTRACT_TOKEN_BUDGET = int(os.environ.get('SUMMARIZATION_EXTRACT_TOKENS', '0'))
+EXTRACT_METHOD = os.environ.get('SUMMARIZATION_EXTRACT_METHOD', 'textrank')
+
+# 'fp32' or 'int8' (dynamic quantization of the Linear layers, applied at load time)
+PRECISION = os.environ.get('SUMMARIZATION_PRECISION', INFERENCE_PRECISION)
+
+# Quality tiers trade summary quality for latency through the beam search settings
+QUALITY_TIERS = {
+    'fast': {'num_beams': 1, 'length_penalty': 1.0, 'no_repeat_ngram_size': 3},
+    'balanced': {'num_beams': 2, 'length_penalty': 2.0},
+    'best': {'num_beams': 4, 'length_penalty': 2.0},
+}
+DEFAULT_QUALITY = os.environ.get('SUMMARIZATION_QUALITY', 'best')
+# Per-request time limit in seconds; when it passes the best partial summary is returned (0: none)
+DEADLINE_SECONDS = float(os.environ.get('SUMMARIZATION_DEADLINE_SECONDS', '0'))
+
+logger = logging.getLogger(__name__)
+
+def check_quality(quality):
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier: {quality} (expected one of {', '.join(QUALITY_TIERS)})")
+    return quality
+
+def load_model(precision=PRECISION):
+    """Load the summarization tokenizer and model at the given precision"""
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    model.eval()
+    return tokenizer, apply_precision(model, precision)
+
+def get_model(precision=None):
+    """Return the shared (tokenizer, model) pair, loading it on first use"""
+    precision = check_precision(precision or PRECISION)
+    return registry.get(f"{model_name}:{precision}", lambda: load_model(precision))
+
+def summarize_token_ids(id_lists, max_length=150, min_length=30, precision=None,
+                        quality=None, deadline=None, report=None):
     """
-    Summarize long text by processing it in chunks
+    Summarize already tokenized inputs with a single padded generate call
+    Each entry is a list of token IDs including special tokens
+    quality names a QUALITY_TIERS entry; deadline is a time.monotonic() value after
+    which generation stops with the best beams so far, setting report['truncated']
     """
-    # Clean and prepare text
-    text = clean_text(text)
-    
-    # If text is short, process directly
-    if len(text.split()) < 500:
-        inputs = tokenizer([text], max_length=chunk_size, truncation=True, return_tensors="pt")
+    tokenizer, model = get_model(precision)
+    tier = QUALITY_TIERS[check_quality(quality or DEFAULT_QUALITY)]
+    criteria = DeadlineCriteria(deadline)
+    inputs = tokenizer.pad({"input_ids": id_lists}, return_tensors="pt")
+    with stage('summarization', 'generate'), torch.no_grad():
         summary_ids = model.generate(
             inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
             max_length=max_length,
             min_length=min_length,
-            length_penalty=2.0,
-            num_beams=4,
-            early_stopping=True
+            early_stopping=True,
+            stopping_criteria=StoppingCriteriaList([criteria]),
+            **tier
         )
-        return tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+    if report is not None:
+        report['truncated'] = report.get('truncated', False) or criteria.triggered
+    with stage('summarization', 'decode'):
+        return tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+def _summarize_requests(requests):
+    """
+    Batch function for the scheduler; requests with different settings are generated separately
+    Requests without a deadline never share a batch with ones that have one; a batch
+    of deadline-bound requests stops at the earliest of their deadlines.
+    Returns (summary, truncated) for each request.
+    """
+    results = [None] * len(requests)
+    groups = {}
+    for index, (_, settings, deadline) in enumerate(requests):
+        groups.setdefault((settings, deadline is not None), []).append(index)
+    for (settings, has_deadline), indices in groups.items():
+        max_length, min_length, quality = settings
+        deadline = min(requests[i][2] for i in indices) if has_deadline else None
+        report = {}
+        summaries = summarize_token_ids([requests[i][0] for i in indices], max_length, min_length,
+                                        quality=quality, deadline=deadline, report=report)
+        for index, summary in zip(indices, summaries):
+            results[index] = (summary, report['truncated'])
+    return results
+
+batcher = MicroBatcher(_summarize_requests, max_batch_size=BATCH_MAX_SIZE,
+                       max_wait_ms=BATCH_WAIT_MS, name='summarization')
+
+def summarize_text(text, max_length=150, min_length=30, chunk_size=1024,
+                   extract_budget=None, extract_method=None, report=None,
+                   quality=None, deadline_seconds=None):
+    """
+    Summarize long text by processing it in chunks
+    With an extract budget, long documents are first reduced to their most central
+    sentences (see extract_chunks). quality picks a QUALITY_TIERS entry (default:
+    SUMMARIZATION_QUALITY). After deadline_seconds (default:
+    SUMMARIZATION_DEADLINE_SECONDS) the best partial summary is returned and
+    report['truncated'] is set. report, if given, is also filled in with the
+    extractive stage's budget and compression and, for multi-chunk documents,
+    the map-reduce levels.
+    """
+    extract_budget = EXTRACT_TOKEN_BUDGET if extract_budget is None else extract_budget
+    extract_method = extract_method or EXTRACT_METHOD
+    quality = check_quality(quality or DEFAULT_QUALITY)
+    deadline = deadline_after(DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    report = {} if report is None else report
+    report.update(quality=quality, truncated=False)
+
+    # Clean and prepare text
+    text = clean_text(text)
     
-    # For long texts, process in chunks and combine
-    chunks = chunk_text(text, chunk_size=chunk_size)
-    summaries = []
+    # Beam search is deterministic, so identical requests are served from the result cache
+    key = _summary_key(text, max_length, min_length, chunk_size, extract_budget, extract_method, quality)
+    hit, summary = result_cache.get(key)
+    if hit:
+        report['cached'] = True
+        return summary
     
-    for chunk in chunks:
-        inputs = tokenizer([chunk], max_length=chunk_size, truncation=True, return_tensors="pt")
-        summary_ids = model.generate(
-            inputs["input_ids"],
-            max_length=max_length,
-            min_length=min_length,
-            length_penalty=2.0,
-            num_beams=4,
-            early_stopping=True
-        )
-        summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-        summaries.append(summary)
-    
-    # Combine chunk summaries and summarize again if needed
+    # If the text fits in one window, hand its token IDs to the batching scheduler
+    tokenizer, _ = get_model()
+    chunks, report['extract'] = extract_chunks(text, tokenizer, chunk_size, extract_budget, extract_method)
+    if not chunks:
+        return ""
+    if len(chunks) == 1:
+        summary, report['truncated'] = batcher.submit((chunks[0], (max_length, min_length, quality), deadline))
+    else:
+        # For long texts, summarize the chunks as a map-reduce tree
+        summary, stats = summarize_map_reduce(text, max_length, min_length, chunk_size, chunks=chunks,
+                                              quality=quality, deadline=deadline)
+        report.update(levels=stats['levels'], total_seconds=stats['total_seconds'],
+                      truncated=stats['truncated'])
+    # Partial summaries depend on timing, so only complete ones are cached
+    if not report['truncated']:
+        result_cache.put(key, summary)
+    return summary
+
+def summarize_texts(texts, max_length=150, min_length=30, chunk_size=1024, quality=None,
+                    deadline_seconds=None, extract_budget=None, extract_method=None,
+                    batch_size=MAP_BATCH_SIZE):
+    """
+    Summarize many texts, sharing padded generate calls between them
+    Texts that fit in one window are sorted by length and summarized batch_size at
+    a time; longer ones go through summarize_map_reduce. The deadline covers the
+    whole call, and a text that fails does not affect the others.
+    Returns one dict per text: {'summary', 'truncated', 'cached'} or {'error'}
+    """
+    extract_budget = EXTRACT_TOKEN_BUDGET if extract_budget is None else extract_budget
+    extract_method = extract_method or EXTRACT_METHOD
+    quality = check_quality(quality or DEFAULT_QUALITY)
+    deadline = deadline_after(DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    tokenizer, _ = get_model()
+    results = [None] * len(texts)
+    single = []
+
+    for index, text in enumerate(texts):
+        try:
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError("Text is empty")
+            text = clean_text(text)
+            key = _summary_key(text, max_length, min_length, chunk_size, extract_budget, extract_method, quality)
+            hit, summary = result_cache.get(key)
+            if hit:
+                results[index] = {'summary': summary, 'truncated': False, 'cached': True}
+                continue
+            chunks, _ = extract_chunks(text, tokenizer, chunk_size, extract_budget, extract_method)
+            if len(chunks) == 1:
+                single.append((index, chunks[0], key))
+                continue
+            summary, stats = summarize_map_reduce(text, max_length, min_length, chunk_size, batch_size,
+                                                  chunks=chunks, quality=quality, deadline=deadline)
+            results[index] = {'summary': summary, 'truncated': stats['truncated'], 'cached': False}
+            if not stats['truncated']:
+                result_cache.put(key, summary)
+        except Exception as e:
+            logger.error(f"Summarizing text {index} failed: {e}")
+            results[index] = {'error': str(e)}
+
+    # Similar lengths share a batch, which keeps padding low
+    single.sort(key=lambda item: len(item[1]))
+    for i in range(0, len(single), batch_size):
+        batch = single[i:i + batch_size]
+        report = {}
+        try:
+            summaries = summarize_token_ids([ids for _, ids, _ in batch], max_length, min_length,
+                                            quality=quality, deadline=deadline, report=report)
+        except Exception as e:
+            logger.error(f"Summarizing a batch of {len(batch)} texts failed: {e}")
+            for index, _, _ in batch:
+                results[index] = {'error': str(e)}
+            continue
+        for (index, _, key), summary in zip(batch, summaries):
+            results[index] = {'summary': summary, 'truncated': report['truncated'], 'cached': False}
+            if not report['truncated']:
+                result_cache.put(key, summary)
+    return results
+
+def _summary_key(text, max_length, min_length, chunk_size, extract_budget, extract_method, quality):
+    """Result cache key for a cleaned text and every setting that changes its summary"""
+    return cache_key('summary', hashlib.sha256(text.encode('utf-8')).hexdigest(), model_name, PRECISION,
+                     max_length, min_length, chunk_size, MAX_REDUCE_LEVELS, extract_budget, extract_method,
+                     quality)
+
+def extract_chunks(text, tokenizer, chunk_size=1024, token_budget=0, method='textrank'):
+    """
+    Tokenize text into model-sized chunks, keeping only its most central sentences
+    when it is longer than token_budget tokens
+    Sentences are scored with sentence_scores and the best ones that fit the budget
+    are kept in document order. A token_budget of 0 keeps everything.
+    Returns (chunks, stats) where stats holds the budget, token and sentence counts
+    and the compression (kept tokens / input tokens)
+    """
+    start = time.perf_counter()
+    with stage('summarization', 'tokenize'):
+        sentences = split_sentences(text)
+        if not sentences:
+            return [], None
+        segments = encode_segments(sentences, tokenizer)
+    lengths = [len(ids) for ids in segments]
+    input_tokens = sum(lengths)
+
+    if token_budget and input_tokens > token_budget:
+        with stage('summarization', 'extract'):
+            kept = select_sentences(sentence_scores(sentences, method), lengths, token_budget)
+        segments = [segments[i] for i in kept]
+    kept_tokens = sum(len(ids) for ids in segments)
+
+    stats = {
+        'method': method if token_budget else None,
+        'token_budget': token_budget,
+        'input_tokens': input_tokens,
+        'kept_tokens': kept_tokens,
+        'input_sentences': len(sentences),
+        'kept_sentences': len(segments),
+        'compression': kept_tokens / input_tokens if input_tokens else 1.0,
+        'seconds': time.perf_counter() - start,
+    }
+    if kept_tokens < input_tokens:
+        logger.info(f"Extractive stage kept {len(segments)}/{len(sentences)} sentences, "
+                    f"{kept_tokens}/{input_tokens} tokens ({stats['compression']:.1%})")
+    return build_chunks(segments, tokenizer, chunk_size), stats
+
+def summarize_map_reduce(text, max_length=150, min_length=30, chunk_size=1024,
+                         batch_size=MAP_BATCH_SIZE, max_levels=MAX_REDUCE_LEVELS, chunks=None,
+                         extract_budget=0, extract_method=EXTRACT_METHOD, quality=None, deadline=None):
+    """
+    Summarize a long document as a tree
+    The map level summarizes every chunk in padded batches. Each reduce level packs
+    neighbouring summaries into groups of up to chunk_size tokens and summarizes the
+    groups in batches again, until the combined summary is short enough, a single
+    summary remains, or max_levels reduce levels have run.
+    chunks may carry the output of extract_chunks for text to skip re-tokenizing it;
+    otherwise text is chunked here, after the extractive stage when extract_budget is set.
+    Once the time.monotonic() deadline passes no further batches are started and
+    the summaries produced so far are joined as the result, with stats['truncated'] set.
+    Returns (summary, stats) where stats['levels'] holds per-level sizes and timings
+    and stats['extract'] the extractive stage's budget and compression
+    """
+    tokenizer, _ = get_model()
+    extract_stats = None
+    if chunks is None:
+        chunks, extract_stats = extract_chunks(clean_text(text), tokenizer, chunk_size,
+                                               extract_budget, extract_method)
+    if not chunks:
+        return "", {'levels': [], 'total_seconds': 0.0, 'extract': extract_stats, 'truncated': False}
+    pieces = chunks
+    levels = []
+    report = {'truncated': False}
+    previous = None
+
+    while True:
+        start = time.perf_counter()
+        summaries = []
+        cut_short = False
+        for i in range(0, len(pieces), batch_size):
+            # The first batch always runs so there is something to return
+            if expired(deadline) and (summaries or previous is not None):
+                cut_short = True
+                break
+            summaries.extend(summarize_token_ids(pieces[i:i + batch_size], max_length, min_length,
+                                                 quality=quality, deadline=deadline, report=report))
+        cut_short = cut_short or report['truncated']
+        report['truncated'] = cut_short
+        if cut_short and previous is not None:
+            # An unfinished reduce level would drop content; keep the complete level below it
+            summaries = previous
+            break
+        levels.append({
+            'level': len(levels),
+            'inputs': len(pieces),
+            'outputs': len(summaries),
+            'seconds': time.perf_counter() - start,
+        })
+
+        if cut_short:
+            break
+        combined_summary = " ".join(summaries)
+        if len(summaries) == 1 or len(combined_summary.split()) <= REDUCE_THRESHOLD_WORDS:
+            break
+        if len(levels) > max_levels:
+            logger.warning(f"Stopping map-reduce after {max_levels} reduce levels "
+                           f"with {len(summaries)} partial summaries")
+            break
+        previous = summaries
+        pieces = _group_summaries(summaries, tokenizer, chunk_size)
+
+    for level in levels:
+        logger.info(f"Summarization level {level['level']}: {level['inputs']} -> "
+                    f"{level['outputs']} in {level['seconds']:.2f}s")
     combined_summary = " ".join(summaries)
-    if len(combined_summary.split()) > 500:
-        return summarize_text(combined_summary, max_length, min_length)
-    
-    return combined_summary
\ No newline at end of file
+    stats = {
+        'levels': levels,
+        'total_seconds': sum(level['seconds'] for level in levels),
+        'extract': extract_stats,
+        'truncated': report['truncated'],
+    }
+    return combined_summary, stats
+
+def _group_summaries(summaries, tokenizer, chunk_size):
+    """Tokenize summaries once and pack neighbours into groups that fit in one window"""
+    return build_chunks(encode_segments(summaries, tokenizer), tokenizer, chunk_size)
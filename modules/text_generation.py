@@ -1,58 +1,471 @@
 from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+from transformers import LogitsProcessor, LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper
+from transformers import TopPLogitsWarper, StoppingCriteriaList
 import torch
+import logging
 from utils.text_processing import clean_text
+from utils.model_registry import registry
+from utils.result_cache import result_cache, cache_key
+from utils.precision import INFERENCE_PRECISION, apply_precision, check_precision
+from utils.deadline import DeadlineCriteria, deadline_after, expired
+from utils.metrics import metrics, stage
+import os
+import time
+from contextlib import closing
 
-# Load model and tokenizer
 model_name = "gpt2-medium"  # Can be changed to "gpt2-large" or other models
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name)
 
-def generate_text(prompt, length=100, temperature=0.7, top_k=50, top_p=0.95):
+# 'fp32' or 'int8' (dynamic quantization of the Linear layers, applied at load time)
+PRECISION = os.environ.get('GENERATION_PRECISION', INFERENCE_PRECISION)
+
+# Speculative decoding: a small model sharing GPT-2's tokenizer drafts tokens that
+# the main model verifies in a single forward pass
+draft_model_name = os.environ.get('GENERATION_DRAFT_MODEL', 'distilgpt2')
+DRAFT_TOKENS = int(os.environ.get('GENERATION_DRAFT_TOKENS', '4'))
+SPECULATIVE = os.environ.get('GENERATION_SPECULATIVE', '0') == '1'
+
+# Quality tiers: 'fast' decodes greedily, 'balanced' samples, 'best' samples with a small
+# beam (beam search needs the whole output to fit in the context window)
+QUALITY_TIERS = {
+    'fast': {'do_sample': False, 'num_beams': 1},
+    'balanced': {'do_sample': True, 'num_beams': 1},
+    'best': {'do_sample': True, 'num_beams': 3},
+}
+DEFAULT_QUALITY = os.environ.get('GENERATION_QUALITY', 'balanced')
+# Per-request time limit in seconds; when it passes the text so far is returned (0: none)
+DEADLINE_SECONDS = float(os.environ.get('GENERATION_DEADLINE_SECONDS', '0'))
+# Prompts sampled together by generate_texts
+BATCH_SIZE = int(os.environ.get('GENERATION_BATCH_SIZE', '8'))
+
+logger = logging.getLogger(__name__)
+
+def check_quality(quality):
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier: {quality} (expected one of {', '.join(QUALITY_TIERS)})")
+    return quality
+
+def load_model(precision=PRECISION):
+    """Load the generation tokenizer and model at the given precision"""
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    model.eval()
+    return tokenizer, apply_precision(model, precision)
+
+def get_model(precision=None):
+    """Return the shared (tokenizer, model) pair, loading it on first use"""
+    precision = check_precision(precision or PRECISION)
+    return registry.get(f"{model_name}:{precision}", lambda: load_model(precision))
+
+def load_draft_model(precision=PRECISION):
+    """Load the draft model used for speculative decoding"""
+    model = AutoModelForCausalLM.from_pretrained(draft_model_name)
+    model.eval()
+    return apply_precision(model, precision)
+
+def get_draft_model(precision=None):
+    """Return the shared draft model, loading it on first use"""
+    precision = check_precision(precision or PRECISION)
+    return registry.get(f"{draft_model_name}:{precision}", lambda: load_draft_model(precision))
+
+def generate_text(prompt, length=100, temperature=0.7, top_k=50, top_p=0.95, seed=None,
+                  speculative=None, report=None, quality=None, deadline_seconds=None):
     """
     Generate coherent text based on a prompt using GPT-2
-    Handles long generation by chunking
+    Requests that fit in the model's context run as a single generate call;
+    longer ones continue with a sliding window over the key/value cache.
+    With a seed, sampling is reproducible and the result is cached; without one
+    every call samples afresh. Concurrent calls do not affect each other's draws.
+    speculative (default: GENERATION_SPECULATIVE) drafts tokens with the small
+    draft model and verifies them with GPT-2; the draft acceptance rate is
+    written to report.
+    quality picks a QUALITY_TIERS entry (default: GENERATION_QUALITY). After
+    deadline_seconds (default: GENERATION_DEADLINE_SECONDS) the text generated so
+    far is returned and report['truncated'] is set.
     """
+    speculative = SPECULATIVE if speculative is None else speculative
+    quality = check_quality(quality or DEFAULT_QUALITY)
+    deadline = deadline_after(DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    report = {} if report is None else report
+    report.update(quality=quality, truncated=False)
+    settings = (length, temperature, top_k, top_p, speculative, quality, deadline, report, seed)
+
     # Clean and prepare prompt
     prompt = clean_text(prompt)
-    
-    # Generate text in chunks if needed
-    if length <= 100:
+
+    # Greedy output is deterministic; sampled output only with a seed
+    if seed is None and QUALITY_TIERS[quality]['do_sample']:
+        return _generate(prompt, *settings)
+
+    key = cache_key('generate', prompt, model_name, PRECISION, length, temperature, top_k, top_p, seed,
+                    draft_model_name if speculative else None, quality)
+    hit, text = result_cache.get(key)
+    if hit:
+        report['cached'] = True
+        return text
+    text = _generate(prompt, *settings)
+    # Partial output depends on timing, so only complete text is cached
+    if not report['truncated']:
+        result_cache.put(key, text)
+    return text
+
+def _generate(prompt, length, temperature, top_k, top_p, speculative, quality, deadline, report, seed=None):
+    tokenizer, model = get_model()
+    tier = QUALITY_TIERS[quality]
+    with stage('generation', 'tokenize'):
         inputs = tokenizer.encode(prompt, return_tensors="pt")
-        outputs = model.generate(
-            inputs,
-            max_length=length + len(inputs[0]),
-            temperature=temperature,
-            top_k=top_k,
-            top_p=top_p,
-            do_sample=True,
-            pad_token_id=tokenizer.eos_token_id
-        )
-        return tokenizer.decode(outputs[0], skip_special_tokens=True)
-    else:
-        # For longer generation, use chunking
-        generated = prompt
-        remaining_length = length
-        
-        while remaining_length > 0:
-            chunk_length = min(100, remaining_length)
-            inputs = tokenizer.encode(generated, return_tensors="pt")
-            
-            # Prevent input from being too long
-            if len(inputs[0]) > 1024:
-                inputs = inputs[:, -1024:]
-            
+    max_positions = model.config.max_position_embeddings
+
+    # Speculative decoding samples a single sequence, so beam tiers keep their beams
+    if (speculative and tier['do_sample'] and tier['num_beams'] == 1
+            and len(inputs[0]) + length + DRAFT_TOKENS < max_positions):
+        tokens = speculative_token_ids(inputs, length, temperature, top_k, top_p, report=report,
+                                       generator=_rng(seed))
+    elif len(inputs[0]) + length <= max_positions:
+        criteria = DeadlineCriteria(deadline)
+        sampling = _sampling(tier, temperature, top_k, top_p, seed)
+        with stage('generation', 'generate'), torch.no_grad():
             outputs = model.generate(
                 inputs,
-                max_length=len(inputs[0]) + chunk_length,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
+                max_new_tokens=length,
+                pad_token_id=tokenizer.eos_token_id,
+                stopping_criteria=StoppingCriteriaList([criteria]),
+                **sampling
             )
-            
-            new_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            generated = new_text
-            remaining_length -= chunk_length
-        
-        return generated
\ No newline at end of file
+        report['truncated'] = criteria.triggered
+        with stage('generation', 'decode'):
+            return tokenizer.decode(outputs[0], skip_special_tokens=True)
+    else:
+        # Longer than the context window: decode token by token without re-encoding
+        tokens = iter_token_ids(inputs, length, temperature, top_k, top_p, do_sample=tier['do_sample'],
+                                generator=_rng(seed))
+
+    with stage('generation', 'generate'):
+        new_ids = _collect_until(tokens, deadline, report)
+    with stage('generation', 'decode'):
+        return tokenizer.decode(inputs[0].tolist() + new_ids, skip_special_tokens=True)
+
+def generate_texts(prompts, length=100, temperature=0.7, top_k=50, top_p=0.95, seed=None,
+                   quality=None, deadline_seconds=None, batch_size=BATCH_SIZE):
+    """
+    Generate continuations for many prompts with padded batch generate calls
+    Prompts are left-padded and decoded together batch_size at a time, shortest
+    first; prompts too long for a single pass are generated on their own with the
+    sliding window. With a seed the whole call is reproducible. The deadline covers
+    the whole call, and a prompt that fails does not affect the others.
+    Returns one dict per prompt: {'text', 'truncated'} or {'error'}
+    """
+    quality = check_quality(quality or DEFAULT_QUALITY)
+    deadline = deadline_after(DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    tokenizer, model = get_model()
+    tier = QUALITY_TIERS[quality]
+    pad_id = tokenizer.eos_token_id
+    results = [None] * len(prompts)
+    batched = []
+
+    for index, prompt in enumerate(prompts):
+        try:
+            if not isinstance(prompt, str) or not prompt.strip():
+                raise ValueError("Prompt is empty")
+            prompt = clean_text(prompt)
+            with stage('generation', 'tokenize'):
+                ids = tokenizer.encode(prompt)
+            if len(ids) + length <= model.config.max_position_embeddings:
+                batched.append((index, ids))
+                continue
+            report = {'truncated': False}
+            text = _generate(prompt, length, temperature, top_k, top_p, False, quality, deadline, report, seed)
+            results[index] = {'text': text, 'truncated': report['truncated']}
+        except Exception as e:
+            logger.error(f"Generating for prompt {index} failed: {e}")
+            results[index] = {'error': str(e)}
+
+    batched.sort(key=lambda item: len(item[1]))
+    for i in range(0, len(batched), batch_size):
+        batch = batched[i:i + batch_size]
+        width = max(len(ids) for _, ids in batch)
+        input_ids = torch.tensor([[pad_id] * (width - len(ids)) + ids for _, ids in batch])
+        attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for _, ids in batch])
+        criteria = DeadlineCriteria(deadline)
+        try:
+            sampling = _sampling(tier, temperature, top_k, top_p, seed)
+            with stage('generation', 'generate'), torch.no_grad():
+                outputs = model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=length,
+                    pad_token_id=pad_id,
+                    stopping_criteria=StoppingCriteriaList([criteria]),
+                    **sampling
+                )
+        except Exception as e:
+            logger.error(f"Generating for a batch of {len(batch)} prompts failed: {e}")
+            for index, _ in batch:
+                results[index] = {'error': str(e)}
+            continue
+        with stage('generation', 'decode'):
+            for row, (index, ids) in enumerate(batch):
+                new_ids = outputs[row, width:].tolist()
+                results[index] = {
+                    'text': tokenizer.decode(ids + new_ids, skip_special_tokens=True),
+                    'truncated': criteria.triggered,
+                }
+    return results
+
+def _collect_until(tokens, deadline, report):
+    """Gather token IDs from a generator, closing it early once the deadline passes"""
+    new_ids = []
+    try:
+        for token_id in tokens:
+            new_ids.append(token_id)
+            if expired(deadline):
+                report['truncated'] = True
+                break
+    finally:
+        tokens.close()
+    return new_ids
+
+def _sampling_warpers(temperature, top_k, top_p, min_tokens_to_keep=1):
+    """Temperature, top-k and top-p warpers; as in generate(), top_k=0 and top_p=1 turn theirs off"""
+    warpers = LogitsProcessorList([TemperatureLogitsWarper(temperature)])
+    if top_k:
+        warpers.append(TopKLogitsWarper(max(top_k, min_tokens_to_keep)))
+    if top_p < 1.0:
+        warpers.append(TopPLogitsWarper(top_p, min_tokens_to_keep=min_tokens_to_keep))
+    return warpers
+
+def _rng(seed=None):
+    """A torch.Generator private to one call, seeded for reproducible output or else from fresh entropy"""
+    generator = torch.Generator()
+    if seed is None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+    return generator
+
+class GeneratorSampler(LogitsProcessor):
+    """
+    Sample each next token inside generate() from a private torch.Generator
+    generate() runs greedy or beam search with this processor: it warps the scores,
+    samples num_samples distinct tokens per row and leaves only those selectable,
+    at their original scores, so beam search ranks the sampled continuations.
+    """
+
+    def __init__(self, warpers, generator, num_samples=1):
+        self.warpers = warpers
+        self.generator = generator
+        self.num_samples = num_samples
+
+    def __call__(self, input_ids, scores):
+        probs = torch.softmax(self.warpers(input_ids, scores), dim=-1)
+        tokens = torch.multinomial(probs, num_samples=self.num_samples, generator=self.generator)
+        return torch.full_like(scores, -float('inf')).scatter_(1, tokens, scores.gather(1, tokens))
+
+def _sampling(tier, temperature, top_k, top_p, seed=None):
+    """
+    generate() keyword arguments for a quality tier, sampling without touching other threads' draws
+    Sampling goes through GeneratorSampler rather than torch's shared global generator.
+    With beams each beam samples as many candidates as beam search keeps per step
+    (twice the beam count), and beam search picks the most likely of them.
+    """
+    if tier['do_sample']:
+        num_samples = 1 if tier['num_beams'] == 1 else 2 * tier['num_beams']
+        warpers = _sampling_warpers(temperature, top_k, top_p, min_tokens_to_keep=num_samples)
+        sampler = GeneratorSampler(warpers, _rng(seed), num_samples)
+        return {'do_sample': False, 'num_beams': tier['num_beams'],
+                'logits_processor': LogitsProcessorList([sampler])}
+    # Greedy decoding ignores the sampling settings, and generate() warns when it is given them
+    return dict(tier)
+
+def _crop_cache(past, length):
+    """Keep the first length positions of a GPT-2 key/value cache"""
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past)
+
+def speculative_token_ids(input_ids, length, temperature=0.7, top_k=50, top_p=0.95,
+                          num_draft_tokens=None, report=None, generator=None):
+    """
+    Sample up to length new tokens with speculative decoding, yielding each token ID
+    Each round the draft model samples num_draft_tokens tokens one at a time, then
+    the main model scores all of them in one forward pass. Draft token x is kept
+    with probability min(1, p(x) / q(x)), where p and q are the main and draft
+    distributions after the temperature/top-k/top-p warpers; at the first rejection
+    a replacement is drawn from max(0, p - q). This samples exactly from the main
+    model's distribution. Both key/value caches are cropped back to the accepted
+    tokens after each round.
+    The prompt plus length plus num_draft_tokens must fit in the models' context.
+    report, if given, receives the drafted and accepted counts and the acceptance rate.
+    Draws come from generator (default: a fresh private one).
+    """
+    num_draft_tokens = num_draft_tokens or DRAFT_TOKENS
+    generator = generator or _rng()
+    tokenizer, model = get_model()
+    draft = get_draft_model()
+    if draft.config.vocab_size != model.config.vocab_size:
+        raise ValueError(f"Draft model {draft_model_name} does not share the tokenizer of {model_name}")
+    warpers = _sampling_warpers(temperature, top_k, top_p)
+    report = {} if report is None else report
+    report.update(mode='speculative', draft_model=draft_model_name, draft_tokens=num_draft_tokens,
+                  drafted=0, accepted=0, target_passes=0, tokens=0)
+
+    def probabilities(context, logits):
+        return torch.softmax(warpers(context, logits), dim=-1)
+
+    context = input_ids
+    target_past = draft_past = None
+    target_pending = draft_pending = context
+    produced = 0
+    with torch.no_grad():
+        try:
+            while produced < length:
+                k = min(num_draft_tokens, length - produced)
+
+                # Draft k tokens autoregressively with the small model
+                drafted = context
+                draft_probs = []
+                for _ in range(k):
+                    outputs = draft(input_ids=draft_pending, past_key_values=draft_past, use_cache=True)
+                    draft_past = outputs.past_key_values
+                    q = probabilities(drafted, outputs.logits[:, -1, :])
+                    token = torch.multinomial(q, num_samples=1, generator=generator)
+                    draft_probs.append(q)
+                    drafted = torch.cat([drafted, token], dim=-1)
+                    draft_pending = token
+                draft_tokens = drafted[:, context.shape[1]:]
+
+                # Score every drafted position (and one past the last) in one pass
+                outputs = model(input_ids=torch.cat([target_pending, draft_tokens], dim=-1),
+                                past_key_values=target_past, use_cache=True)
+                target_past = outputs.past_key_values
+                logits = outputs.logits[:, -(k + 1):, :]
+                report['target_passes'] += 1
+                report['drafted'] += k
+
+                accepted = 0
+                new_token = None
+                for i in range(k):
+                    p = probabilities(drafted[:, :context.shape[1] + i], logits[:, i, :])
+                    q = draft_probs[i]
+                    token = draft_tokens[0, i]
+                    if torch.rand(1, generator=generator).item() < min(1.0, (p[0, token] / q[0, token]).item()):
+                        accepted += 1
+                        continue
+                    residual = torch.clamp(p - q, min=0)
+                    total = residual.sum()
+                    new_token = torch.multinomial(residual / total if total > 0 else p, num_samples=1,
+                                                  generator=generator)
+                    break
+                if new_token is None:
+                    # Every draft was accepted: the extra position gives one more token for free
+                    new_token = torch.multinomial(probabilities(drafted, logits[:, k, :]), num_samples=1,
+                                                  generator=generator)
+                report['accepted'] += accepted
+
+                # Drop the rejected drafts from both caches
+                kept = context.shape[1] + accepted
+                target_past = _crop_cache(target_past, kept)
+                target_pending = new_token
+                if accepted == k:
+                    # The draft never ran its own last token
+                    draft_pending = torch.cat([draft_tokens[:, -1:], new_token], dim=-1)
+                    draft_past = _crop_cache(draft_past, kept - 1)
+                else:
+                    draft_pending = new_token
+                    draft_past = _crop_cache(draft_past, kept)
+
+                new_tokens = torch.cat([draft_tokens[:, :accepted], new_token], dim=-1)
+                context = torch.cat([context, new_tokens], dim=-1)
+                for token_id in new_tokens[0].tolist():
+                    if token_id == tokenizer.eos_token_id or produced >= length:
+                        return
+                    produced += 1
+                    report['tokens'] = produced
+                    yield token_id
+        finally:
+            report['acceptance_rate'] = report['accepted'] / report['drafted'] if report['drafted'] else 0.0
+            if report['target_passes']:
+                logger.info(f"Speculative decoding: {report['accepted']}/{report['drafted']} drafts accepted "
+                            f"({report['acceptance_rate']:.0%}), {report['tokens']} tokens in "
+                            f"{report['target_passes']} passes of {model_name}")
+
+def iter_token_ids(input_ids, length, temperature=0.7, top_k=50, top_p=0.95, do_sample=True, generator=None):
+    """
+    Sample up to length new tokens after input_ids, yielding each token ID as it is produced
+    (or pick the most likely token at each step when do_sample is False)
+    The key/value cache is reused between steps, so each step only runs the newest
+    token through the model. When the context reaches the model's position limit
+    the oldest tokens are dropped and the cache is rebuilt once from the most
+    recent half window. Samples come from generator (default: a fresh private one).
+    """
+    tokenizer, model = get_model()
+    max_positions = model.config.max_position_embeddings
+    keep = max_positions // 2
+    generator = generator or _rng()
+    warpers = _sampling_warpers(temperature, top_k, top_p)
+
+    context = input_ids[:, -(max_positions - 1):]
+    pending = context
+    past = None
+    with torch.no_grad():
+        for _ in range(length):
+            outputs = model(input_ids=pending, past_key_values=past, use_cache=True)
+            past = outputs.past_key_values
+            if do_sample:
+                scores = warpers(context, outputs.logits[:, -1, :])
+                next_token = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1, generator=generator)
+            else:
+                next_token = outputs.logits[:, -1, :].argmax(dim=-1, keepdim=True)
+
+            token_id = next_token.item()
+            if token_id == tokenizer.eos_token_id:
+                return
+            yield token_id
+
+            context = torch.cat([context, next_token], dim=-1)
+            if context.shape[1] >= max_positions:
+                # Slide the window; positions restart from zero for the kept tokens
+                context = context[:, -keep:]
+                pending = context
+                past = None
+            else:
+                pending = next_token
+
+def stream_text(prompt, length=100, temperature=0.7, top_k=50, top_p=0.95,
+                quality=None, deadline_seconds=None, report=None):
+    """
+    Generate text like generate_text, yielding new text fragments as tokens are produced
+    Only the continuation is yielded, not the prompt. Closing the generator stops
+    generation after the current token. Streaming decodes greedily for the 'fast'
+    tier and samples otherwise; once the deadline passes the stream ends and
+    report['truncated'] is set. The time to the first fragment is recorded in the
+    generation_ttft_seconds histogram and report['ttft_seconds'].
+    """
+    start = time.perf_counter()
+    quality = check_quality(quality or DEFAULT_QUALITY)
+    deadline = deadline_after(DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    report = {} if report is None else report
+    report.update(quality=quality, truncated=False)
+    tokenizer, _ = get_model()
+    prompt = clean_text(prompt)
+    with stage('generation', 'tokenize'):
+        inputs = tokenizer.encode(prompt, return_tensors="pt")
+
+    # Only the tokens since the previous fragment are decoded, with the ones before them
+    # as context, so each token costs the same however long the stream gets
+    new_ids = []
+    prefix_offset = read_offset = 0
+    tokens = iter_token_ids(inputs, length, temperature, top_k, top_p,
+                            do_sample=QUALITY_TIERS[quality]['do_sample'])
+    with closing(tokens):
+        for token_id in tokens:
+            new_ids.append(token_id)
+            prefix = tokenizer.decode(new_ids[prefix_offset:read_offset], skip_special_tokens=True)
+            text = tokenizer.decode(new_ids[prefix_offset:], skip_special_tokens=True)
+            # Hold back incomplete multi-byte characters until the next token completes them
+            if not text.endswith('\ufffd') and len(text) > len(prefix):
+                if read_offset == 0:
+                    report['ttft_seconds'] = time.perf_counter() - start
+                    metrics.observe('generation_ttft_seconds', report['ttft_seconds'])
+                yield text[len(prefix):]
+                prefix_offset, read_offset = read_offset, len(new_ids)
+            if expired(deadline):
+                report['truncated'] = True
+                return
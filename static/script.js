@@ -27,4 +27,114 @@ document.addEventListener('DOMContentLoaded', function() {
         const event = new Event('input');
         textarea.dispatchEvent(event);
     });
-});
\ No newline at end of file
+
+    // Stream generated text as it is produced instead of waiting for the full page
+    const streamForm = document.querySelector('form[data-stream-url]');
+    if (streamForm && window.fetch && window.ReadableStream && window.TextDecoder) {
+        streamForm.addEventListener('submit', async function(e) {
+            e.preventDefault();
+            const result = document.getElementById(this.dataset.streamTarget);
+            const output = result.querySelector('.generated-output');
+            const note = result.querySelector('.result-note');
+            const button = this.querySelector('button[type="submit"]');
+            const prompt = this.querySelector('[name="prompt"]');
+
+            output.textContent = prompt ? prompt.value.trim() : '';
+            if (note) note.hidden = true;
+            result.hidden = false;
+            button.disabled = true;
+
+            try {
+                const response = await fetch(this.dataset.streamUrl, {
+                    method: 'POST',
+                    body: new FormData(this)
+                });
+                if (!response.ok) {
+                    const body = await response.json().catch(() => ({}));
+                    output.textContent = body.error || 'Text generation failed.';
+                    return;
+                }
+
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+
+                    // Server-Sent Events are separated by a blank line
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        const message = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        const event = (message.match(/^event: (.*)$/m) || [])[1] || 'message';
+                        const data = JSON.parse((message.match(/^data: (.*)$/m) || [])[1] || '{}');
+                        if (event === 'message') {
+                            output.textContent += data.text;
+                        } else if (event === 'done') {
+                            if (note) note.hidden = !data.truncated;
+                        } else if (event === 'error') {
+                            output.textContent += '\n[' + data.error + ']';
+                        }
+                    }
+                }
+            } catch (err) {
+                output.textContent += '\n[Connection lost]';
+            } finally {
+                button.disabled = false;
+            }
+        });
+    }
+
+    // Poll a background style transfer job until it finishes
+    const styleJob = document.getElementById('style-job');
+    if (styleJob) {
+        const statusText = styleJob.querySelector('.job-status');
+        const cancelButton = styleJob.querySelector('.job-cancel');
+
+        cancelButton.addEventListener('click', function() {
+            cancelButton.disabled = true;
+            fetch(styleJob.dataset.cancelUrl, { method: 'POST' });
+        });
+
+        const poll = async function() {
+            let job;
+            try {
+                const response = await fetch(styleJob.dataset.statusUrl);
+                job = await response.json();
+            } catch (err) {
+                setTimeout(poll, 2000);
+                return;
+            }
+
+            if (job.status === 'queued') {
+                statusText.textContent = 'Queued...';
+            } else if (job.status === 'running') {
+                const p = job.progress || {};
+                statusText.textContent = p.step
+                    ? `Step ${p.step} of ${p.num_steps} (loss ${p.loss.toFixed(2)})`
+                    : 'Starting...';
+            } else if (job.status === 'succeeded') {
+                const output = styleJob.querySelector('.job-output');
+                output.querySelector('img').src = job.output_url;
+                output.querySelector('a').href = job.output_url;
+                output.hidden = false;
+                const report = job.result.report || {};
+                statusText.textContent = report.mode === 'optimize'
+                    ? `Done in ${report.total_steps} steps (${report.total_seconds.toFixed(1)}s).`
+                    : 'Done.';
+                cancelButton.hidden = true;
+                return;
+            } else {
+                statusText.textContent = job.status === 'cancelled'
+                    ? 'Cancelled.'
+                    : `Style transfer failed: ${job.error}`;
+                cancelButton.hidden = true;
+                return;
+            }
+            setTimeout(poll, 1000);
+        };
+        poll();
+    }
+});
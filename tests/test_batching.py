@@ -0,0 +1,36 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.batching import MicroBatcher
+
+
+def test_concurrent_submits_share_one_batch():
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    # The wait is long enough for every thread to submit before the first batch closes
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=2000, name='test')
+    start = threading.Barrier(8)
+
+    def submit(item):
+        start.wait()
+        return batcher.submit(item, timeout=10)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(submit, range(8)))
+
+    assert results == [item * 2 for item in range(8)]
+    assert len(calls) == 1 and sorted(calls[0]) == list(range(8))
+
+
+def test_batch_failure_reaches_every_caller():
+    def fail(items):
+        raise ValueError("batch failed")
+
+    batcher = MicroBatcher(fail, max_batch_size=2, max_wait_ms=2000, name='test')
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(batcher.submit, item, 10) for item in range(2)]
+    for future in futures:
+        assert isinstance(future.exception(), ValueError)
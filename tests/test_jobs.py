@@ -0,0 +1,86 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from utils.jobs import CANCELLED, FAILED, RUNNING, SUCCEEDED, JobManager
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the job")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def managers(tmp_path):
+    """Two managers sharing one job store, standing in for two gunicorn workers"""
+    first = JobManager(name='first', store_dir=str(tmp_path))
+    second = JobManager(name='second', store_dir=str(tmp_path))
+    yield first, second
+    for manager in (first, second):
+        manager._executor.shutdown(wait=True)
+
+
+def test_one_process_claims_a_key(managers):
+    first, second = managers
+    release = threading.Event()
+    calls = []
+
+    def work(job):
+        calls.append(job.id)
+        release.wait(5)
+        return 'done'
+
+    job, submitted = first.submit_once('same-key', work)
+    assert submitted
+    other, submitted = second.submit_once('same-key', work)
+    assert not submitted and other.id == job.id
+
+    release.set()
+    wait_for(lambda: first.get(job.id).status == SUCCEEDED)
+    assert calls == [job.id]
+    assert second.get(job.id).result == 'done'
+    # The finished job released the key, so the next submission runs again
+    again, submitted = second.submit_once('same-key', work)
+    assert submitted and again.id != job.id
+    wait_for(lambda: second.get(again.id).status == SUCCEEDED)
+
+
+def test_cancel_through_the_marker_file(managers):
+    first, second = managers
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    job = first.submit(work)
+    started.wait(5)
+    assert second.get(job.id).status == RUNNING
+    second.cancel(job.id)
+    wait_for(lambda: first.get(job.id).status == CANCELLED)
+    assert second.get(job.id).status == CANCELLED
+
+
+def test_job_of_an_exited_process_is_failed(managers, tmp_path):
+    first, second = managers
+    job = first.submit(lambda job: None)
+    wait_for(lambda: first.get(job.id).status == SUCCEEDED)
+
+    # Rewrite the record as a running job owned by a process that has exited
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    record = job.to_dict()
+    record.update(status=RUNNING, finished_at=None)
+    with open(tmp_path / f"{job.id}.json", 'w') as f:
+        json.dump({'pid': child.pid, 'job': record}, f)
+
+    loaded = second.get(job.id)
+    assert loaded.status == FAILED
+    assert 'exited' in loaded.error
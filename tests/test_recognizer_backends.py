@@ -0,0 +1,107 @@
+import threading
+import time
+import speech_recognition as sr
+from modules.recognizer_backends import StubBackend, recognize_chunks
+from utils.metrics import metrics
+
+SAMPLE_RATE = 16000
+
+
+def audio(seconds):
+    return sr.AudioData(b'\0\0' * int(seconds * SAMPLE_RATE), SAMPLE_RATE, 2)
+
+
+def chunks(durations):
+    return ((index, audio(seconds)) for index, seconds in enumerate(durations))
+
+
+def request_errors(backend):
+    for name, labels, value in metrics.snapshot()['counters']:
+        if name == 'speech_request_errors_total' and labels == [['backend', backend]]:
+            return value
+    return 0
+
+
+class RecordingBackend(StubBackend):
+    """Stub that sleeps longer for earlier chunks and records how many requests overlap"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.active = 0
+        self.most_active = 0
+        self.finished = 0
+        self._count_lock = threading.Lock()
+
+    def _recognize(self, session, audio_data, language):
+        with self._count_lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        try:
+            seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+            time.sleep(0.05 / seconds)
+            return super()._recognize(session, audio_data, language)
+        finally:
+            with self._count_lock:
+                self.active -= 1
+                self.finished += 1
+
+
+class FlakyBackend(StubBackend):
+    """Stub whose requests fail a set number of times per chunk duration"""
+
+    name = 'flaky'
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = dict(failures)
+        self.attempts = {}
+
+    def _recognize(self, session, audio_data, language):
+        seconds = round(len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width), 2)
+        self.attempts[seconds] = self.attempts.get(seconds, 0) + 1
+        if self.attempts[seconds] <= self.failures.get(seconds, 0):
+            raise sr.RequestError("service unavailable")
+        return super()._recognize(session, audio_data, language)
+
+
+def test_transcripts_come_back_in_chunk_order():
+    # Earlier chunks take longer, so they finish last
+    backend = RecordingBackend(max_concurrency=4)
+    durations = [0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4]
+    texts = recognize_chunks(chunks(durations), backend, 'en-GB')
+    assert texts == [f"[{seconds:.2f}s of en-GB speech]" for seconds in durations]
+
+
+def test_requests_and_pulled_chunks_stay_within_limits():
+    backend = RecordingBackend(max_concurrency=2)
+    unfinished = []
+
+    def lazy_chunks():
+        for index in range(12):
+            # Chunks pulled earlier whose requests have not finished yet
+            unfinished.append(index - backend.finished)
+            yield index, audio(1)
+
+    texts = recognize_chunks(lazy_chunks(), backend)
+    assert len(texts) == 12
+    assert backend.most_active <= backend.max_concurrency
+    assert max(unfinished) <= 2 * backend.max_concurrency - 1
+
+
+def test_failed_requests_are_retried_and_lost_chunks_left_out():
+    # The 1s chunk recovers on its second retry; the 2s chunk fails every attempt
+    backend = FlakyBackend({1.0: 2, 2.0: 10}, retries=2, backoff_seconds=0, max_concurrency=2)
+    errors_before = request_errors('flaky')
+
+    texts = recognize_chunks(chunks([1, 2, 3]), backend)
+
+    assert texts == ["[1.00s of en-US speech]", "[3.00s of en-US speech]"]
+    assert backend.attempts == {1.0: 3, 2.0: 3, 3.0: 1}
+    assert request_errors('flaky') - errors_before == 5
+
+
+def test_unrecognizable_audio_is_not_retried():
+    backend = FlakyBackend({}, retries=3, backoff_seconds=0)
+    texts = recognize_chunks(chunks([0, 1]), backend)
+    assert texts == ["[1.00s of en-US speech]"]
+    assert backend.attempts == {0.0: 1, 1.0: 1}
@@ -0,0 +1,102 @@
+import pytest
+import torch
+from benchmarks.fixtures import build_gpt2, build_tokenizer
+from modules import text_generation
+from modules.text_generation import _rng, speculative_token_ids
+from utils.model_registry import registry
+
+PROMPT = "The city council voted on the plan to expand the bus network"
+
+
+@pytest.fixture(scope='module')
+def models():
+    """Tiny random GPT-2 main and draft models, registered under the names the module loads"""
+    tokenizer = build_tokenizer('gpt2')
+    model = build_gpt2(tokenizer)
+    names = (f"{text_generation.model_name}:{text_generation.PRECISION}",
+             f"{text_generation.draft_model_name}:{text_generation.PRECISION}")
+    registry.register(names[0], (tokenizer, model))
+    yield tokenizer, model, names[1]
+    for name in names:
+        registry.evict(name)
+
+
+def use_draft(name, draft):
+    registry.evict(name)
+    registry.register(name, draft)
+
+
+def prompt_ids(tokenizer):
+    return tokenizer(PROMPT, return_tensors='pt').input_ids
+
+
+@pytest.mark.parametrize('draft_layers', [1, 2])
+def test_greedy_speculative_output_equals_greedy_generate(models, draft_layers):
+    # With top_k=1 both distributions are one-hot, so the main model's argmax wins every round
+    tokenizer, model, draft_name = models
+    use_draft(draft_name, build_gpt2(tokenizer, layers=draft_layers))
+    input_ids = prompt_ids(tokenizer)
+    length = 24
+
+    with torch.no_grad():
+        expected = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                                  max_new_tokens=length, min_new_tokens=length,
+                                  pad_token_id=tokenizer.eos_token_id)[0, input_ids.shape[1]:].tolist()
+    report = {}
+    tokens = list(speculative_token_ids(input_ids, length, top_k=1, num_draft_tokens=4, report=report))
+
+    assert tokens and tokens == expected[:len(tokens)]
+    assert report['target_passes'] < length
+    if draft_layers == 2:
+        # The draft is the main model itself, so every draft is accepted
+        assert report['accepted'] == report['drafted']
+
+
+def test_sampled_drafts_are_accepted_and_rejected(models):
+    tokenizer, model, draft_name = models
+    use_draft(draft_name, build_gpt2(tokenizer, layers=1, n_embd=32))
+    input_ids = prompt_ids(tokenizer)
+    length = 40
+
+    report = {}
+    tokens = list(speculative_token_ids(input_ids, length, temperature=1.0, top_k=50, top_p=0.95,
+                                        num_draft_tokens=4, report=report, generator=_rng(0)))
+
+    assert 0 < len(tokens) <= length
+    assert all(0 <= token < len(tokenizer) for token in tokens)
+    assert 0 < report['accepted'] < report['drafted']
+    assert report['acceptance_rate'] == report['accepted'] / report['drafted']
+    # The same generator seed gives the same tokens
+    again = list(speculative_token_ids(input_ids, length, temperature=1.0, top_k=50, top_p=0.95,
+                                       num_draft_tokens=4, generator=_rng(0)))
+    assert again == tokens
+
+
+def test_beam_sampling_draws_from_the_seeded_generator(models):
+    tokenizer, model, draft_name = models
+    use_draft(draft_name, build_gpt2(tokenizer, layers=1))
+    state = torch.random.get_rng_state()
+
+    def best(seed):
+        return text_generation.generate_text(PROMPT, length=12, seed=seed, quality='best', speculative=True,
+                                             deadline_seconds=0)
+
+    first = best(1)
+    text_generation.result_cache.clear()
+    assert best(1) == first
+    assert torch.equal(torch.random.get_rng_state(), state)
+
+
+def test_streamed_fragments_join_to_the_decoded_text(models):
+    tokenizer, model, _ = models
+    report = {}
+    fragments = list(text_generation.stream_text(PROMPT, length=40, quality='fast', deadline_seconds=0,
+                                                 report=report))
+    input_ids = prompt_ids(tokenizer)
+
+    with torch.no_grad():
+        ids = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                             max_new_tokens=40, min_new_tokens=40,
+                             pad_token_id=tokenizer.eos_token_id)[0, input_ids.shape[1]:].tolist()
+    assert ''.join(fragments) == tokenizer.decode(ids, skip_special_tokens=True)
+    assert len(fragments) > 1 and report['ttft_seconds'] >= 0
@@ -0,0 +1,34 @@
+import pytest
+from benchmarks.fixtures import build_tokenizer
+from utils.text_processing import build_chunks, encode_segments, pack_token_ids
+
+
+def test_segments_are_packed_whole_within_the_budget():
+    segments = [[1] * 4, [2] * 3, [3] * 5, [4] * 2]
+    chunks = pack_token_ids(segments, 8)
+    assert chunks == [[1] * 4 + [2] * 3, [3] * 5 + [4] * 2]
+
+
+def test_segment_longer_than_the_budget_is_split():
+    chunks = pack_token_ids([[1] * 2, list(range(10, 30)), [2] * 3], 8)
+    assert all(len(chunk) <= 8 for chunk in chunks)
+    assert chunks[0] == [1] * 2
+    assert [token for chunk in chunks for token in chunk] == [1] * 2 + list(range(10, 30)) + [2] * 3
+
+
+@pytest.fixture(scope='module')
+def tokenizer():
+    return build_tokenizer('bart')
+
+
+def test_chunks_fit_the_model_input_with_special_tokens(tokenizer):
+    sentences = ["The council met on Monday.", "It voted to expand the bus network.",
+                 " ".join(["Every new route was listed one after another"] * 20) + "."]
+    segments = encode_segments(sentences, tokenizer)
+    chunks = build_chunks(segments, tokenizer, max_tokens=32)
+
+    assert len(chunks) > 2
+    assert all(len(chunk) <= 32 for chunk in chunks)
+    # Nothing is dropped: the chunks hold every sentence's tokens in order
+    special = set(tokenizer.all_special_ids)
+    assert [t for chunk in chunks for t in chunk if t not in special] == [t for ids in segments for t in ids]
@@ -0,0 +1,53 @@
+import io
+import os
+import subprocess
+import sys
+import time
+from utils.upload_store import IN_USE_FOLDER, UploadStore
+
+
+def store_old(store, content):
+    """Store content and date it an hour back, past the test stores' max age"""
+    _, path = store.put(io.BytesIO(content), 'png')
+    hour_ago = time.time() - 3600
+    os.utime(path, (hour_ago, hour_ago))
+    return path
+
+
+def exited_pid():
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    return child.pid
+
+
+def test_sweep_skips_files_another_store_uses(tmp_path):
+    # Two stores on one folder stand in for two gunicorn workers
+    worker = UploadStore(str(tmp_path), max_age_seconds=60)
+    sweeper = UploadStore(str(tmp_path), max_age_seconds=60)
+    used = store_old(worker, b'in use')
+    unused = store_old(worker, b'not in use')
+    worker.acquire(used)
+    assert os.path.exists(tmp_path / IN_USE_FOLDER / f"{os.path.basename(used)}.{os.getpid()}")
+
+    assert sweeper.sweep() == 1
+    assert os.path.exists(used) and not os.path.exists(unused)
+
+    worker.release(used)
+    assert not os.listdir(tmp_path / IN_USE_FOLDER)
+    assert sweeper.sweep() == 1
+    assert not os.path.exists(used)
+
+
+def test_sweep_removes_stale_markers_and_expired_files(tmp_path):
+    store = UploadStore(str(tmp_path), max_age_seconds=60)
+    expired = store_old(store, b'left by an exited worker')
+    _, fresh = store.put(io.BytesIO(b'fresh'), 'png')
+    folder = tmp_path / IN_USE_FOLDER
+    folder.mkdir()
+    stale_marker = folder / f"{os.path.basename(expired)}.{exited_pid()}"
+    stale_marker.touch()
+
+    assert store.sweep() == 1
+    assert not stale_marker.exists()
+    assert not os.path.exists(expired)
+    assert os.path.exists(fresh)
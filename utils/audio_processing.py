@@ -0,0 +1,373 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+import logging
+import numpy as np
+from utils.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# All readers hand out 16-bit mono samples
+SAMPLE_WIDTH = 2
+
+# Decoded uploads stay in memory up to this size before spilling to a temporary file
+AUDIO_SPILL_BYTES = int(os.environ.get('AUDIO_SPILL_MB', '32')) * 2**20
+TARGET_SAMPLE_RATE = int(os.environ.get('AUDIO_SAMPLE_RATE', '16000'))
+
+
+def to_mono_int16(frames, sample_width, channels):
+    """Convert interleaved PCM bytes of any common sample width to 16-bit mono samples"""
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype='<i2')
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 16).astype(np.int16)
+    elif sample_width == 4:
+        samples = (np.frombuffer(frames, dtype='<i4') >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples
+
+
+class WavReader:
+    """
+    Sequential reader over a WAV file
+    The file is decoded once, front to back; read() returns 16-bit mono samples.
+    """
+
+    def __init__(self, path):
+        self._wav = wave.open(path, 'rb')
+        self.sample_rate = self._wav.getframerate()
+        self.channels = self._wav.getnchannels()
+        self._sample_width = self._wav.getsampwidth()
+        self.n_samples = self._wav.getnframes()
+
+    @property
+    def duration(self):
+        return self.n_samples / self.sample_rate
+
+    def read(self, n_samples):
+        """Return up to n_samples further samples; an empty array at end of stream"""
+        frames = self._wav.readframes(n_samples)
+        return to_mono_int16(frames, self._sample_width, self.channels)
+
+    def rewind(self):
+        self._wav.rewind()
+
+    def close(self):
+        self._wav.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PCMBuffer:
+    """
+    16-bit mono PCM held in memory, spilling to a temporary file above max_memory_bytes
+    Written once, then read sequentially with the same interface as WavReader.
+    """
+
+    def __init__(self, sample_rate, max_memory_bytes=AUDIO_SPILL_BYTES):
+        self.sample_rate = sample_rate
+        self.channels = 1
+        self.n_samples = 0
+        self.max_memory_bytes = max_memory_bytes
+        self._bytes_written = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes)
+
+    @property
+    def duration(self):
+        return self.n_samples / self.sample_rate
+
+    @property
+    def spilled(self):
+        """True when the audio no longer fits in memory and lives in a temporary file"""
+        # SpooledTemporaryFile rolls over once a write takes it past max_size (0: never)
+        return bool(self.max_memory_bytes) and self._bytes_written > self.max_memory_bytes
+
+    def write(self, samples):
+        self.write_bytes(np.asarray(samples, dtype='<i2').tobytes())
+
+    def write_bytes(self, data):
+        """Append raw little-endian 16-bit samples (whole samples only)"""
+        self._file.write(data)
+        self._bytes_written += len(data)
+        self.n_samples += len(data) // SAMPLE_WIDTH
+
+    def rewind(self):
+        self._file.seek(0)
+
+    def read(self, n_samples):
+        return np.frombuffer(self._file.read(n_samples * SAMPLE_WIDTH), dtype='<i2')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _decode_wav(stream, sample_rate, max_memory_bytes, block_samples=1 << 16):
+    """Copy a WAV stream already at sample_rate into a PCMBuffer; None if it needs ffmpeg"""
+    try:
+        wav = wave.open(stream, 'rb')
+    except (wave.Error, EOFError):
+        return None
+    with wav:
+        if wav.getframerate() != sample_rate:
+            return None
+        pcm = PCMBuffer(sample_rate, max_memory_bytes)
+        width, channels = wav.getsampwidth(), wav.getnchannels()
+        while True:
+            frames = wav.readframes(block_samples)
+            if not frames:
+                break
+            pcm.write(to_mono_int16(frames, width, channels))
+    pcm.rewind()
+    return pcm
+
+
+def _ffmpeg_binary():
+    # Reuse the converter configured for pydub, falling back to ffmpeg on the PATH
+    from pydub import AudioSegment
+    converter = AudioSegment.converter
+    if converter and os.path.exists(converter):
+        return converter
+    return shutil.which('ffmpeg') or converter
+
+
+def _decode_ffmpeg(stream, sample_rate, max_memory_bytes, block_bytes=1 << 16):
+    """Pipe an encoded stream through ffmpeg into a PCMBuffer without touching disk"""
+    command = [
+        _ffmpeg_binary(), '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0',
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate),
+        'pipe:1',
+    ]
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise ValueError(f"Could not decode audio: ffmpeg not found at {command[0]}")
+
+    def feed():
+        # Runs alongside the reader below so neither pipe can fill up and block
+        try:
+            for block in iter(lambda: stream.read(block_bytes), b''):
+                process.stdin.write(block)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    pcm = PCMBuffer(sample_rate, max_memory_bytes)
+    carry = b''
+    for block in iter(lambda: process.stdout.read(block_bytes), b''):
+        block = carry + block
+        usable = len(block) - len(block) % SAMPLE_WIDTH
+        pcm.write_bytes(block[:usable])
+        carry = block[usable:]
+    feeder.join()
+    errors = process.stderr.read().decode(errors='replace').strip()
+    if process.wait() != 0:
+        pcm.close()
+        raise ValueError(f"Could not decode audio: {errors or 'ffmpeg failed'}")
+    pcm.rewind()
+    return pcm
+
+
+def decode_audio_stream(stream, sample_rate=TARGET_SAMPLE_RATE, max_memory_bytes=AUDIO_SPILL_BYTES):
+    """
+    Decode an uploaded audio stream to 16-bit mono PCM at sample_rate
+    WAV files already at the target rate are copied directly; anything else is piped
+    through ffmpeg. The result is held in memory and only spills to a temporary file
+    when it exceeds max_memory_bytes. Returns a PCMBuffer ready for reading.
+    """
+    with stage('speech', 'audio_conversion'):
+        start = stream.tell() if stream.seekable() else None
+        if start is not None:
+            pcm = _decode_wav(stream, sample_rate, max_memory_bytes)
+            if pcm is not None:
+                return pcm
+            stream.seek(start)
+        return _decode_ffmpeg(stream, sample_rate, max_memory_bytes)
+
+
+def pcm_sha256(reader, block_samples=1 << 16):
+    """SHA-256 of the samples of a WavReader or PCMBuffer; the reader is rewound afterwards"""
+    digest = hashlib.sha256()
+    reader.rewind()
+    while True:
+        samples = reader.read(block_samples)
+        if len(samples) == 0:
+            break
+        digest.update(np.asarray(samples, dtype='<i2').tobytes())
+    reader.rewind()
+    return digest.hexdigest()
+
+
+def rms(samples):
+    """Root-mean-square level of 16-bit samples"""
+    if len(samples) == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(samples.astype(np.float64) ** 2)))
+
+
+def iter_audio_chunks(reader, chunk_seconds=30):
+    """
+    Yield (index, start_seconds, samples) for consecutive fixed-length chunks
+    Each sample is read exactly once, in order, from the reader.
+    """
+    chunk_samples = int(chunk_seconds * reader.sample_rate)
+    index = 0
+    while True:
+        samples = reader.read(chunk_samples)
+        if len(samples) == 0:
+            return
+        yield index, index * chunk_seconds, samples
+        index += 1
+
+
+def frame_energy_db(frames):
+    """Energy of each row of a (n_frames, frame_samples) array of 16-bit samples, in dBFS"""
+    power = np.mean(frames.astype(np.float64) ** 2, axis=1) / 32768.0 ** 2
+    return 10 * np.log10(power + 1e-12)
+
+
+def estimate_threshold_db(energy_db, margin_db=10.0, floor_db=-55.0, ceiling_db=-35.0):
+    """
+    Speech threshold from the noise floor of a stretch of frames
+    The noise floor is the 10th percentile frame energy; the threshold sits margin_db
+    above it, clamped to a range that works for both quiet and noisy recordings.
+    """
+    noise_db = float(np.percentile(energy_db, 10))
+    return min(max(noise_db + margin_db, floor_db), ceiling_db)
+
+
+def iter_speech_regions(reader, frame_ms=30, threshold_db=None, min_silence_ms=500,
+                        min_speech_ms=250, padding_ms=200, max_region_seconds=30,
+                        block_seconds=30, report=None):
+    """
+    Yield (start_sample, samples) for each stretch of speech, detected by frame energy
+    Frames louder than the threshold are speech. Speech separated by at least
+    min_silence_ms of silence forms separate regions, regions with less than
+    min_speech_ms of speech are dropped, and regions are cut at max_region_seconds.
+    The reader is consumed once, block by block; only the open region is buffered.
+    """
+    rate = reader.sample_rate
+    frame = max(1, int(rate * frame_ms / 1000))
+    pad = int(rate * padding_ms / 1000)
+    min_silence_frames = max(1, int(min_silence_ms / frame_ms))
+    min_speech_frames = max(1, int(min_speech_ms / frame_ms))
+    max_frames = max(1, (int(rate * max_region_seconds) - 2 * pad) // frame)
+    report = {} if report is None else report
+    report.update(threshold_db=threshold_db, speech_seconds=0.0, total_seconds=0.0, regions=0)
+
+    buffer = np.zeros(0, dtype=np.int16)
+    buffer_start = 0     # sample index of buffer[0]
+    analyzed = 0         # frames classified so far
+    seg_start = None     # first frame of the open region
+    seg_cut = False      # the open region continues one that was cut at max length
+    last_voiced = None   # end frame of the last speech run in the open region
+    voiced_count = 0
+
+    def region(start_frame, end_frame, pad_start=True, pad_end=True):
+        # Regions are padded with context, except where one was cut from the next
+        start = max(start_frame * frame - (pad if pad_start else 0), buffer_start)
+        end = min(end_frame * frame + (pad if pad_end else 0), buffer_start + len(buffer))
+        report['speech_seconds'] += (end - start) / rate
+        report['regions'] += 1
+        return start, buffer[start - buffer_start:end - buffer_start].copy()
+
+    while True:
+        block = reader.read(int(rate * block_seconds))
+        at_end = len(block) == 0
+        buffer = np.concatenate([buffer, block])
+        report['total_seconds'] += len(block) / rate
+
+        # Classify every complete frame not yet seen
+        n = (buffer_start + len(buffer) - analyzed * frame) // frame
+        if n > 0:
+            offset = analyzed * frame - buffer_start
+            energy_db = frame_energy_db(buffer[offset:offset + n * frame].reshape(n, frame))
+            if report['threshold_db'] is None:
+                report['threshold_db'] = estimate_threshold_db(energy_db)
+            voiced = energy_db > report['threshold_db']
+
+            # Walk runs of equal classification rather than single frames
+            changes = np.flatnonzero(np.diff(voiced.astype(np.int8))) + 1
+            for run_start, run_end in zip(np.concatenate([[0], changes]), np.concatenate([changes, [n]])):
+                first, end = analyzed + int(run_start), analyzed + int(run_end)
+                if voiced[run_start]:
+                    if seg_start is None:
+                        seg_start, seg_cut, voiced_count = first, False, 0
+                    voiced_count += end - first
+                    last_voiced = end
+                    while last_voiced - seg_start > max_frames:
+                        cut = seg_start + max_frames
+                        yield region(seg_start, cut, pad_start=not seg_cut, pad_end=False)
+                        seg_start, seg_cut, voiced_count = cut, True, last_voiced - cut
+                elif seg_start is not None and end - last_voiced >= min_silence_frames:
+                    if voiced_count >= min_speech_frames:
+                        yield region(seg_start, last_voiced, pad_start=not seg_cut)
+                    seg_start = None
+            analyzed += n
+
+        if at_end:
+            if seg_start is not None and voiced_count >= min_speech_frames:
+                yield region(seg_start, last_voiced, pad_start=not seg_cut)
+            return
+
+        # Drop samples that can no longer belong to a region
+        if seg_start is None:
+            keep_from = analyzed * frame - pad
+        else:
+            keep_from = seg_start * frame - (0 if seg_cut else pad)
+        if keep_from > buffer_start:
+            buffer = buffer[keep_from - buffer_start:]
+            buffer_start = keep_from
+
+
+def iter_speech_segments(reader, max_segment_seconds=30, report=None, **vad_options):
+    """
+    Yield (index, start_seconds, samples) segments of speech ready for recognition
+    Consecutive speech regions are merged, without the silence between them, into
+    segments of up to max_segment_seconds. Silent stretches are never yielded.
+    """
+    rate = reader.sample_rate
+    max_samples = int(rate * max_segment_seconds)
+    merged, merged_len, merged_start = [], 0, 0
+    index = 0
+
+    regions = iter_speech_regions(reader, max_region_seconds=max_segment_seconds,
+                                  report=report, **vad_options)
+    for start, samples in regions:
+        if merged and merged_len + len(samples) > max_samples:
+            yield index, merged_start / rate, np.concatenate(merged)
+            index += 1
+            merged, merged_len = [], 0
+        if not merged:
+            merged_start = start
+        merged.append(samples)
+        merged_len += len(samples)
+
+    if merged:
+        yield index, merged_start / rate, np.concatenate(merged)
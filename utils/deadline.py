@@ -0,0 +1,29 @@
+import time
+import torch
+from transformers import StoppingCriteria
+
+
+def deadline_after(seconds):
+    """Absolute time.monotonic() deadline seconds from now, or None when seconds is None or 0"""
+    return time.monotonic() + seconds if seconds else None
+
+
+def expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stopping criterion that ends generate() once a time.monotonic() deadline passes
+    generate() then returns what it has so far (for beam search, the best beams);
+    triggered records whether the deadline cut the output short.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if expired(self.deadline):
+            self.triggered = True
+        return torch.full((input_ids.shape[0],), self.triggered, dtype=torch.bool, device=input_ids.device)
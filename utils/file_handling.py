@@ -1,5 +1,5 @@
-from pydub import AudioSegment
 import os
+import hashlib
 from werkzeug.utils import secure_filename
 import logging
 
@@ -12,6 +12,16 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+def file_sha256(path, block_size=1 << 20):
+    """
+    Hex SHA-256 digest of a file's contents, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 def convert_audio_format(input_path, target_format='wav'):
     """
     Convert audio file to target format using pydub/ffmpeg
@@ -25,7 +35,8 @@ def convert_audio_format(input_path, target_format='wav'):
         base = os.path.splitext(input_path)[0]
         output_path = f"{base}.{target_format.lower()}"
         
-        # Convert using pydub
+        # Convert using pydub, imported here so checking and hashing files stays light
+        from pydub import AudioSegment
         audio = AudioSegment.from_file(input_path)
         audio.export(output_path, format=target_format)
         
@@ -1,7 +1,6 @@
 from PIL import Image
 import torchvision.transforms as transforms
 import numpy as np
-import matplotlib.pyplot as plt
 
 def load_image(image_path, max_size=512, shape=None):
     """Load and preprocess image"""
@@ -33,6 +32,9 @@ def save_image(tensor, filename):
 
 def imshow(tensor, title=None):
     """Display image from tensor"""
+    # Imported here so loading and saving images does not pull in matplotlib
+    import matplotlib.pyplot as plt
+
     image = tensor.cpu().clone()
     image = image.squeeze(0)
     image = transforms.ToPILImage()(image)
@@ -0,0 +1,358 @@
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from utils.resources import process_alive
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Job IDs are uuid4 hex strings; anything else is never looked up in the shared store
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+# Least seconds between writes of a running job's progress to the shared store
+PROGRESS_SAVE_SECONDS = 0.5
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function to stop work after a cancel request"""
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when too many jobs are waiting"""
+
+
+class Job:
+    """State of one background job, shared between the worker and status requests"""
+
+    def __init__(self, job_id, kind, cancel_path=None):
+        self.id = job_id
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        # Marker file through which other processes sharing the job store cancel this job
+        self._cancel_path = cancel_path
+        self._on_progress = None
+        self._saved_at = 0.0
+        # Set by JobManager.submit_once; released when the job finishes
+        self.key = None
+
+    @classmethod
+    def from_dict(cls, data, cancel_path=None):
+        """Read-only copy of a job from its to_dict() output"""
+        job = cls(data['id'], data['kind'], cancel_path)
+        for name in ('status', 'progress', 'result', 'error', 'created_at', 'started_at', 'finished_at'):
+            setattr(job, name, data[name])
+        return job
+
+    @property
+    def cancelled(self):
+        if (not self._cancel_event.is_set() and self._cancel_path is not None
+                and os.path.exists(self._cancel_path)):
+            self._cancel_event.set()
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if a cancel was requested; call this between units of work"""
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def update(self, **progress):
+        """Record progress values such as the current step and loss"""
+        self.progress = {**self.progress, **progress}
+        if self._on_progress is not None:
+            self._on_progress(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs in submission order on a bounded pool of worker threads
+    Job functions are called as fn(job, *args, **kwargs) and their return
+    value becomes job.result. Finished jobs are kept for status polling until
+    more than max_finished have accumulated.
+    With store_dir set, every job's state is also written there as <id>.json, so
+    processes sharing the directory (gunicorn workers) can report and cancel each
+    other's jobs; each job still runs in the process that accepted it, and
+    max_pending applies per process.
+    submit_once shares one unfinished job between identical submissions; with
+    store_dir set it does so across the processes too, through <key>.key files.
+    """
+
+    def __init__(self, max_workers=1, max_pending=100, max_finished=1000, name='jobs', store_dir=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.name = name
+        self.store_dir = store_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        # Key -> id of the unfinished job this process submitted under it
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, kind='job', **kwargs):
+        """Queue fn to run in the background and return its Job immediately"""
+        with self._lock:
+            job = self._add(kind)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def submit_once(self, key, fn, *args, kind='job', **kwargs):
+        """
+        Like submit, unless a job submitted under key (in this process or, with
+        store_dir, another one) is still unfinished: then that job is returned and
+        fn is not queued. Returns (job, submitted).
+        """
+        with self._lock:
+            job = self._jobs.get(self._keys.get(key))
+            if job is not None:
+                return job, False
+            job = self._add(kind)
+            owner = self._claim(key, job.id)
+            if owner is not None:
+                self._discard(job)
+                return owner, False
+            job.key = key
+            self._keys[key] = job.id
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job, True
+
+    def get(self, job_id):
+        """The job with this ID, from this process or the shared store, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                # A cancel from another process reaches a queued job before a worker thread does
+                if job.status == QUEUED and job.cancelled:
+                    self._finish(job, CANCELLED)
+                return job
+        return self._load(job_id)
+
+    def cancel(self, job_id):
+        """
+        Request cancellation; queued jobs are cancelled at once, running jobs
+        stop the next time they call check_cancelled. Returns the job or None.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.cancel()
+                if job.status == QUEUED:
+                    self._finish(job, CANCELLED)
+                return job
+
+        job = self._load(job_id)
+        if job is not None and job.status not in FINISHED_STATES:
+            # Owned by another process, which sees the marker the next time it checks
+            open(self._path(job_id, 'cancel'), 'w').close()
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+        return job
+
+    def stats(self):
+        """Count this process's jobs by status"""
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {'name': self.name, 'max_workers': self.max_workers, **counts}
+
+    def clear_store(self):
+        """Remove job records left in store_dir by earlier runs; call once before the workers start"""
+        if self.store_dir is not None:
+            for pattern in ('*.json', '*.cancel', '*.key'):
+                for path in glob.glob(os.path.join(self.store_dir, pattern)):
+                    os.remove(path)
+
+    def _run(self, job, fn, args, kwargs):
+        with self._lock:
+            if job.cancelled:
+                if job.status == QUEUED:
+                    self._finish(job, CANCELLED)
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            self._save(job)
+
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            status, result, error = CANCELLED, None, None
+            logger.info(f"Job {job.id} cancelled")
+        except Exception as e:
+            status, result, error = FAILED, None, str(e)
+            logger.error(f"Job {job.id} failed: {e}")
+        else:
+            status, error = SUCCEEDED, None
+
+        with self._lock:
+            job.result = result
+            job.error = error
+            self._finish(job, status)
+
+    def _add(self, kind):
+        # Called with the lock held
+        pending = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+        if pending >= self.max_pending:
+            raise QueueFull(f"{pending} {self.name} jobs are already waiting")
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, kind, self._path(job_id, 'cancel'))
+        if self.store_dir is not None:
+            job._on_progress = self._save_progress
+        self._jobs[job.id] = job
+        self._save(job)
+        self._prune()
+        return job
+
+    def _discard(self, job):
+        # Called with the lock held, for a job that was added but never queued
+        del self._jobs[job.id]
+        self._remove_files(job.id)
+
+    def _claim(self, key, job_id):
+        """
+        Record job_id as the job for key in the shared store; called with the lock held
+        Returns None once claimed, or the unfinished job of another process holding key.
+        """
+        if self.store_dir is None:
+            return None
+        path = self._path(key, 'key')
+        tmp_path = f"{path}.{job_id}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(job_id)
+        try:
+            while True:
+                try:
+                    # Linking fails if the key file exists, so only one process claims it
+                    os.link(tmp_path, path)
+                    return None
+                except FileExistsError:
+                    pass
+                try:
+                    with open(path) as f:
+                        owner = self._load(f.read().strip())
+                except FileNotFoundError:
+                    continue
+                if owner is not None and owner.status not in FINISHED_STATES:
+                    return owner
+                # Left behind by a finished job or an exited process
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        finally:
+            os.remove(tmp_path)
+
+    def _release(self, job):
+        # Called with the lock held
+        if self._keys.get(job.key) == job.id:
+            del self._keys[job.key]
+        if self.store_dir is not None:
+            path = self._path(job.key, 'key')
+            try:
+                with open(path) as f:
+                    owned = f.read().strip() == job.id
+                if owned:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        job.key = None
+
+    def _finish(self, job, status):
+        # Called with the lock held
+        job.status = status
+        job.finished_at = time.time()
+        self._save(job)
+        if job.key is not None:
+            self._release(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+            self._remove_files(job_id)
+
+    def _remove_files(self, job_id):
+        if self.store_dir is not None:
+            for suffix in ('json', 'cancel'):
+                try:
+                    os.remove(self._path(job_id, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _path(self, job_id, suffix):
+        if self.store_dir is None:
+            return None
+        return os.path.join(self.store_dir, f"{job_id}.{suffix}")
+
+    def _save(self, job):
+        if self.store_dir is None:
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self._path(job.id, 'json')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'pid': os.getpid(), 'job': job.to_dict()}, f)
+        os.replace(tmp_path, path)
+        job._saved_at = time.monotonic()
+
+    def _save_progress(self, job):
+        if time.monotonic() - job._saved_at >= PROGRESS_SAVE_SECONDS:
+            self._save(job)
+
+    def _load(self, job_id):
+        """A job of another process from the shared store, or None"""
+        if self.store_dir is None or not isinstance(job_id, str) or not JOB_ID.match(job_id):
+            return None
+        path = self._path(job_id, 'json')
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable job record {path}: {e}")
+            return None
+
+        job = Job.from_dict(record['job'], self._path(job_id, 'cancel'))
+        if job.status not in FINISHED_STATES:
+            if job.status == QUEUED and job.cancelled:
+                job.status = CANCELLED
+            elif not process_alive(record['pid']):
+                job.status = FAILED
+                job.error = "The worker process running this job exited"
+        return job
@@ -0,0 +1,332 @@
+"""
+Process metrics: counters, histograms and per-request stage traces
+Pipeline stages are timed with
+
+    with stage('summarization', 'generate'):
+        ...
+
+which records the stage_seconds histogram and, when the code runs on a request
+thread, a span in that request's trace. render() produces the Prometheus text
+format. With METRICS_DIR set every process also writes its metrics there and
+render() adds up all of them, so gunicorn workers can be scraped through any one.
+"""
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from utils.resources import current_rss_bytes, peak_rss_bytes, process_alive
+
+logger = logging.getLogger(__name__)
+
+# Directory shared by the worker processes for aggregated metrics (default: per-process only)
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+# Seconds between writes of this process's metrics to METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
+# Log every request's trace as one JSON line and send it back in a Server-Timing header
+METRICS_TRACE = os.environ.get('METRICS_TRACE', '0') == '1'
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MEMORY_BUCKETS = tuple(mb * 2**20 for mb in (128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of labelled counters and histograms
+    Metrics must be declared with counter() or histogram() before they are used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name, help_text):
+        self._meta[name] = {'type': 'counter', 'help': help_text}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = {'type': 'histogram', 'help': help_text, 'buckets': list(buckets)}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name]['buckets']
+        key = (name, _label_key(labels))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count
+                state = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(buckets)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """JSON-serializable copy of every value"""
+        with self._lock:
+            return {
+                'counters': [[name, list(map(list, labels)), value]
+                             for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(map(list, labels)), list(state)]
+                               for (name, labels), state in self._histograms.items()],
+            }
+
+    def render(self, snapshots=None, gauges=()):
+        """
+        Prometheus text format of one or more snapshots added together
+        gauges is a list of (name, help, [(labels dict, value)]) added as they are.
+        """
+        counters, histograms = {}, {}
+        for snapshot in snapshots if snapshots is not None else [self.snapshot()]:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, state in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(state))
+                for i, value in enumerate(state):
+                    total[i] += value
+
+        lines = []
+        for name, meta in sorted(self._meta.items()):
+            lines.append(f"# HELP {name} {meta['help']}")
+            lines.append(f"# TYPE {name} {meta['type']}")
+            if meta['type'] == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            buckets = meta['buckets']
+            for (metric, labels), state in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], state):
+                    cumulative += count
+                    bucket_labels = labels + (('le', str(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(state[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.histogram('stage_seconds', "Time spent in each pipeline stage")
+metrics.histogram('http_request_seconds', "Time to handle each HTTP request")
+metrics.counter('http_requests_total', "HTTP requests handled")
+metrics.histogram('request_peak_rss_bytes', "Highest resident memory seen at a stage boundary during a request",
+                  buckets=MEMORY_BUCKETS)
+metrics.counter('model_loads_total', "Models loaded into the model registry")
+metrics.histogram('model_load_seconds', "Time to load each model")
+metrics.counter('cache_lookups_total', "Result cache lookups by namespace and outcome")
+metrics.histogram('generation_ttft_seconds', "Time from the start of a streamed generation to its first text fragment")
+metrics.counter('speech_request_errors_total', "Failed speech recognition requests, retried or not")
+
+
+class Trace:
+    """Stages of one request in the order they finished, with the highest RSS seen between them"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self.peak_rss_bytes = current_rss_bytes()
+
+    def add(self, task, name, seconds):
+        self.spans.append({'task': task, 'stage': name, 'seconds': seconds,
+                           'end': time.perf_counter() - self.started})
+        self.sample_rss()
+
+    def sample_rss(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak_rss_bytes is None or rss > self.peak_rss_bytes):
+            self.peak_rss_bytes = rss
+
+    def totals(self):
+        """Seconds per stage, added up over repeated stages, in first-seen order"""
+        totals = {}
+        for span in self.spans:
+            key = f"{span['task']}.{span['stage']}"
+            totals[key] = totals.get(key, 0.0) + span['seconds']
+        return totals
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'seconds': time.perf_counter() - self.started,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'stages': self.totals(),
+            'spans': self.spans,
+        }
+
+    def server_timing(self):
+        """Stage totals as a Server-Timing header value"""
+        return ', '.join(f"{key.replace('.', '-')};dur={seconds * 1000:.1f}"
+                         for key, seconds in self.totals().items())
+
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def start_trace(name):
+    """Begin a trace for the current request; returns (trace, token) for end_trace"""
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        # Ended from another context (a streamed response finishing late)
+        _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(task, name):
+    """
+    Time a pipeline stage of task
+    Stages running on other threads (batch schedulers, thread pools) reach the
+    histogram but not the trace of the request that queued them.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe('stage_seconds', seconds, task=task, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(task, name, seconds)
+
+
+def _process_gauges():
+    return [
+        ('process_resident_memory_bytes', "Current resident memory", [({}, current_rss_bytes())]),
+        ('process_peak_resident_memory_bytes', "Highest resident memory so far", [({}, peak_rss_bytes())]),
+    ]
+
+
+_flush_state = {'last': 0.0, 'timer': None}
+_flush_lock = threading.Lock()
+
+
+def flush(force=False):
+    """
+    Write this process's metrics to METRICS_DIR, at most once per METRICS_FLUSH_SECONDS
+    A call inside that interval schedules one write for when it ends, so the last
+    requests before a worker goes idle are not left out.
+    """
+    if not METRICS_DIR:
+        return
+    with _flush_lock:
+        wait = _flush_state['last'] + METRICS_FLUSH_SECONDS - time.monotonic()
+        if not force and wait > 0:
+            if _flush_state['timer'] is None:
+                timer = threading.Timer(wait, _scheduled_flush)
+                timer.daemon = True
+                _flush_state['timer'] = timer
+                timer.start()
+            return
+        _flush_state['last'] = time.monotonic()
+    _write_snapshot()
+
+
+def _scheduled_flush():
+    with _flush_lock:
+        _flush_state['timer'] = None
+    flush(force=True)
+
+
+def _write_snapshot():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    snapshot = metrics.snapshot()
+    snapshot['pid'] = os.getpid()
+    snapshot['rss_bytes'] = current_rss_bytes()
+    snapshot['peak_rss_bytes'] = peak_rss_bytes()
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def clear_dir():
+    """Remove metrics left in METRICS_DIR by earlier runs; call once before the workers start"""
+    if METRICS_DIR:
+        for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+            os.remove(path)
+
+
+def render():
+    """
+    Prometheus text for this process, or for every process sharing METRICS_DIR
+    Counters and histograms of exited workers keep counting; memory gauges are
+    reported per live process.
+    """
+    if not METRICS_DIR:
+        return metrics.render(gauges=_process_gauges())
+
+    flush(force=True)
+    snapshots = []
+    rss, peak = [], []
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable metrics file {path}: {e}")
+            continue
+        snapshots.append(snapshot)
+        if process_alive(snapshot['pid']):
+            rss.append(({'pid': snapshot['pid']}, snapshot['rss_bytes']))
+            peak.append(({'pid': snapshot['pid']}, snapshot['peak_rss_bytes']))
+    gauges = [
+        ('process_resident_memory_bytes', "Current resident memory", rss),
+        ('process_peak_resident_memory_bytes', "Highest resident memory so far", peak),
+    ]
+    return metrics.render(snapshots, gauges)
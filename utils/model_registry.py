@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_model_bytes(obj):
+    """
+    Approximate resident size of a loaded model in bytes
+    Walks tuples/lists/dicts and counts parameters, buffers and quantized weights of any torch module found
+    """
+    if isinstance(obj, (tuple, list)):
+        return sum(estimate_model_bytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(estimate_model_bytes(item) for item in obj.values())
+
+    total = 0
+    if hasattr(obj, 'parameters') and hasattr(obj, 'buffers'):
+        for tensor in obj.parameters():
+            total += tensor.numel() * tensor.element_size()
+        for tensor in obj.buffers():
+            total += tensor.numel() * tensor.element_size()
+        # Dynamically quantized layers keep their packed weights outside parameters()
+        for module in obj.modules():
+            if hasattr(module, '_weight_bias'):
+                for tensor in module._weight_bias():
+                    if tensor is not None:
+                        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _Entry:
+    def __init__(self, model, size_bytes, load_seconds):
+        self.model = model
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models
+    Models are loaded on first use, shared between callers and evicted in
+    least-recently-used order once the memory budget is exceeded
+    """
+
+    def __init__(self, memory_budget_bytes=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._entries = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, loader):
+        """
+        Return the model registered under name, calling loader() to create it if needed
+        Concurrent callers asking for the same model share a single load
+        """
+        with self._lock:
+            entry = self._touch(name)
+            if entry is not None:
+                return entry.model
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                entry = self._touch(name)
+                if entry is not None:
+                    return entry.model
+
+            logger.info(f"Loading model: {name}")
+            start = time.perf_counter()
+            model = loader()
+            elapsed = time.perf_counter() - start
+            metrics.inc('model_loads_total', model=name)
+            metrics.observe('model_load_seconds', elapsed, model=name)
+            self.register(name, model, load_seconds=elapsed)
+            return model
+
+    def register(self, name, model, load_seconds=0.0):
+        """Add an already constructed model to the registry"""
+        size_bytes = estimate_model_bytes(model)
+        with self._lock:
+            self._entries[name] = _Entry(model, size_bytes, load_seconds)
+            self._entries.move_to_end(name)
+            logger.info(f"Registered model {name}: {size_bytes / 2**20:.1f} MB "
+                        f"loaded in {load_seconds:.2f}s")
+            self._evict(keep=name)
+
+    def evict(self, name):
+        """Drop a model from the registry; returns True if it was loaded"""
+        with self._lock:
+            return self._entries.pop(name, None) is not None
+
+    def clear(self):
+        """Drop every loaded model"""
+        with self._lock:
+            self._entries.clear()
+
+    def is_loaded(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    def stats(self):
+        """
+        Report the loaded models, least recently used first
+        Returns a list of dicts with name, size_bytes, load_seconds and last_used
+        """
+        with self._lock:
+            return [
+                {
+                    'name': name,
+                    'size_bytes': entry.size_bytes,
+                    'load_seconds': entry.load_seconds,
+                    'last_used': entry.last_used,
+                }
+                for name, entry in self._entries.items()
+            ]
+
+    def _touch(self, name):
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry.last_used = time.time()
+            self._entries.move_to_end(name)
+        return entry
+
+    def _evict(self, keep):
+        if not self.memory_budget_bytes:
+            return
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        for name in list(self._entries):
+            if total <= self.memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            entry = self._entries.pop(name)
+            total -= entry.size_bytes
+            logger.info(f"Evicted model {name} ({entry.size_bytes / 2**20:.1f} MB) "
+                        f"to stay within memory budget")
+        if total > self.memory_budget_bytes:
+            logger.warning(f"Model {keep} alone exceeds the memory budget "
+                           f"({total / 2**20:.1f} MB > {self.memory_budget_bytes / 2**20:.1f} MB)")
+
+
+def _budget_from_env():
+    """Read MODEL_MEMORY_BUDGET_MB; unset or 0 means unlimited"""
+    budget_mb = int(os.environ.get('MODEL_MEMORY_BUDGET_MB', '0') or 0)
+    return budget_mb * 2**20 if budget_mb > 0 else None
+
+
+# Shared registry used by every module in the process
+registry = ModelRegistry(memory_budget_bytes=_budget_from_env())
@@ -0,0 +1,51 @@
+import logging
+import os
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+# 'fp32' keeps the weights as loaded; 'int8' dynamically quantizes every Linear layer (CPU only)
+PRECISIONS = ('fp32', 'int8')
+INFERENCE_PRECISION = os.environ.get('INFERENCE_PRECISION', 'fp32')
+
+
+def check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown inference precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    return precision
+
+
+def conv1d_to_linear(model):
+    """
+    Replace the transformers Conv1D layers of GPT-2 style models with equivalent nn.Linear layers
+    Conv1D stores its weight transposed; dynamic quantization only recognizes nn.Linear.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features)
+                with torch.no_grad():
+                    linear.weight.copy_(child.weight.t())
+                    linear.bias.copy_(child.bias)
+                setattr(parent, name, linear)
+    return model
+
+
+def apply_precision(model, precision=INFERENCE_PRECISION):
+    """
+    Convert a freshly loaded model to the requested inference precision
+    int8 uses PyTorch dynamic quantization: Linear weights are stored as int8 and
+    activations are quantized on the fly, so no calibration data is needed.
+    """
+    check_precision(precision)
+    if precision == 'fp32':
+        return model
+
+    conv1d_to_linear(model)
+    model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    logger.info(f"Quantized {type(model).__name__} Linear layers to int8")
+    return model.eval()
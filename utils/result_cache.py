@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# In-memory entries, and an optional directory whose size is kept under RESULT_CACHE_MAX_MB
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR') or None
+RESULT_CACHE_MAX_MB = float(os.environ.get('RESULT_CACHE_MAX_MB', '512'))
+
+
+def cache_key(namespace, *parts):
+    """
+    Key for a cached result: the namespace followed by a SHA-256 over every part
+    Parts are input digests, model names and generation parameters; anything with
+    a stable repr() works.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return f"{namespace}-{digest.hexdigest()}"
+
+
+class ResultCache:
+    """
+    Two-tier cache of inference results
+    Results are kept in an in-process LRU of max_entries items and, when disk_dir
+    is set, pickled to disk as well. The disk tier drops its least recently used
+    files once it grows past max_disk_bytes.
+    """
+
+    def __init__(self, max_entries=256, disk_dir=None, max_disk_bytes=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, result) on a hit and (False, None) on a miss"""
+        namespace = key.split('-', 1)[0]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc('cache_lookups_total', namespace=namespace, result='memory_hit')
+                return True, self._entries[key]
+
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+            else:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._store(key, result)
+                metrics.inc('cache_lookups_total', namespace=namespace, result='disk_hit')
+                return True, result
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc('cache_lookups_total', namespace=namespace, result='miss')
+        return False, None
+
+    def put(self, key, result):
+        with self._lock:
+            self._store(key, result)
+        if self.disk_dir:
+            try:
+                self._write(key, result)
+            except Exception as e:
+                logger.warning(f"Could not write cache entry {key}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _store(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _write(self, key, result):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        path = self._path(key)
+        # Write then rename so concurrent readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_bytes += size
+            if self.max_disk_bytes is not None and self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_files(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict_disk(self):
+        """Delete the least recently used files until the disk tier fits (lock held)"""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'disk_bytes': self._disk_bytes,
+            }
+
+
+result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE, disk_dir=RESULT_CACHE_DIR,
+                           max_disk_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024))
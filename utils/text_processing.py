@@ -1,8 +1,14 @@
 import re
-import nltk
-from nltk.tokenize import sent_tokenize
+import logging
+import numpy as np
 
-nltk.download('punkt')
+logger = logging.getLogger(__name__)
+
+# Sentences are split with NLTK's punkt model when its data is installed locally
+# (`python -m nltk.downloader punkt`, or NLTK_DATA pointing at a copy); nothing is
+# downloaded at runtime. Without the data, sentences end at . ! or ? before whitespace
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_splitter = {}
 
 def clean_text(text):
     """Basic text cleaning"""
@@ -21,6 +27,128 @@ def chunk_text(text, chunk_size=1000, overlap=100):
     
     return chunks
 
+def sentence_splitter():
+    """
+    Name of the sentence splitter in use, 'punkt' or 'regex'
+    Chosen on first use: NLTK is imported only then, and punkt is only looked up
+    in the local data path.
+    """
+    if 'split' not in _splitter:
+        try:
+            import nltk
+            nltk.data.find('tokenizers/punkt')
+            from nltk.tokenize import sent_tokenize
+            _splitter.update(split=sent_tokenize, name='punkt')
+        except (ImportError, LookupError):
+            logger.warning("NLTK punkt data not found; splitting sentences at end punctuation "
+                           "(install it with: python -m nltk.downloader punkt)")
+            _splitter.update(split=lambda text: [s for s in SENTENCE_END.split(text.strip()) if s],
+                             name='regex')
+    return _splitter['name']
+
 def split_sentences(text):
     """Split text into sentences"""
-    return sent_tokenize(text)
\ No newline at end of file
+    sentence_splitter()
+    return _splitter['split'](text)
+
+def pack_token_ids(segments, max_tokens):
+    """
+    Greedily pack lists of token IDs into chunks of at most max_tokens
+    Segments are kept whole unless a single segment is longer than max_tokens
+    """
+    chunks = []
+    current = []
+    for ids in segments:
+        if current and len(current) + len(ids) > max_tokens:
+            chunks.append(current)
+            current = []
+        while len(ids) > max_tokens:
+            chunks.append(list(ids[:max_tokens]))
+            ids = ids[max_tokens:]
+        current.extend(ids)
+    if current:
+        chunks.append(current)
+    return chunks
+
+def encode_segments(segments, tokenizer):
+    """Tokenize text segments in one call, keeping the space between consecutive segments"""
+    segments = [s if i == 0 else ' ' + s for i, s in enumerate(segments)]
+    return tokenizer(segments, add_special_tokens=False)["input_ids"]
+
+def build_chunks(segments, tokenizer, max_tokens=1024):
+    """Pack tokenized segments into model inputs of at most max_tokens, special tokens included"""
+    budget = max_tokens - tokenizer.num_special_tokens_to_add(pair=False)
+    chunks = pack_token_ids(segments, budget)
+    return [tokenizer.build_inputs_with_special_tokens(chunk) for chunk in chunks]
+
+def sentence_scores(sentences, method='textrank', max_features=4096, damping=0.85,
+                    iterations=50, tol=1e-6):
+    """
+    Score sentences by how central they are to the document
+    Sentences become L2-normalized TF-IDF vectors over words that occur in at least
+    two sentences (at most max_features of them). 'tfidf' scores each sentence by its
+    similarity to the document centroid; 'textrank' runs PageRank over the cosine
+    similarity graph of the sentences.
+    Returns a NumPy array with one score per sentence.
+    """
+    if method not in ('textrank', 'tfidf'):
+        raise ValueError(f"Unknown sentence scoring method: {method}")
+    n = len(sentences)
+    if n == 0:
+        return np.zeros(0)
+
+    words = [re.findall(r"\w+", sentence.lower()) for sentence in sentences]
+    document_frequency = {}
+    for sentence_words in words:
+        for word in set(sentence_words):
+            document_frequency[word] = document_frequency.get(word, 0) + 1
+    # Words found in a single sentence link it to nothing, so they are left out
+    shared = sorted((w for w, df in document_frequency.items() if df >= 2),
+                    key=lambda w: (-document_frequency[w], w))[:max_features]
+    if not shared:
+        return np.full(n, 1.0 / n)
+    vocab = {word: column for column, word in enumerate(shared)}
+
+    rows, columns = [], []
+    for row, sentence_words in enumerate(words):
+        for word in sentence_words:
+            column = vocab.get(word)
+            if column is not None:
+                rows.append(row)
+                columns.append(column)
+    tf = np.zeros((n, len(vocab)), dtype=np.float32)
+    np.add.at(tf, (np.array(rows), np.array(columns)), 1.0)
+    df = np.array([document_frequency[word] for word in shared], dtype=np.float32)
+    vectors = tf * (np.log((1 + n) / (1 + df)) + 1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    if method == 'tfidf':
+        return vectors @ vectors.mean(axis=0)
+
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0.0)
+    out_weight = similarity.sum(axis=1, keepdims=True)
+    # Sentences without neighbours spread their rank evenly
+    transition = np.where(out_weight > 0, similarity / np.maximum(out_weight, 1e-12), 1.0 / n)
+    ranks = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1 - damping) / n + damping * (transition.T @ ranks)
+        if np.abs(updated - ranks).sum() < tol:
+            return updated
+        ranks = updated
+    return ranks
+
+def select_sentences(scores, lengths, budget):
+    """
+    Pick the highest scoring sentences whose lengths fit in budget
+    Sentences too long for the remaining budget are skipped in favour of shorter
+    ones. Returns the indices of the kept sentences in document order.
+    """
+    kept = []
+    remaining = budget
+    for index in np.argsort(-np.asarray(scores), kind='stable'):
+        if lengths[index] <= remaining:
+            kept.append(int(index))
+            remaining -= lengths[index]
+    return sorted(kept)
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from utils.resources import process_alive
+
+logger = logging.getLogger(__name__)
+
+# Only files named <sha256>.<ext> belong to a store; anything else in the folder is left alone
+STORED_NAME = re.compile(r'^[0-9a-f]{64}\.[0-9a-z]+$')
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+# Subfolder of in-use markers, <stored name>.<pid>, one per process using the file
+IN_USE_FOLDER = '.in-use'
+
+
+class UploadStore:
+    """
+    Content-addressed file store
+    Files are saved as <sha256>.<ext>, so identical uploads share one file.
+    Files in use are protected with acquire()/release(); sweep() deletes
+    unreferenced files older than max_age_seconds, then the least recently used
+    ones until the folder fits in max_bytes.
+    References are marked on disk, so a sweeper in one process (every gunicorn
+    worker runs one) leaves alone files that another process is using.
+    """
+
+    def __init__(self, root, max_age_seconds=None, max_bytes=None):
+        self.root = root
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self._refs = {}
+        self._lock = threading.Lock()
+        self._sweeper_pid = None
+
+    def path_for(self, digest, extension):
+        extension = extension.lower().lstrip('.')
+        extension = EXTENSION_ALIASES.get(extension, extension)
+        return os.path.join(self.root, f"{digest}.{extension}")
+
+    def put(self, stream, extension, block_size=1 << 20):
+        """
+        Store the contents of a file-like object
+        Returns (digest, path); when the content is already stored the existing
+        file is kept and only its last-used time is refreshed.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for block in iter(lambda: stream.read(block_size), b''):
+                    digest.update(block)
+                    tmp.write(block)
+            path = self.path_for(digest.hexdigest(), extension)
+            with self._lock:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                    os.utime(path)
+                    logger.info(f"Upload already stored as {path}")
+                else:
+                    os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest.hexdigest(), path
+
+    def lookup(self, digest, extension):
+        """Return the stored path for digest and refresh its last-used time, or None"""
+        path = self.path_for(digest, extension)
+        with self._lock:
+            if not os.path.exists(path):
+                return None
+            os.utime(path)
+        return path
+
+    def _marker_path(self, path, pid=None):
+        return os.path.join(self.root, IN_USE_FOLDER, f"{os.path.basename(path)}.{pid or os.getpid()}")
+
+    def acquire(self, path):
+        """
+        Protect a stored file from the sweeper until release() is called
+        Raises FileNotFoundError when the file was swept before it could be marked.
+        """
+        with self._lock:
+            count = self._refs.get(path, 0)
+            if count == 0:
+                marker = self._marker_path(path)
+                os.makedirs(os.path.dirname(marker), exist_ok=True)
+                open(marker, 'w').close()
+                # Another process may have swept the file between put() and the marker
+                if not os.path.exists(path):
+                    os.remove(marker)
+                    raise FileNotFoundError(f"{path} was removed before it could be used")
+            self._refs[path] = count + 1
+
+    def release(self, path):
+        with self._lock:
+            count = self._refs.get(path, 0) - 1
+            if count > 0:
+                self._refs[path] = count
+                return
+            self._refs.pop(path, None)
+            try:
+                os.remove(self._marker_path(path))
+            except FileNotFoundError:
+                pass
+
+    def _in_use(self):
+        """Names of stored files marked in use by a running process; removes markers of exited ones"""
+        names = set()
+        folder = os.path.join(self.root, IN_USE_FOLDER)
+        if not os.path.isdir(folder):
+            return names
+        for entry in os.scandir(folder):
+            name, _, pid = entry.name.rpartition('.')
+            if not pid.isdigit():
+                continue
+            if process_alive(int(pid)):
+                names.add(name)
+            else:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        return names
+
+    def sweep(self):
+        """Delete expired and excess unreferenced files; returns the number deleted"""
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        deleted = 0
+        with self._lock:
+            in_use = self._in_use()
+            files = []
+            for entry in os.scandir(self.root):
+                if entry.is_file() and STORED_NAME.match(entry.name):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            files.sort()
+
+            total = sum(size for _, size, _ in files)
+            for mtime, size, path in files:
+                if path in self._refs or os.path.basename(path) in in_use:
+                    continue
+                expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+                oversize = self.max_bytes is not None and total > self.max_bytes
+                if not (expired or oversize):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                deleted += 1
+
+        if deleted:
+            logger.info(f"Swept {deleted} files from {self.root}")
+        return deleted
+
+    def start_sweeper(self, interval_seconds=600):
+        """Run sweep() every interval_seconds in a daemon thread (once per process)"""
+        if self._sweeper_pid == os.getpid():
+            return
+        self._sweeper_pid = os.getpid()
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"Sweeping {self.root} failed: {e}")
+                time.sleep(interval_seconds)
+
+        threading.Thread(target=run, name=f"sweeper-{os.path.basename(self.root)}", daemon=True).start()